@@ -0,0 +1,107 @@
+"""
+Cold start benchmark of the transform of the view rows into the L4E inference input.
+
+    python benchmarks/inference_input.py
+
+Compares the standard library transform of the inference schedule lambda with the
+pandas transform it replaced, which the unit tests also use as its reference.
+"""
+import csv
+import datetime
+import io
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+
+BENCHMARKS_PATH = os.path.dirname(os.path.abspath(__file__))
+LAMBDA_PATH = os.path.join(BENCHMARKS_PATH, '..', 'lambda', 'inference_schedule')
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def get_inference_csv_with_pandas(result_csv):
+    """The pandas transform of the view rows, for comparison."""
+    import pandas as pd
+    inference_df = pd.read_csv(io.StringIO(result_csv))
+    inference_df['Timestamp'] = pd.to_datetime(inference_df['Timestamp'])
+    inference_df = inference_df.sort_values(by='Timestamp')
+    inference_df.ffill(axis = 0, inplace=True)
+    inference_df = inference_df.resample("T", on='Timestamp').mean()
+    inference_df = inference_df.sort_values(by='Timestamp', ascending=False).head(5).reset_index()
+    return inference_df.to_csv(index=False, date_format=TIMESTAMP_FORMAT)
+
+
+def make_result_csv(num_rows, num_properties, seed=0):
+    """Returns an Athena result CSV of view rows one second apart in random order, with missing values.
+
+    The times are unique, as rows of the same time are forward-filled in an unspecified
+    order by the unstable pandas sort.
+    """
+    rng = random.Random(seed)
+    start = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    header = ['Timestamp'] + [f'Sensor{i}' for i in range(num_properties)]
+    lines = []
+    for i in range(num_rows):
+        time = start + datetime.timedelta(seconds=i)
+        values = ['' if rng.random() < 0.3 else f'"{rng.uniform(-100, 100)!r}"' for _ in range(num_properties)]
+        lines.append(','.join([f'"{time.strftime("%Y-%m-%dT%H:%M:%S.000")}"'] + values))
+    rng.shuffle(lines)
+    return '\n'.join([','.join(f'"{column}"' for column in header)] + lines) + '\n'
+
+
+def csv_rows_match(inference_csv, pandas_csv):
+    """Returns whether the CSVs have the same rows, averages being exactly rounded where pandas
+    may differ in the last digit."""
+    rows = list(csv.reader(io.StringIO(inference_csv)))
+    pandas_rows = list(csv.reader(io.StringIO(pandas_csv)))
+    return len(rows) == len(pandas_rows) and all(
+        row[0] == pandas_row[0] and len(row) == len(pandas_row) and all(
+            value == pandas_value or math.isclose(float(value), float(pandas_value), rel_tol=1e-12)
+            for value, pandas_value in zip(row[1:], pandas_row[1:]))
+        for row, pandas_row in zip(rows, pandas_rows))
+
+
+class Body(object):
+    """The streaming body of an S3 object of data."""
+
+    def __init__(self, data):
+        self._data = data
+
+    def iter_lines(self):
+        return iter(self._data.encode('utf-8').splitlines())
+
+
+COLD_START = '''
+import sys, time
+start = time.perf_counter()
+sys.path.insert(0, {lambda_path!r})
+sys.path.insert(0, {benchmarks_path!r})
+result_csv = open({csv_path!r}).read()
+if {use_pandas!r}:
+    import inference_input
+    output = inference_input.get_inference_csv_with_pandas(result_csv)
+else:
+    import inference_data
+    from inference_input import Body
+    header, rows = inference_data.read_result_csv(Body(result_csv))
+    output = inference_data.to_csv(*inference_data.get_inference_rows(header, rows))
+seconds = time.perf_counter() - start
+# The peak resident memory of the interpreter in kB, ru_maxrss would include the parent's from before exec
+print(seconds, [line.split()[1] for line in open('/proc/self/status') if line.startswith('VmHWM')][0])
+'''
+
+
+if __name__ == '__main__':
+    # Cold start benchmark of the pandas and the standard library transforms, each in a new interpreter
+    for num_rows in (360, 3600):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as csv_file:
+            csv_file.write(make_result_csv(num_rows, 30))
+        for use_pandas in (True, False):
+            code = COLD_START.format(lambda_path=LAMBDA_PATH, benchmarks_path=BENCHMARKS_PATH,
+                                     csv_path=csv_file.name, use_pandas=use_pandas)
+            seconds, max_rss = subprocess.check_output([sys.executable, '-c', code], text=True).split()
+            print('{} rows, {}: {:.3f}s, {:.1f} MB max RSS'.format(
+                num_rows, 'pandas' if use_pandas else 'stdlib', float(seconds), int(max_rss) / 1024))
+        os.remove(csv_file.name)
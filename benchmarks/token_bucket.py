@@ -0,0 +1,72 @@
+"""
+Microbenchmark of the token bucket of the lambdas calling IoT SiteWise.
+
+    python benchmarks/token_bucket.py
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'ingest_data'))
+
+from token_bucket import TokenBucket
+
+
+def benchmark_threads(num_threads, acquisitions_per_thread):
+    bucket = TokenBucket(rate=1e9)
+    barrier = threading.Barrier(num_threads + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(acquisitions_per_thread):
+            bucket.acquire()
+
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return (time.perf_counter() - start) / (num_threads * acquisitions_per_thread)
+
+
+async def benchmark_tasks(num_tasks, acquisitions_per_task):
+    bucket = TokenBucket(rate=1e9)
+
+    async def worker():
+        for _ in range(acquisitions_per_task):
+            async with bucket:
+                pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(num_tasks)))
+    return (time.perf_counter() - start) / (num_tasks * acquisitions_per_task)
+
+
+def measure_rate(num_threads, rate, capacity, acquisitions):
+    bucket = TokenBucket(rate=rate, capacity=capacity)
+    per_thread = acquisitions // num_threads
+    threads = [threading.Thread(target=lambda: [bucket.acquire() for _ in range(per_thread)])
+               for _ in range(num_threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return (per_thread * num_threads - capacity) / elapsed
+
+
+if __name__ == '__main__':
+    # Microbenchmark of the limiter overhead under contention
+    for num_threads in (1, 4, 16, 64):
+        overhead = benchmark_threads(num_threads, 200000 // num_threads)
+        print(f'{num_threads:3d} threads: {overhead * 1e6:.2f} us per acquisition')
+    for num_tasks in (1, 64, 1024):
+        overhead = asyncio.run(benchmark_tasks(num_tasks, 200000 // num_tasks))
+        print(f'{num_tasks:4d} tasks: {overhead * 1e6:.2f} us per acquisition')
+    achieved_rate = measure_rate(num_threads=16, rate=200, capacity=20, acquisitions=480)
+    print(f'16 threads at 200/s: {achieved_rate:.1f} acquisitions per second')
@@ -0,0 +1,96 @@
+"""
+Benchmark of the transform of the Firehose records of IoT SiteWise notifications.
+
+    python benchmarks/transform_json_data.py
+
+Compares the transform lambda with a transform building a dict per row, which
+the unit tests also use as the reference of its output.
+"""
+import base64
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+LAMBDA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda', 'transform_json_data')
+
+# Value keys of SiteWise property values, by increasing precedence
+VALUE_COLUMNS = [
+    ('doubleValue', 'double', 'asset_property_double_value'),
+    ('integerValue', 'integer', 'asset_property_integer_value'),
+    ('booleanValue', 'boolean', 'asset_property_boolean_value'),
+    ('stringValue', 'string', 'asset_property_string_value'),
+]
+
+
+def transform_with_dicts(data):
+    """The transform of a record building a dict per row, for comparison."""
+    rows = []
+    try:
+        for asset_value in data['payload']['values']:
+            value_key, valuetype, column = next(
+                value_column for value_column in reversed(VALUE_COLUMNS) if value_column[0] in asset_value['value'])
+            value = asset_value['value'][value_key]
+            if valuetype == 'string':
+                value = str(value)
+            elif type(value) is float and not math.isfinite(value):
+                value = None
+            rows.append({
+                "type": data['type'],
+                "asset_id": data['payload']['assetId'],
+                "asset_property_id": data['payload']['propertyId'],
+                'time_in_seconds': asset_value['timestamp']['timeInSeconds'],
+                'offset_in_nanos': asset_value['timestamp']['offsetInNanos'],
+                'asset_property_quality': asset_value['quality'],
+                column: value,
+                'asset_property_data_type': valuetype,
+            })
+    except Exception:
+        pass
+    return '\n'.join(json.dumps(row) for row in rows)
+
+
+def make_batch(batch_size, values_per_record):
+    """Returns a Firehose event of about batch_size bytes of SiteWise notifications."""
+    records = []
+    size = 0
+    while size < batch_size:
+        i = len(records)
+        data = {
+            'type': 'PropertyValueUpdate',
+            'payload': {
+                'assetId': '1f5e8c2a-0d6b-4f3e-9a7c-{:012d}'.format(i % 2),
+                'propertyId': '7b3a9e14-5c2d-4e8f-b6a1-{:012d}'.format(i % 30),
+                'values': [{
+                    'timestamp': {'timeInSeconds': 1700000000 + i, 'offsetInNanos': j * 1000},
+                    'quality': 'GOOD',
+                    'value': {'doubleValue': 0.1 * i + j},
+                } for j in range(values_per_record)],
+            },
+        }
+        encoded = base64.b64encode(json.dumps(data).encode('utf-8')).decode('utf-8')
+        records.append({'recordId': str(i), 'data': encoded})
+        size += len(encoded)
+    return {'records': records}
+
+
+if __name__ == '__main__':
+    # Benchmark of the transform on 6 MB Firehose batches
+    sys.path.insert(0, LAMBDA_PATH)
+    from index import handler, logger
+
+    logger.setLevel(logging.WARNING)
+    for values_per_record in (1, 10):
+        event = make_batch(6 * 1024 * 1024, values_per_record)
+        start = time.perf_counter()
+        for record in event['records']:
+            data = json.loads(base64.b64decode(record['data']))
+            base64.b64encode(transform_with_dicts(data).encode('utf-8'))
+        dicts_time = time.perf_counter() - start
+        start = time.perf_counter()
+        handler(event, None)
+        handler_time = time.perf_counter() - start
+        print('{} records of {} values: dicts {:.3f}s, streaming {:.3f}s'.format(
+            len(event['records']), values_per_record, dicts_time, handler_time))
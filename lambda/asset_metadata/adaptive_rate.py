@@ -0,0 +1,88 @@
+"""
+Additive increase, multiplicative decrease control of SiteWise request rates.
+"""
+import functools
+import json
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+METRIC_NAMESPACE = 'SiteWiseMetadataExport'
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'TooManyRequestsException')
+
+
+class AimdController(object):
+    """Adapts the rate of a token bucket to the rate the account actually permits.
+
+    The rate grows by increase requests per second for every increase_interval seconds
+    of successful calls, and is multiplied by decrease_factor on throttling. Throttles
+    within a cooldown of the last decrease are attributed to the same overload and
+    don't cut the rate again.
+    """
+
+    def __init__(self, name, bucket, min_rate, max_rate, increase=1.0, decrease_factor=0.5,
+                 increase_interval=1.0, cooldown=1.0, clock=time.monotonic):
+        self.name = name
+        self.bucket = bucket
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.increase_interval = increase_interval
+        self.cooldown = cooldown
+        self._clock = clock
+        self._last_increase = clock()
+        self._last_decrease = None
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def on_success(self):
+        with self._lock:
+            now = self._clock()
+            if now - self._last_increase < self.increase_interval or self.rate >= self.max_rate:
+                return
+            self._last_increase = now
+            self.bucket.set_rate(min(self.max_rate, self.rate + self.increase))
+
+    def on_throttle(self):
+        with self._lock:
+            now = self._clock()
+            if self._last_decrease is not None and now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._last_increase = now
+            self.bucket.set_rate(max(self.min_rate, self.rate * self.decrease_factor))
+        self.emit_metric()
+
+    def track(self, f):
+        """Decorator reporting the outcome of every call to the controller."""
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            try:
+                result = f(*args, **kwargs)
+            except ClientError as e:
+                if e.response['Error']['Code'] in THROTTLING_ERROR_CODES:
+                    self.on_throttle()
+                raise
+            self.on_success()
+            return result
+        return wrapped
+
+    def emit_metric(self):
+        """Prints the current rate in CloudWatch embedded metric format."""
+        print(json.dumps({
+            '_aws': {
+                'Timestamp': int(time.time() * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRIC_NAMESPACE,
+                    'Dimensions': [['Api']],
+                    'Metrics': [{'Name': 'RequestRate', 'Unit': 'Count/Second'}],
+                }],
+            },
+            'Api': self.name,
+            'RequestRate': self.rate,
+        }))
@@ -1,16 +1,23 @@
 """
 Metadata on assets from AWS IoT SiteWise.
 """
+import io
 import json
 import logging
 import os
 import sys
 import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import boto3
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.config import Config
 from botocore.exceptions import ClientError
-from ratelimiter import RateLimiter
-from retrying import retry
+from token_bucket import TokenBucket
+from adaptive_rate import AimdController
+from retry_policy import DeadlineExceededError, RetryPolicy
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -20,35 +27,260 @@ formatter = logging.Formatter(
 stream_hanlder.setFormatter(formatter)
 logger.addHandler(stream_hanlder)
 
-s3 = boto3.client("s3")
-sitewise = boto3.client("iotsitewise")
 MAX_REQUESTS_PER_PERIOD = 20
 MAX_REQUESTS_PER_PERIOD_MODEL = 8
 PERIOD_LENGTH_IN_SECONDS = 1
 
+# Bounds of the adaptive SiteWise request rates, in requests per second
+MIN_REQUEST_RATE = 1
+MAX_REQUEST_RATE = int(os.environ.get("MAX_REQUEST_RATE", 100))
+MAX_REQUEST_RATE_MODEL = int(os.environ.get("MAX_REQUEST_RATE_MODEL", 40))
+
 STANDARD_RETRY_MAX_ATTEMPT_COUNT = 10
+# Time kept at the end of an invocation to write the snapshot and the manifest
+CHECKPOINT_MARGIN_IN_SECONDS = 30
+# Time kept at the end of an invocation after the last retry of those writes
+WRITE_MARGIN_IN_SECONDS = 5
+S3_RETRYABLE_ERROR_CODES = ('SlowDown', 'InternalError', 'ServiceUnavailable', 'RequestTimeout', '500', '503')
+
+# Workers describing assets and listing child assets, each with a connection of the
+# client pool, and assets listed ahead of the workers
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 16))
+MAX_ASSETS_IN_FLIGHT = 2 * MAX_WORKERS
+
+# Columns of the metadata snapshot, all strings
+METADATA_COLUMNS = [
+    "asset_id",
+    "asset_name",
+    "asset_model_id",
+    "asset_property_id",
+    "asset_property_name",
+    "asset_property_data_type",
+    "asset_property_unit",
+    "asset_property_alias",
+]
+MANIFEST_VERSION = 2
+SNAPSHOTS_KEPT = 2
+
+# Assets are described again regardless of their last update date this often,
+# in case a change didn't update it
+FULL_REFRESH_INTERVAL_IN_SECONDS = int(os.environ.get("FULL_REFRESH_INTERVAL_IN_SECONDS", 24 * 60 * 60))
+
+client_config = Config(max_pool_connections=MAX_WORKERS)
+s3 = boto3.client("s3", config=client_config)
+sitewise = boto3.client("iotsitewise", config=client_config)
+
+
+def create_adaptive_rate(api_name, requests_per_period, max_rate):
+    """Returns an AIMD controlled token bucket starting at requests_per_period."""
+    bucket = TokenBucket(rate=requests_per_period / PERIOD_LENGTH_IN_SECONDS,
+                         capacity=requests_per_period)
+    return AimdController(api_name, bucket, MIN_REQUEST_RATE, max_rate)
+
+describe_asset_rate = create_adaptive_rate("DescribeAsset", MAX_REQUESTS_PER_PERIOD, MAX_REQUEST_RATE)
+list_assets_rate = create_adaptive_rate("ListAssets", MAX_REQUESTS_PER_PERIOD, MAX_REQUEST_RATE)
+list_asset_models_rate = create_adaptive_rate("ListAssetModels", MAX_REQUESTS_PER_PERIOD_MODEL, MAX_REQUEST_RATE_MODEL)
+list_associated_assets_rate = create_adaptive_rate("ListAssociatedAssets", MAX_REQUESTS_PER_PERIOD, MAX_REQUEST_RATE)
+adaptive_rates = [describe_asset_rate, list_assets_rate, list_asset_models_rate, list_associated_assets_rate]
 
 
 def lambda_handler(event, context):
     bucket_name = event['bucket_name']
     key_name_prefix = event['key_name_prefix']
+    # The manifest is kept outside of the exported prefix, which is read by Glue
+    manifest_key = event.get('manifest_key', key_name_prefix + "-state/manifest.json")
+    checkpoint_key = event.get('checkpoint_key', key_name_prefix + "-state/checkpoint.json")
+    incremental = event.get('incremental', True)
+    # Assets are discovered from the root assets down their hierarchies if any are
+    # given, and only assets of the given asset models are exported
+    root_asset_ids = event.get('root_asset_ids')
+    asset_model_ids = event.get('asset_model_ids')
+
+    retry_policy.set_deadline(context, CHECKPOINT_MARGIN_IN_SECONDS)
+    # The writes of the snapshot, the manifest and the checkpoint keep retrying in the checkpoint margin
+    write_retry_policy.set_deadline(context, WRITE_MARGIN_IN_SECONDS)
+    manifest = load_manifest(bucket_name, manifest_key)
+    now = time.time()
+    # A crawl interrupted at the deadline is resumed from its checkpoint
+    checkpoint = load_checkpoint(bucket_name, checkpoint_key)
+    if checkpoint is not None:
+        crawl_id, full_refresh, position = checkpoint["crawl_id"], checkpoint["full_refresh"], checkpoint["position"]
+        logger.info("Resuming crawl %s after asset %s", crawl_id, position and position["asset_id"])
+    else:
+        crawl_id, position = str(int(now * 1000)), None
+        full_refresh = not incremental or \
+            now - manifest.get("full_refresh_at", 0) >= FULL_REFRESH_INTERVAL_IN_SECONDS
+    exported_assets = manifest["assets"]
+    assets = {}
+    # Assets in listing order that aren't finished yet, the checkpoint is the
+    # position of the last asset finished along with all assets listed before it
+    unfinished = deque()
+
+    # Listing continues on this thread while the workers describe assets,
+    # the rate limiters are shared by all threads
+    complete = True
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        if root_asset_ids:
+            asset_generator = list_hierarchy_asset_generator(executor, root_asset_ids, asset_model_ids)
+        else:
+            asset_generator = list_asset_generator(position, asset_model_ids)
+        in_flight = set()
+        try:
+            for asset_position, asset in asset_generator:
+                if retry_policy.deadline_passed():
+                    raise DeadlineExceededError("Asset listing stopped at the deadline")
+                unfinished.append((asset_position, asset["id"]))
+                exported_asset = exported_assets.get(asset["id"])
+                # Assets described earlier in the crawl are skipped when it's resumed
+                if exported_asset is not None and (exported_asset.get("crawl_id") == crawl_id or (
+                        not full_refresh and exported_asset["last_update_date"] == get_last_update_date(asset))):
+                    assets[asset["id"]] = dict(exported_asset, crawl_id=crawl_id)
+                    continue
+                if len(in_flight) >= MAX_ASSETS_IN_FLIGHT:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect_asset_records(done, assets)
+                    position = advance_position(unfinished, assets, position)
+                in_flight.add(executor.submit(describe_asset_records, asset, crawl_id))
+        except DeadlineExceededError:
+            complete = False
+        try:
+            collect_asset_records(wait(in_flight).done, assets)
+        except DeadlineExceededError:
+            complete = False
+        position = advance_position(unfinished, assets, position)
+
+    # Assets that weren't reached keep their previous records
+    assets = dict(exported_assets, **assets)
+    if complete:
+        # Assets not listed by any run of the crawl were deleted from SiteWise
+        assets = {asset_id: asset for asset_id, asset in assets.items() if asset.get("crawl_id") == crawl_id}
+    else:
+        logger.warning("Deadline reached, crawl %s checkpointed after asset %s",
+                       crawl_id, position and position["asset_id"])
 
-    for asset in list_asset_generator():
-        asset_summary = describe_asset_from_sitewise(asset["id"])
-        asset_property_list = extract_asset_property_details(
-            asset_summary, asset)
-        result = [json.dumps(record) for record in asset_property_list]
+    changed_count = sum(1 for asset_id, exported_asset in assets.items()
+                        if exported_assets.get(asset_id, {}).get("records") != exported_asset["records"])
+    removed_count = len(exported_assets.keys() - assets.keys())
+    logger.info("Exported metadata of %d assets, %d changed, %d removed",
+                len(assets), changed_count, removed_count)
 
-        key = key_name_prefix + "/" + "asset-id-" + asset["id"] + ".ndjson"
-        body = "\n".join(result)
-        # Write one file per asset
-        put_object_to_s3(bucket_name, key, body)
+    snapshot_keys = manifest.get("snapshot_keys", [])
+    if not snapshot_keys or changed_count or removed_count:
+        snapshot_key = key_name_prefix + "/snapshots/" + str(int(now * 1000)) + ".parquet"
+        put_object_to_s3(bucket_name, snapshot_key, build_snapshot(assets))
+        # The Glue table reads the snapshot listed in the symlink file, overwriting
+        # the file swaps snapshots atomically
+        put_object_to_s3(bucket_name, key_name_prefix + "/current/symlink.txt",
+                         "s3://" + bucket_name + "/" + snapshot_key + "\n")
+        snapshot_keys = snapshot_keys + [snapshot_key]
+        # Older snapshots are kept for queries planned before the swap
+        for old_snapshot_key in snapshot_keys[:-SNAPSHOTS_KEPT]:
+            delete_object_from_s3(bucket_name, old_snapshot_key)
+        snapshot_keys = snapshot_keys[-SNAPSHOTS_KEPT:]
+
+    # The manifest is saved before the checkpoint, so a resumed crawl never
+    # skips assets whose records were lost
+    save_manifest(bucket_name, manifest_key, {
+        "version": MANIFEST_VERSION,
+        "full_refresh_at": now if complete and full_refresh else manifest.get("full_refresh_at", 0),
+        "snapshot_keys": snapshot_keys,
+        "assets": assets,
+    })
+    if not complete:
+        save_checkpoint(bucket_name, checkpoint_key, {
+            "crawl_id": crawl_id,
+            "full_refresh": full_refresh,
+            "position": position,
+        })
+    elif checkpoint is not None:
+        delete_object_from_s3(bucket_name, checkpoint_key)
+
+    for adaptive_rate in adaptive_rates:
+        adaptive_rate.emit_metric()
 
     return {
         "statusCode": 200,
         "body": json.dumps("Lambda is successfully executed")
     }
 
+def advance_position(unfinished, assets, position):
+    """Returns the position of the last asset finished along with all assets listed before it."""
+    while unfinished and unfinished[0][1] in assets:
+        position, _ = unfinished.popleft()
+    return position
+
+def get_last_update_date(asset):
+    last_update_date = asset.get("lastUpdateDate")
+    return last_update_date.isoformat() if last_update_date is not None else None
+
+def describe_asset_records(asset, crawl_id):
+    """Describes an asset and returns its manifest entry keyed by its ID.
+
+    Assets discovered by describing them, the roots of hierarchy walks, carry
+    their description, which is used instead of describing them again.
+    """
+    asset_summary = asset.get("description") or describe_asset_from_sitewise(asset["id"])
+    asset_property_list = extract_asset_property_details(
+        asset_summary, asset)
+    return {asset["id"]: {
+        "last_update_date": get_last_update_date(asset),
+        "crawl_id": crawl_id,
+        "records": asset_property_list,
+    }}
+
+def collect_asset_records(futures, assets):
+    """Adds the records of finished describe calls to assets.
+
+    DeadlineExceededError is raised once the records of all other calls are added.
+    """
+    deadline_exceeded = False
+    for future in futures:
+        try:
+            assets.update(future.result())
+        except DeadlineExceededError:
+            deadline_exceeded = True
+    if deadline_exceeded:
+        raise DeadlineExceededError("Assets not described before the deadline")
+
+def build_snapshot(assets):
+    """Returns the records of all assets as Parquet, sorted by asset and property ID."""
+    records = sorted((record for asset in assets.values() for record in asset["records"]),
+                     key=lambda record: (record["asset_id"], record["asset_property_id"]))
+    table = pa.table({column: [record[column] for record in records] for column in METADATA_COLUMNS},
+                     schema=pa.schema([(column, pa.string()) for column in METADATA_COLUMNS]))
+    body = io.BytesIO()
+    pq.write_table(table, body, compression="snappy")
+    return body.getvalue()
+
+def load_manifest(bucket_name, manifest_key):
+    """Returns the state of the previous run, or an empty manifest on the first one."""
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=manifest_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return {"assets": {}}
+        raise
+    manifest = json.load(response["Body"])
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {"assets": {}}
+    return manifest
+
+def save_manifest(bucket_name, manifest_key, manifest):
+    put_object_to_s3(bucket_name, manifest_key, json.dumps(manifest))
+
+def load_checkpoint(bucket_name, checkpoint_key):
+    """Returns the checkpoint of an unfinished crawl, or None."""
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=checkpoint_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+    return json.load(response["Body"])
+
+def save_checkpoint(bucket_name, checkpoint_key, checkpoint):
+    put_object_to_s3(bucket_name, checkpoint_key, json.dumps(checkpoint))
+
 def is_retryable_error(exception):
     if isinstance(exception, ClientError):
         error_code = exception.response['Error']['Code']
@@ -56,29 +288,41 @@ def is_retryable_error(exception):
             return True
     return False
 
-@RateLimiter(max_calls=MAX_REQUESTS_PER_PERIOD,
-             period=PERIOD_LENGTH_IN_SECONDS)
-@retry(retry_on_exception=is_retryable_error,
-       stop_max_attempt_number=STANDARD_RETRY_MAX_ATTEMPT_COUNT)
+def is_retryable_s3_error(exception):
+    return isinstance(exception, ClientError) and exception.response['Error']['Code'] in S3_RETRYABLE_ERROR_CODES
+
+retry_policy = RetryPolicy(is_retryable_error, max_attempts=STANDARD_RETRY_MAX_ATTEMPT_COUNT)
+write_retry_policy = RetryPolicy(is_retryable_s3_error, max_attempts=STANDARD_RETRY_MAX_ATTEMPT_COUNT, max_delay=2.0)
+
+@retry_policy
+@retry_policy.rate_limited(describe_asset_rate.bucket)
+@describe_asset_rate.track
 def describe_asset_from_sitewise(asset_id):
     asset_summary = sitewise.describe_asset(assetId=asset_id)
     return asset_summary
 
-def list_asset_model_generator():
-    token = None
+def list_asset_model_generator(next_token=None, first_asset_model_id=None):
+    """Yields the token of the page listing each asset model, and the asset model.
+
+    Listing starts at the page of next_token, from first_asset_model_id if it's on it.
+    """
     first_execution = True
-    while first_execution or token is not None:
+    while first_execution or next_token is not None:
         first_execution = False
+        token = next_token
         asset_model_list_result = list_asset_models_from_sitewise(
             next_token=token)
-        token = asset_model_list_result.get("nextToken")
-        for asset_model in asset_model_list_result["assetModelSummaries"]:
-            yield asset_model
-
-@RateLimiter(max_calls=MAX_REQUESTS_PER_PERIOD_MODEL,
-             period=PERIOD_LENGTH_IN_SECONDS)
-@retry(retry_on_exception=is_retryable_error,
-       stop_max_attempt_number=STANDARD_RETRY_MAX_ATTEMPT_COUNT)
+        next_token = asset_model_list_result.get("nextToken")
+        asset_models = asset_model_list_result["assetModelSummaries"]
+        if first_asset_model_id is not None:
+            asset_models = summaries_from(asset_models, first_asset_model_id)
+            first_asset_model_id = None
+        for asset_model in asset_models:
+            yield token, asset_model
+
+@retry_policy
+@retry_policy.rate_limited(list_asset_models_rate.bucket)
+@list_asset_models_rate.track
 def list_asset_models_from_sitewise(next_token=None):
     if next_token is None:
         asset_model_lists_summary = sitewise.list_asset_models(maxResults=250)
@@ -86,21 +330,117 @@ def list_asset_models_from_sitewise(next_token=None):
         asset_model_lists_summary = sitewise.list_asset_models(nextToken=next_token, maxResults=250)
     return asset_model_lists_summary
 
-def list_asset_generator():
-    for asset_model in list_asset_model_generator():
-        token = None
+def list_asset_generator(position=None, asset_model_ids=None):
+    """Yields the listing position of each asset, and the asset.
+
+    A position holds the pagination tokens of the asset model and asset pages
+    listing the asset, and the IDs of its asset model and of the asset itself.
+    Listing resumes after the asset at position, and is limited to the assets
+    of asset_model_ids if given.
+    """
+    resume = position or {}
+    for asset_model_token, asset_model in list_asset_model_generator(
+            resume.get("asset_model_token"), resume.get("asset_model_id")):
+        if asset_model_ids is not None and asset_model["id"] not in asset_model_ids:
+            continue
+        if resume.get("asset_model_id") == asset_model["id"]:
+            token, after_asset_id = resume["asset_token"], resume["asset_id"]
+        else:
+            token, after_asset_id = None, None
+        resume = {}
         first_execution = True
         while first_execution or token is not None:
             first_execution = False
-            asset_list_result = list_assets_from_sitewise(asset_model["id"], next_token=token)
+            asset_token = token
+            asset_list_result = list_assets_from_sitewise(asset_model["id"], next_token=asset_token)
             token = asset_list_result.get("nextToken")
-            for asset in asset_list_result["assetSummaries"]:
-                yield asset
+            assets = asset_list_result["assetSummaries"]
+            if after_asset_id is not None:
+                assets = summaries_from(assets, after_asset_id, after=True)
+                after_asset_id = None
+            for asset in assets:
+                yield {
+                    "asset_model_token": asset_model_token,
+                    "asset_model_id": asset_model["id"],
+                    "asset_token": asset_token,
+                    "asset_id": asset["id"],
+                }, asset
+
+def list_hierarchy_asset_generator(executor, root_asset_ids, asset_model_ids=None):
+    """Yields the root assets and their descendants, limited to asset_model_ids if given.
+
+    The child assets of every hierarchy are listed concurrently on executor, the
+    one describing the assets, so all workers fit in the connection pool. A hierarchy
+    walk can't be resumed from a position, so None is yielded as the position of
+    every asset.
+    """
+    pending = deque(get_asset_summary(describe_asset_from_sitewise(asset_id)) for asset_id in root_asset_ids)
+    visited = set()
+    in_flight = set()
+    while pending or in_flight:
+        while pending:
+            asset = pending.popleft()
+            if asset["id"] in visited:
+                continue
+            visited.add(asset["id"])
+            for hierarchy in asset.get("hierarchies", []):
+                in_flight.add(executor.submit(list_child_assets, asset["id"], hierarchy["id"]))
+            if asset_model_ids is None or asset["assetModelId"] in asset_model_ids:
+                yield None, asset
+        if in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.extend(future.result())
+
+def get_asset_summary(asset_description):
+    """Returns a DescribeAsset response in the shape of the summaries of listed assets, along with the response."""
+    return {
+        "description": asset_description,
+        "id": asset_description["assetId"],
+        "name": asset_description["assetName"],
+        "assetModelId": asset_description["assetModelId"],
+        "lastUpdateDate": asset_description.get("assetLastUpdateDate"),
+        "hierarchies": [{"id": hierarchy["id"], "name": hierarchy["name"]}
+                        for hierarchy in asset_description.get("assetHierarchies", [])],
+    }
 
-@RateLimiter(max_calls=MAX_REQUESTS_PER_PERIOD,
-             period=PERIOD_LENGTH_IN_SECONDS)
-@retry(retry_on_exception=is_retryable_error,
-       stop_max_attempt_number=STANDARD_RETRY_MAX_ATTEMPT_COUNT)
+def list_child_assets(asset_id, hierarchy_id):
+    child_assets = []
+    token = None
+    first_execution = True
+    while first_execution or token is not None:
+        first_execution = False
+        asset_list_result = list_associated_assets_from_sitewise(asset_id, hierarchy_id, next_token=token)
+        token = asset_list_result.get("nextToken")
+        child_assets.extend(asset_list_result["assetSummaries"])
+    return child_assets
+
+@retry_policy
+@retry_policy.rate_limited(list_associated_assets_rate.bucket)
+@list_associated_assets_rate.track
+def list_associated_assets_from_sitewise(asset_id, hierarchy_id, next_token=None):
+    if next_token is None:
+        asset_lists_summary = sitewise.list_associated_assets(
+            assetId=asset_id, hierarchyId=hierarchy_id, traversalDirection="CHILD", maxResults=250)
+    else:
+        asset_lists_summary = sitewise.list_associated_assets(
+            assetId=asset_id, hierarchyId=hierarchy_id, traversalDirection="CHILD",
+            nextToken=next_token, maxResults=250)
+    return asset_lists_summary
+
+def summaries_from(summaries, summary_id, after=False):
+    """Returns the summaries from the one with ID summary_id, or after it.
+
+    All summaries are returned if summary_id isn't listed, e.g. after it was deleted.
+    """
+    ids = [summary["id"] for summary in summaries]
+    if summary_id not in ids:
+        return summaries
+    return summaries[ids.index(summary_id) + (1 if after else 0):]
+
+@retry_policy
+@retry_policy.rate_limited(list_assets_rate.bucket)
+@list_assets_rate.track
 def list_assets_from_sitewise(asset_model_id, next_token=None):
     if next_token is None:
         asset_lists_summary = sitewise.list_assets(
@@ -109,13 +449,14 @@ def list_assets_from_sitewise(asset_model_id, next_token=None):
         asset_lists_summary = sitewise.list_assets(assetModelId=asset_model_id, nextToken=next_token, maxResults=250)
     return asset_lists_summary
 
-@RateLimiter(max_calls=MAX_REQUESTS_PER_PERIOD,
-             period=PERIOD_LENGTH_IN_SECONDS)
-@retry(retry_on_exception=is_retryable_error,
-       stop_max_attempt_number=STANDARD_RETRY_MAX_ATTEMPT_COUNT)
+@write_retry_policy
 def put_object_to_s3(bucket, key, body):
     s3.put_object(Bucket=bucket, Key=key, Body=body)
 
+@write_retry_policy
+def delete_object_from_s3(bucket, key):
+    s3.delete_object(Bucket=bucket, Key=key)
+
 def extract_asset_property_details(asset_summary, asset):
     asset_property_list = []
     for asset_property in asset_summary["assetProperties"]:
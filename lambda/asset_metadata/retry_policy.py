@@ -0,0 +1,72 @@
+"""
+Retries with exponential backoff and full jitter, bounded by the time left in the invocation.
+"""
+import functools
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceededError(Exception):
+    """Raised instead of retrying when the backoff would run past the deadline."""
+
+
+class RetryPolicy(object):
+    """Retries calls failing with a retryable exception until a deadline.
+
+    The first attempt of a call is always made, so work started before the deadline
+    can still be saved. Later attempts wait a random delay of up to
+    base_delay * 2 ** attempt seconds, capped at max_delay, and are given up with
+    DeadlineExceededError when the wait would end after the deadline.
+    """
+
+    def __init__(self, retry_on_exception, max_attempts=10, base_delay=0.1, max_delay=10.0,
+                 clock=time.monotonic):
+        self.retry_on_exception = retry_on_exception
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clock = clock
+        self.deadline = None
+
+    def set_deadline(self, context, margin_in_seconds):
+        """Stops retrying margin_in_seconds before the lambda invocation of context times out."""
+        self.deadline = self._clock() + context.get_remaining_time_in_millis() / 1000 - margin_in_seconds
+
+    def deadline_passed(self):
+        return self.deadline is not None and self._clock() >= self.deadline
+
+    def get_backoff_delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def rate_limited(self, bucket):
+        """Decorator taking a token of bucket before every call, unless it comes after the deadline."""
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapped(*args, **kwargs):
+                timeout = None if self.deadline is None else max(0.0, self.deadline - self._clock())
+                if not bucket.acquire(timeout=timeout):
+                    raise DeadlineExceededError(f'{f.__name__} not rate limited before the deadline')
+                return f(*args, **kwargs)
+            return wrapped
+        return decorator
+
+    def __call__(self, f):
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            attempt = 0
+            while True:
+                try:
+                    return f(*args, **kwargs)
+                except Exception as e:
+                    attempt += 1
+                    if attempt >= self.max_attempts or not self.retry_on_exception(e):
+                        raise
+                    delay = self.get_backoff_delay(attempt)
+                    if self.deadline is not None and self._clock() + delay >= self.deadline:
+                        raise DeadlineExceededError(f'{f.__name__} not retried past the deadline') from e
+                    logger.warning('Retrying %s in %.2fs after %r', f.__name__, delay, e)
+                    time.sleep(delay)
+        return wrapped
@@ -0,0 +1,106 @@
+"""
+Token bucket rate limiting for threads and asyncio tasks.
+
+Shared by the lambdas calling IoT SiteWise, keep the copies identical.
+"""
+import asyncio
+import functools
+import threading
+import time
+
+
+class TokenBucket(object):
+    """Allows rate operations per second on average, with bursts of up to capacity operations.
+
+    Callers reserve their token under a short lock and sleep outside of it, so waiting
+    callers don't hold each other up and are served in the order they arrived. The bucket
+    can be used as a decorator of functions or coroutine functions, with `with` and with
+    `async with`.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        if rate <= 0:
+            raise ValueError('Token bucket rate should be > 0')
+        if capacity is None:
+            capacity = max(rate, 1)
+        if capacity < 1:
+            raise ValueError('Token bucket capacity should be >= 1')
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate, capacity=None):
+        """Changes the rate, and the capacity which defaults to one second worth of tokens."""
+        if rate <= 0:
+            raise ValueError('Token bucket rate should be > 0')
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            self.capacity = max(rate, 1) if capacity is None else capacity
+            self._tokens = min(self._tokens, self.capacity)
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _reserve(self, tokens, timeout=None):
+        """Takes tokens from the bucket and returns the seconds until they are available.
+
+        The token count goes negative while callers wait, which queues later callers
+        behind them. Returns None without taking tokens if they wouldn't be available
+        within timeout seconds.
+        """
+        with self._lock:
+            self._refill()
+            delay = max(0.0, tokens - self._tokens) / self.rate
+            if timeout is not None and delay > timeout:
+                return None
+            self._tokens -= tokens
+            return delay
+
+    def acquire(self, tokens=1, timeout=None):
+        """Waits for tokens, returns False if they wouldn't be available within timeout seconds."""
+        delay = self._reserve(tokens, timeout)
+        if delay is None:
+            return False
+        if delay > 0:
+            time.sleep(delay)
+        return True
+
+    async def acquire_async(self, tokens=1):
+        delay = self._reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def __call__(self, f):
+        if asyncio.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def async_wrapped(*args, **kwargs):
+                await self.acquire_async()
+                return await f(*args, **kwargs)
+            return async_wrapped
+
+        @functools.wraps(f)
+        def wrapped(*args, **kwargs):
+            self.acquire()
+            return f(*args, **kwargs)
+        return wrapped
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+    async def __aenter__(self):
+        await self.acquire_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
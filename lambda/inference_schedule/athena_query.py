@@ -0,0 +1,96 @@
+"""
+Waits for Athena query executions, polling with backoff until a deadline.
+"""
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+METRIC_NAMESPACE = 'L4EInferenceSchedule'
+DONE_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+
+
+class QueryFailedError(Exception):
+    """Raised when a query execution ends FAILED or CANCELLED."""
+
+    def __init__(self, query_execution_id, state, reason):
+        super().__init__(f'Query {query_execution_id} {state}: {reason}')
+        self.query_execution_id = query_execution_id
+        self.state = state
+        self.reason = reason
+
+
+class QueryTimeoutError(Exception):
+    """Raised when a query execution is still running at the deadline, and was stopped."""
+
+
+class AthenaQuery(object):
+    """Runs Athena queries and waits for them to complete.
+
+    The state of an execution is polled every base_delay seconds at first, growing by
+    backoff_factor up to max_delay, so short queries are picked up soon after they
+    complete and long ones don't spend the request rate.
+    """
+
+    def __init__(self, client, base_delay=0.2, max_delay=2.0, backoff_factor=1.5, clock=time.monotonic):
+        self.client = client
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.backoff_factor = backoff_factor
+        self._clock = clock
+
+    def run(self, deadline=None, **kwargs):
+        """Starts a query with the start_query_execution arguments and waits for it."""
+        query_execution_id = self.client.start_query_execution(**kwargs)['QueryExecutionId']
+        logger.info('Query Start: %s', query_execution_id)
+        return self.wait(query_execution_id, deadline)
+
+    def wait(self, query_execution_id, deadline=None):
+        """Returns the QueryExecution of a query once it succeeded.
+
+        Raises QueryFailedError when it failed or was cancelled, and QueryTimeoutError
+        when it is still running at the deadline, a time of the clock, after stopping it.
+        """
+        delay = self.base_delay
+        while True:
+            execution = self.client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+            status = execution['Status']
+            if status['State'] in DONE_STATES:
+                break
+            if deadline is not None and self._clock() + delay >= deadline:
+                # Stopped so it doesn't keep scanning data no one will read
+                self.client.stop_query_execution(QueryExecutionId=query_execution_id)
+                raise QueryTimeoutError(f'Query {query_execution_id} still {status["State"]} at the deadline')
+            time.sleep(delay)
+            delay = min(self.max_delay, delay * self.backoff_factor)
+
+        emit_statistics(execution)
+        if status['State'] != 'SUCCEEDED':
+            raise QueryFailedError(query_execution_id, status['State'], status.get('StateChangeReason', ''))
+        return execution
+
+
+def emit_statistics(execution):
+    """Prints the queue time, execution time and bytes scanned of a query in CloudWatch embedded metric format."""
+    statistics = execution.get('Statistics', {})
+    print(json.dumps({
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRIC_NAMESPACE,
+                'Dimensions': [['WorkGroup', 'State']],
+                'Metrics': [
+                    {'Name': 'QueryQueueTime', 'Unit': 'Milliseconds'},
+                    {'Name': 'QueryExecutionTime', 'Unit': 'Milliseconds'},
+                    {'Name': 'QueryDataScanned', 'Unit': 'Bytes'},
+                ],
+            }],
+        },
+        'WorkGroup': execution.get('WorkGroup', ''),
+        'State': execution['Status']['State'],
+        'QueryExecutionId': execution['QueryExecutionId'],
+        'QueryQueueTime': statistics.get('QueryQueueTimeInMillis', 0),
+        'QueryExecutionTime': statistics.get('EngineExecutionTimeInMillis', 0),
+        'QueryDataScanned': statistics.get('DataScannedInBytes', 0),
+    }))
@@ -0,0 +1,117 @@
+"""
+Builds the L4E inference input from the Athena result CSV of a view, with the standard library.
+
+The rows are forward-filled in time order, averaged per minute and the last minutes
+kept, like the pandas ffill, resample("T").mean() and head of the view rows. Windows
+of rows newer than a watermark are handled the same, the forward fill carrying over
+from the previous window.
+"""
+import codecs
+import csv
+import datetime
+import io
+import math
+
+TIMESTAMP_COLUMN = 'Timestamp'
+ASSET_ID_COLUMN = 'asset_id'
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+ONE_MINUTE = datetime.timedelta(minutes=1)
+
+
+def read_result_csv(body):
+    """Returns the header and an iterator of the rows of an Athena result CSV streamed from S3."""
+    reader = csv.reader(codecs.iterdecode(body.iter_lines(), 'utf-8'))
+    return next(reader, []), reader
+
+
+def split_by_asset(header, rows):
+    """Returns the header without the asset_id column and the rows of each asset without it."""
+    asset_id_index = header.index(ASSET_ID_COLUMN)
+    asset_rows = {}
+    for row in rows:
+        asset_id = row.pop(asset_id_index)
+        asset_rows.setdefault(asset_id, []).append(row)
+    return header[:asset_id_index] + header[asset_id_index + 1:], asset_rows
+
+
+def get_inference_rows(header, rows, minutes=5):
+    """Returns the header and the rows of the last minutes of rows, latest first.
+
+    Empty values are filled with the previous value of their column, then the values
+    of every minute from the first to the last one are averaged, minutes without rows
+    giving empty values.
+    """
+    timestamp_index = header.index(TIMESTAMP_COLUMN)
+    rows_by_time = sort_by_time(rows, timestamp_index)
+    if not rows_by_time:
+        return get_minute_rows(header, rows_by_time, None, None)[:2]
+    first_minute = truncate_to_minute(rows_by_time[0][0])
+    last_minute = truncate_to_minute(rows_by_time[-1][0])
+    oldest_minute = max(first_minute, last_minute - (minutes - 1) * ONE_MINUTE)
+    return get_minute_rows(header, rows_by_time, oldest_minute, last_minute)[:2]
+
+
+def get_window_rows(header, rows, first_minute, last_minute, last_values=None):
+    """Returns the header, the rows of the minutes from first_minute to last_minute, latest first,
+    and the filled values of the columns at the end of last_minute.
+
+    last_values are the filled values of the columns before the rows, by column name,
+    which carries the forward fill over from the previous window.
+    """
+    timestamp_index = header.index(TIMESTAMP_COLUMN)
+    return get_minute_rows(header, sort_by_time(rows, timestamp_index), first_minute, last_minute, last_values)
+
+
+def sort_by_time(rows, timestamp_index):
+    """Returns the rows with their time in time order, keeping the order of rows of the same time."""
+    return sorted(
+        ((datetime.datetime.fromisoformat(row[timestamp_index]), row) for row in rows),
+        key=lambda time_and_row: time_and_row[0]
+    )
+
+
+def get_minute_rows(header, rows_by_time, first_minute, last_minute, last_values=None):
+    timestamp_index = header.index(TIMESTAMP_COLUMN)
+    value_columns = [i for i in range(len(header)) if i != timestamp_index]
+    output_header = [TIMESTAMP_COLUMN] + [header[i] for i in value_columns]
+    last_values = [(last_values or {}).get(header[i]) for i in value_columns]
+    # The values of each column of each of the kept minutes
+    buckets = {}
+    for time, row in rows_by_time:
+        minute = truncate_to_minute(time)
+        if minute > last_minute:
+            break
+        for column, i in enumerate(value_columns):
+            if row[i] != '':
+                last_values[column] = float(row[i])
+        if minute < first_minute:
+            continue
+        bucket = buckets.get(minute)
+        if bucket is None:
+            bucket = buckets[minute] = [[] for _ in value_columns]
+        for column, value in enumerate(last_values):
+            if value is not None:
+                bucket[column].append(value)
+
+    output_rows = []
+    minute = last_minute
+    while minute is not None and minute >= first_minute:
+        bucket = buckets.get(minute) or [[] for _ in value_columns]
+        output_rows.append([minute] + [math.fsum(values) / len(values) if values else None for values in bucket])
+        minute -= ONE_MINUTE
+    filled_values = {output_header[column + 1]: value for column, value in enumerate(last_values) if value is not None}
+    return output_header, output_rows, filled_values
+
+
+def truncate_to_minute(time):
+    return time.replace(second=0, microsecond=0)
+
+
+def to_csv(header, rows):
+    """Returns the CSV of the rows, in the format of the pandas to_csv of the inference input."""
+    with io.StringIO() as csv_buffer:
+        writer = csv.writer(csv_buffer, lineterminator='\n')
+        writer.writerow(header)
+        for row in rows:
+            writer.writerow([row[0].strftime(TIMESTAMP_FORMAT)] + ['' if value is None else value for value in row[1:]])
+        return csv_buffer.getvalue()
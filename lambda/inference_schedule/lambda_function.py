@@ -13,87 +13,233 @@
 # limitations under the License.
 #author Julia Hu
 from __future__ import print_function
-import io
 import os
 import sys
 import time
+import calendar
 import csv
 import datetime
+import hashlib
+import string
 import boto3
 import logging
-import pandas as pd
+from athena_query import AthenaQuery
+import inference_data
+from watermark_store import LocalWatermarkStore, S3WatermarkStore
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Seconds left to write the inference input after the query
+DEADLINE_MARGIN_IN_SECONDS = 20
+# Minutes in the inference input
+INFERENCE_MINUTES = 5
+# Minutes after their end before minutes are written, data arriving later is dropped. Data
+# spends up to a minute in the Firehose buffer of the transform lambda and another in the
+# buffer of the S3 destination, plus the time to transform, convert and write it
+GRACE_PERIOD_IN_MINUTES = 5
+# Most minutes written at once for an asset whose watermark fell behind
+MAX_WINDOW_IN_MINUTES = 60
+# A notification is filed under the hour of its first value. Its values span less than the
+# 60 second Firehose buffering interval of the transform lambda, so windows starting within
+# it of the hour also read the previous hour, like the views
+PARTITION_LOOKBACK = datetime.timedelta(seconds=60)
+WATERMARK_KEY = 'inference-state/watermarks.json'
+# Prefix of the hashes of the named queries the views were created with
+VIEW_QUERY_HASH_PREFIX = 'inference-state/views/'
+
 def lambda_handler(event, context):
+    """Writes the last minutes of data of assets to their L4E inference input.
+
+    The event either names the view of one asset with assetId, asset_name and
+    l4e_bucket, or, in fleet mode, the view of all the assets with an asset_id
+    column and an assets list of their assetId, asset_name and l4e_bucket. A
+    fleet runs a single Athena query per tick, whose result is split per asset.
+    With a window_query_id, the assets get the minutes since their watermark instead
+    of the last minutes of the view.
+    """
     logger.info('Received event: %s', event)
-    asset_name = event['asset_name']
     client = boto3.client('athena')
+    athena_query = AthenaQuery(client)
+    deadline = get_deadline(context)
     s3_url = 's3://' + event['athena_output_bucket'] + '/athenaquery/'
+    if 'window_query_id' in event:
+        return write_window_inference_input(event, client, athena_query, deadline, s3_url)
     ################First to see if the view exists or not, if not run the named query to create the view**************************
-    response = client.list_query_executions(MaxResults=1,WorkGroup=event['work_group'])
-    logger.info('List Query Executions: %s', response['QueryExecutionIds'])
-
     get_query_response = client.get_named_query(NamedQueryId=event['view_query_id'])
     database = event['database']
-    if len(response['QueryExecutionIds']) == 0:
-       querystr_4_view = get_query_response['NamedQuery']['QueryString']
-       executionResponse = client.start_query_execution(QueryString=querystr_4_view,QueryExecutionContext = {'Database': database, 'Catalog': 'AwsDataCatalog'},ResultConfiguration = {'OutputLocation': s3_url})
-       logger.info('Create View: %s', executionResponse)
-    else:
-       pass
-    ########################run query to gather data#####################################
     query_name = get_query_response["NamedQuery"]["Name"]
+    querystr_4_view = get_query_response['NamedQuery']['QueryString']
+    ##The view is looked up in the catalog, a view added to a workgroup that already ran queries is created too,
+    ##and it is created again when its named query changed since it was created
+    view_query_hash = get_query_hash(querystr_4_view)
+    view_query_hash_key = VIEW_QUERY_HASH_PREFIX + query_name + '.sha256'
+    if get_view_query_hash(event['athena_output_bucket'], view_query_hash_key) != view_query_hash or not view_exists(database, query_name):
+       executionResponse = athena_query.run(deadline, QueryString=querystr_4_view,QueryExecutionContext = {'Database': database, 'Catalog': 'AwsDataCatalog'},ResultConfiguration = {'OutputLocation': s3_url})
+       logger.info('Create View: %s', executionResponse['Status'])
+       boto3.client('s3').put_object(Bucket=event['athena_output_bucket'], Key=view_query_hash_key, Body=view_query_hash)
+    ########################run query to gather data#####################################
     logger.info('Named Query: %s', query_name)
     query = f'SELECT * FROM {database}.{query_name}'
     logger.info('Query: %s', query)
-    queryStart = client.start_query_execution(QueryString=query,QueryExecutionContext = {'Database': database, 'Catalog': 'AwsDataCatalog'},ResultConfiguration = {'OutputLocation': s3_url})
-    logger.info('Query Start: %s', queryStart)
-    
-    status = int(queryStart["ResponseMetadata"]["HTTPStatusCode"])
-    if status == 200:
-        print("Query Success")
-    else:
-        print("Query Failed")
-        
-    #executes query and waits 3 seconds
-    queryId = queryStart["QueryExecutionId"]
-    
-    time.sleep(10)
-    #copies newly generated csv file with appropriate name
-    
+    ##Waits for the query to complete, raises if it failed or is still running close to the lambda timeout
+    execution = athena_query.run(deadline, QueryString=query,QueryExecutionContext = {'Database': database, 'Catalog': 'AwsDataCatalog'},ResultConfiguration = {'OutputLocation': s3_url})
+    print("Query Success")
+    result_bucket, result_key = execution['ResultConfiguration']['OutputLocation'][len('s3://'):].split('/', 1)
+
     c_timestamp = (datetime.datetime.now()- datetime.timedelta(minutes=6)).strftime("%Y%m%d%H%M" + "00")   
     print(c_timestamp)
     
-    response = boto3.client('s3').get_object(Bucket=event['athena_output_bucket'], Key='athenaquery/'+ queryId+'.csv')
+    response = boto3.client('s3').get_object(Bucket=result_bucket, Key=result_key)
     status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
     if status == 200:
-        inference_df = pd.read_csv(response.get("Body"))
-        inference_df['Timestamp'] = pd.to_datetime(inference_df['Timestamp'])
-        inference_df = inference_df.sort_values(by='Timestamp')
-        ##First fill in empty values from previous cell, then aggregate to minute, sort by descending order, then select top five
-        inference_df.ffill(axis = 0, inplace=True)
-        inference_df = inference_df.resample("T", on='Timestamp').mean()
-        inference_df = inference_df.sort_values(by='Timestamp', ascending=False).head(5).reset_index()
-        print(inference_df)
+        header, rows = inference_data.read_result_csv(response.get("Body"))
+        if 'assets' in event:
+            ##Split the fleet result per asset, each asset gets its own input file
+            header, asset_rows = inference_data.split_by_asset(header, rows)
+            for asset in event['assets']:
+                if asset['assetId'] not in asset_rows:
+                    logger.warning('No data for asset %s', asset['assetId'])
+                    continue
+                inference_csv = get_inference_csv(header, asset_rows[asset['assetId']])
+                write_inference_input(inference_csv, asset['l4e_bucket'], asset['assetId'], asset['asset_name'], c_timestamp)
+        else:
+            inference_csv = get_inference_csv(header, rows)
+            write_inference_input(inference_csv, event['l4e_bucket'], event['assetId'], event['asset_name'], c_timestamp)
     else:
         print(f"Unsuccessful S3 get_object response. Status - {status}")
-    ########################################write csv to inference scheduler**************************  
-    with io.StringIO() as csv_buffer:
-        inference_df.to_csv(csv_buffer, index=False, date_format='%Y-%m-%dT%H:%M:%S.%f')                            
-        response = boto3.client('s3').put_object(Bucket=event['l4e_bucket'], Key=event['assetId']+'/inference-data/input/'+asset_name+'_'+ c_timestamp+'.csv', Body=csv_buffer.getvalue())
-        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
-        if status == 200:
-            print(f"Successful S3 put_object response. Status - {status}")
-        else:
-            print(f"Unsuccessful S3 put_object response. Status - {status}")
     
-    response = boto3.client('s3').delete_object(Bucket=event['athena_output_bucket'],Key='athenaquery/'+ queryId+'.csv')
+    response = boto3.client('s3').delete_object(Bucket=result_bucket,Key=result_key)
     print(response)  
     
-    response_meta = boto3.client('s3').delete_object(Bucket=event['athena_output_bucket'], Key='athenaquery/'+ queryId+'.csv.metadata')
+    response_meta = boto3.client('s3').delete_object(Bucket=result_bucket, Key=result_key+'.metadata')
     print(response_meta)
 
+def write_window_inference_input(event, client, athena_query, deadline, s3_url):
+    """Writes the minutes closed since the watermark of the assets to their L4E inference input.
+
+    A minute is closed grace_period_in_minutes after its end, so data arriving late
+    within the grace period is included. Only the data of the minutes since the oldest
+    watermark is queried, with the window query template of the named query.
+    """
+    assets = event.get('assets') or [{'assetId': event['assetId'], 'asset_name': event['asset_name'], 'l4e_bucket': event['l4e_bucket']}]
+    grace_period = datetime.timedelta(minutes=event.get('grace_period_in_minutes', GRACE_PERIOD_IN_MINUTES))
+    last_minute = get_last_minute(datetime.datetime.utcnow(), grace_period)
+    watermark_store = get_watermark_store(event)
+    watermarks = watermark_store.load()
+    first_minutes = {}
+    for asset in assets:
+        first_minute = get_first_minute(watermarks.get(asset['assetId']), last_minute)
+        if first_minute <= last_minute:
+            first_minutes[asset['assetId']] = first_minute
+    if not first_minutes:
+        logger.info('No minute closed since the watermarks')
+        return
+
+    window_start = min(first_minutes.values())
+    window_end = last_minute + inference_data.ONE_MINUTE
+    query_template = client.get_named_query(NamedQueryId=event['window_query_id'])['NamedQuery']['QueryString']
+    query = string.Template(query_template).substitute(
+        partitions_predicate=get_partitions_predicate(window_start, window_end),
+        window_start=calendar.timegm(window_start.timetuple()),
+        window_end=calendar.timegm(window_end.timetuple()),
+    )
+    logger.info('Query: %s', query)
+    execution = athena_query.run(deadline, QueryString=query,QueryExecutionContext = {'Database': event['database'], 'Catalog': 'AwsDataCatalog'},ResultConfiguration = {'OutputLocation': s3_url})
+    result_bucket, result_key = execution['ResultConfiguration']['OutputLocation'][len('s3://'):].split('/', 1)
+
+    response = boto3.client('s3').get_object(Bucket=result_bucket, Key=result_key)
+    header, asset_rows = inference_data.split_by_asset(*inference_data.read_result_csv(response['Body']))
+    for asset in assets:
+        asset_id = asset['assetId']
+        if asset_id not in first_minutes:
+            continue
+        watermark = watermarks.get(asset_id, {})
+        output_header, output_rows, filled_values = inference_data.get_window_rows(
+            header, asset_rows.get(asset_id, []), first_minutes[asset_id], last_minute, watermark.get('values'))
+        ##The minutes are closed, without data they are skipped for good
+        if asset_id in asset_rows:
+            c_timestamp = first_minutes[asset_id].strftime("%Y%m%d%H%M" + "00")
+            write_inference_input(inference_data.to_csv(output_header, output_rows), asset['l4e_bucket'], asset_id, asset['asset_name'], c_timestamp)
+        else:
+            logger.warning('No data for asset %s', asset_id)
+        watermarks[asset_id] = {'minute': calendar.timegm(last_minute.timetuple()), 'values': filled_values}
+    watermark_store.save(watermarks)
+
+    boto3.client('s3').delete_object(Bucket=result_bucket, Key=result_key)
+    boto3.client('s3').delete_object(Bucket=result_bucket, Key=result_key+'.metadata')
+
+def get_last_minute(now, grace_period):
+    """Returns the last minute closed at now, the last one that ended at least grace_period ago."""
+    return inference_data.truncate_to_minute(now - grace_period) - inference_data.ONE_MINUTE
+
+def get_first_minute(watermark, last_minute):
+    """Returns the first minute to write of an asset, the minute after its watermark."""
+    oldest_minute = last_minute - (MAX_WINDOW_IN_MINUTES - 1) * inference_data.ONE_MINUTE
+    if not watermark:
+        return last_minute - (INFERENCE_MINUTES - 1) * inference_data.ONE_MINUTE
+    watermark_minute = datetime.datetime.utcfromtimestamp(watermark['minute'])
+    return max(oldest_minute, watermark_minute + inference_data.ONE_MINUTE)
+
+def get_partitions_predicate(window_start, window_end):
+    """Returns the predicate of the dt and hour partitions holding the data from window_start to window_end.
+
+    The previous hour is included when window_start is close enough to the hour for its
+    first values to be in notifications filed under the previous hour.
+    """
+    partitions = []
+    hour = (window_start - PARTITION_LOOKBACK).replace(minute=0, second=0, microsecond=0)
+    while hour < window_end:
+        partitions.append(f'''(("data"."dt" = '{hour:%Y-%m-%d}') AND ("data"."hour" = {hour.hour}))''')
+        hour += datetime.timedelta(hours=1)
+    return ' OR '.join(partitions)
+
+def get_watermark_store(event):
+    if 'watermark_file' in event:
+        return LocalWatermarkStore(event['watermark_file'])
+    return S3WatermarkStore(boto3.client('s3'), event['athena_output_bucket'], event.get('watermark_key', WATERMARK_KEY))
+
+def get_deadline(context):
+    """Returns the time.monotonic time to give up waiting for queries, before the lambda times out."""
+    if context is None:
+        return None
+    return time.monotonic() + context.get_remaining_time_in_millis() / 1000 - DEADLINE_MARGIN_IN_SECONDS
+
+def view_exists(database, view_name):
+    glue = boto3.client('glue')
+    try:
+        glue.get_table(DatabaseName=database, Name=view_name)
+    except glue.exceptions.EntityNotFoundException:
+        return False
+    return True
+
+def get_query_hash(query_string):
+    return hashlib.sha256(query_string.encode('utf-8')).hexdigest()
+
+def get_view_query_hash(bucket, key):
+    """Returns the hash of the named query the view was last created with, None if it is unknown."""
+    s3 = boto3.client('s3')
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return None
+    return response['Body'].read().decode('utf-8')
+
+def get_inference_csv(header, rows):
+    """Returns the CSV of the last five minutes of the view rows of an asset, one row per minute."""
+    ##First fill in empty values from previous cell, then aggregate to minute, sort by descending order, then select top five
+    inference_csv = inference_data.to_csv(*inference_data.get_inference_rows(header, rows, minutes=5))
+    print(inference_csv)
+    return inference_csv
+
+def write_inference_input(inference_csv, l4e_bucket, asset_id, asset_name, c_timestamp):
+    ########################################write csv to inference scheduler**************************  
+    response = boto3.client('s3').put_object(Bucket=l4e_bucket, Key=asset_id+'/inference-data/input/'+asset_name+'_'+ c_timestamp+'.csv', Body=inference_csv)
+    status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    if status == 200:
+        print(f"Successful S3 put_object response. Status - {status}")
+    else:
+        print(f"Unsuccessful S3 put_object response. Status - {status}")
+
 if __name__ == '__main__':
     logging.basicConfig(stream=sys.stdout, level=logging.INFO)
     event = {
@@ -0,0 +1,45 @@
+"""
+Per-asset watermarks of the inference input, the last minute written for each asset.
+"""
+import json
+import os
+
+
+class S3WatermarkStore(object):
+    """Keeps the watermarks of all the assets in one JSON object in S3.
+
+    A watermark is a dict of the minute, in seconds since the epoch, and of the
+    forward-filled values of the columns at the end of that minute.
+    """
+
+    def __init__(self, client, bucket, key):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+
+    def load(self):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key)
+        except self.client.exceptions.NoSuchKey:
+            return {}
+        return json.loads(response['Body'].read())
+
+    def save(self, watermarks):
+        self.client.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(watermarks))
+
+
+class LocalWatermarkStore(object):
+    """Keeps the watermarks in a local file, in place of S3 for local runs."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as watermark_file:
+            return json.load(watermark_file)
+
+    def save(self, watermarks):
+        with open(self.path, 'w') as watermark_file:
+            json.dump(watermarks, watermark_file)
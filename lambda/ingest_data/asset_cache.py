@@ -0,0 +1,78 @@
+"""
+Warm container cache for asset data files and asset descriptions.
+"""
+import collections
+import json
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DESCRIBE_ASSET_TTL_SECONDS = int(os.environ.get('DESCRIBE_ASSET_TTL_SECONDS', 300))
+# Bytes of decoded asset data kept in the warm container, half the function memory by default
+ASSET_DATA_CACHE_BYTES = int(os.environ.get(
+    'ASSET_DATA_CACHE_BYTES', int(os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', 512)) * 1024 * 1024 // 2))
+# Decoded JSON asset data takes about this many times the size of its file in memory
+JSON_EXPANSION_FACTOR = 4
+
+# (bucket, key) -> (etag, asset data, size in bytes), least recently used first
+asset_data_cache = collections.OrderedDict()
+# asset id -> (expiry time, describe_asset response)
+asset_description_cache = {}
+cache_stats = collections.Counter()
+
+
+def get_asset_data(s3, bucket, key, loader=json.load, expansion_factor=JSON_EXPANSION_FACTOR):
+    """Returns the decoded asset data file, revalidating a cached copy with its ETag.
+
+    The decoded data is taken to be expansion_factor times the size of the file. The
+    least recently used files are evicted to keep the cache within ASSET_DATA_CACHE_BYTES,
+    and a file larger than that is decoded for every call instead of being cached.
+    """
+    cached = asset_data_cache.get((bucket, key))
+    request = {'Bucket': bucket, 'Key': key}
+    if cached is not None:
+        request['IfNoneMatch'] = cached[0]
+    try:
+        obj = s3.get_object(**request)
+    except ClientError as e:
+        if cached is not None and e.response['Error']['Code'] in ('304', 'NotModified'):
+            cache_stats['asset_data_hit'] += 1
+            asset_data_cache.move_to_end((bucket, key))
+            return cached[1]
+        raise
+    cache_stats['asset_data_miss'] += 1
+    # The cached copy is stale, dropped before decoding the new one
+    asset_data_cache.pop((bucket, key), None)
+    asset_data = loader(obj['Body'])
+    size = obj['ContentLength'] * expansion_factor
+    if size > ASSET_DATA_CACHE_BYTES:
+        logger.warning('s3://%s/%s is too large for the asset data cache', bucket, key)
+        return asset_data
+    while asset_data_cache and sum(entry[2] for entry in asset_data_cache.values()) + size > ASSET_DATA_CACHE_BYTES:
+        evicted_key, _ = asset_data_cache.popitem(last=False)
+        cache_stats['asset_data_eviction'] += 1
+        logger.info('Evicted s3://%s/%s from the asset data cache', *evicted_key)
+    asset_data_cache[(bucket, key)] = (obj['ETag'], asset_data, size)
+    return asset_data
+
+
+def describe_asset(describe_asset_from_sitewise, asset_id):
+    """Returns the describe_asset response, cached for DESCRIBE_ASSET_TTL_SECONDS."""
+    now = time.monotonic()
+    cached = asset_description_cache.get(asset_id)
+    if cached is not None and cached[0] > now:
+        cache_stats['describe_asset_hit'] += 1
+        return cached[1]
+    cache_stats['describe_asset_miss'] += 1
+    desc_asset_response = describe_asset_from_sitewise(asset_id)
+    asset_description_cache[asset_id] = (now + DESCRIBE_ASSET_TTL_SECONDS, desc_asset_response)
+    return desc_asset_response
+
+
+def log_cache_stats():
+    logger.info('Cache stats: %s', dict(cache_stats))
@@ -0,0 +1,57 @@
+"""
+Builds IoT SiteWise property values for a whole invocation window with NumPy.
+"""
+import numpy as np
+
+SECONDS_PER_MINUTE = 60
+# BatchPutAssetPropertyValue limits
+MAX_ENTRIES_IN_BATCH = 10
+NUM_VALUES_PER_ENTRY = 10
+
+rng = np.random.default_rng()
+
+
+def build_property_values(asset_property_values, start_time, base_offset, num_seconds):
+    """Returns the timestamps and values of one property for num_seconds of data.
+
+    Every second gets a value drawn uniformly between the replay value of its
+    minute and the replay value of the next minute, as the per-value loop did.
+    """
+    asset_property_values = np.asarray(asset_property_values, dtype=np.float64)
+    seconds_since_start = np.arange(num_seconds)
+    range_minimum_index = (base_offset + seconds_since_start // SECONDS_PER_MINUTE) % len(asset_property_values)
+    range_maximum_index = (range_minimum_index + 1) % len(asset_property_values)
+    range_minimum = asset_property_values[range_minimum_index]
+    range_maximum = asset_property_values[range_maximum_index]
+    values = range_minimum + (range_maximum - range_minimum) * rng.random(num_seconds)
+    timestamps = int(start_time.timestamp()) + seconds_since_start
+    return timestamps, values
+
+
+def get_entries(asset_id, property_id, timestamps, values):
+    """Splits the arrays of one property into BatchPutAssetPropertyValue entries."""
+    timestamps = timestamps.tolist()
+    values = values.tolist()
+    for start in range(0, len(timestamps), NUM_VALUES_PER_ENTRY):
+        property_values = [
+            {'value': {'doubleValue': value}, 'timestamp': {'timeInSeconds': timestamp, 'offsetInNanos': 0}, 'quality': 'GOOD'}
+            for timestamp, value in zip(timestamps[start:start + NUM_VALUES_PER_ENTRY], values[start:start + NUM_VALUES_PER_ENTRY])
+        ]
+        yield {'assetId': asset_id, 'propertyId': property_id, 'propertyValues': property_values}
+
+
+def pack_batches(entries, max_entries_in_batch=MAX_ENTRIES_IN_BATCH):
+    """Packs entries of any asset and property into full BatchPutAssetPropertyValue requests.
+
+    Entries are consumed lazily, so the caller can chain the entries of several
+    properties and assets and every request but the last carries max_entries_in_batch entries.
+    """
+    batch = []
+    for entry in entries:
+        entry['entryId'] = str(len(batch))
+        batch.append(entry)
+        if len(batch) == max_entries_in_batch:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
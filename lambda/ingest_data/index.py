@@ -1,94 +1,209 @@
 import boto3
-import logging
 import json
+import logging
+import itertools
+import os
 import time
-import random
 from datetime import datetime, timedelta, timezone
-from ratelimiter import RateLimiter
+from botocore.exceptions import ClientError
+from token_bucket import TokenBucket
+from quota_coordinator import QuotaCoordinator, DynamoDBQuotaBackend, LocalQuotaBackend
+from asset_cache import describe_asset, get_asset_data, log_cache_stats
+from batch_builder import build_property_values, get_entries, pack_batches, MAX_ENTRIES_IN_BATCH, NUM_VALUES_PER_ENTRY, SECONDS_PER_MINUTE
+from sitewise_writer import put_asset_property_values
+from replay_dataset import load_replay_dataset
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 iotsitewise = boto3.client('iotsitewise')
 s3 = boto3.client('s3')
 
-MAX_ENTRIES_IN_BATCH = 1
-NUM_VALUES_PER_ENTRY = 10
-
-SECONDS_PER_MINUTE = 60
+ASSET_DATA_FORMAT_COLUMNAR = 'columnar'
 
 STANDARD_INVOCATION_DURATION_TO_UPLOAD_DATA_FOR = timedelta(minutes=1)
 
 MAX_REQUESTS_PER_PERIOD = 1
 PERIOD_LENGTH_IN_SECONDS = 1
 
-def put_all_data(asset_id, asset_data_bucket, asset_data_file_path, start_time, base_offset, num_entries_needed, property_to_put_data):
-    desc_asset_response = iotsitewise.describe_asset(assetId=asset_id)
-    obj = s3.get_object(Bucket=asset_data_bucket, Key=asset_data_file_path)
-    body = obj['Body']
-    asset_data = json.load(body)
-    for asset_property in desc_asset_response['assetProperties']:
-        if asset_property['name'] == property_to_put_data:
-            asset_property_values = asset_data[asset_property['name']]
-            for batch in get_batches(asset_id, asset_property, asset_property_values, start_time, base_offset, num_entries_needed):
-                send_batch_put_asset_property_value(batch)
+BACKFILL_MODE = 'backfill'
+BACKFILL_MAX_CHUNK_DURATION = timedelta(minutes=10)
+BACKFILL_SAFETY_MARGIN_IN_MILLIS = 15000
+# Set to the BatchPutAssetPropertyValue quota of the account
+BACKFILL_MAX_REQUESTS_PER_PERIOD = int(os.environ.get('BACKFILL_MAX_REQUESTS_PER_PERIOD', 10))
+
+# Quotas of the whole fleet of ingest containers, shared through QUOTA_TABLE_NAME when set
+FLEET_MAX_REQUESTS_PER_PERIOD = int(os.environ.get('FLEET_MAX_REQUESTS_PER_PERIOD', 10))
+FLEET_MAX_DESCRIBE_REQUESTS_PER_PERIOD = int(os.environ.get('FLEET_MAX_DESCRIBE_REQUESTS_PER_PERIOD', 10))
+QUOTA_TABLE_NAME = os.environ.get('QUOTA_TABLE_NAME')
+quota_coordinator = QuotaCoordinator(
+    DynamoDBQuotaBackend(QUOTA_TABLE_NAME) if QUOTA_TABLE_NAME else LocalQuotaBackend(),
+    {
+        'BatchPutAssetPropertyValue': FLEET_MAX_REQUESTS_PER_PERIOD,
+        'DescribeAsset': FLEET_MAX_DESCRIBE_REQUESTS_PER_PERIOD,
+    },
+    window_seconds=PERIOD_LENGTH_IN_SECONDS
+)
+
+def put_all_data(assets, start_time, base_offset, num_entries_needed, send_batch=None):
+    send_batch = send_batch or send_batch_put_asset_property_value
+    entries = itertools.chain.from_iterable(
+        get_asset_entries(asset, start_time, base_offset, num_entries_needed) for asset in assets)
+    num_rejected_entries = 0
+    for batch in pack_batches(entries):
+        num_rejected_entries += len(put_asset_property_values(send_batch, batch))
+    if num_rejected_entries:
+        logger.warning('SiteWise rejected %d entries', num_rejected_entries)
     return True
 
-def get_batches(asset_id, asset_property, asset_property_values, start_time, base_offset, num_entries_needed):
-    num_batches = int(num_entries_needed // MAX_ENTRIES_IN_BATCH)
-    if num_entries_needed % MAX_ENTRIES_IN_BATCH != 0:
-        num_batches += 1
-    for batch_number in range(num_batches):
-        yield get_batch(asset_id, asset_property, asset_property_values, start_time, base_offset, num_entries_needed, batch_number)
-
-def get_batch(asset_id, asset_property, asset_property_values, start_time, base_offset, num_entries_needed, batch_number):
-    batch = []
-    for entry_id in range(MAX_ENTRIES_IN_BATCH):
-        seconds_since_start_for_current_entry = (batch_number*MAX_ENTRIES_IN_BATCH*NUM_VALUES_PER_ENTRY)+(entry_id*NUM_VALUES_PER_ENTRY)
-        property_value_range = get_property_value_range(asset_property_values, base_offset, seconds_since_start_for_current_entry)
-        property_values = get_property_values(property_value_range, start_time, seconds_since_start_for_current_entry)
-        entry = {'entryId': str(entry_id), 'assetId': asset_id, 'propertyId':asset_property['id'], 'propertyValues':property_values}
-        batch.append(entry)
-        num_entries_created = (batch_number*MAX_ENTRIES_IN_BATCH) + len(batch)
-        if num_entries_created == num_entries_needed:
-            break
-    return batch
-
-def get_property_value_range(asset_property_values, base_offset, seconds_since_start_for_current_entry):
-    minutes_since_start = seconds_since_start_for_current_entry // SECONDS_PER_MINUTE
-    range_minimum_index = (base_offset + minutes_since_start) % len(asset_property_values)
-    range_maximum_index = (range_minimum_index + 1) % len(asset_property_values)
-    return [asset_property_values[range_minimum_index],asset_property_values[range_maximum_index]]
-
-def get_property_values(property_value_range, start_time, seconds_since_start_for_current_entry):
-    property_values = []
-    start_time_timestamp = int(start_time.timestamp())
-    for value_second in range(NUM_VALUES_PER_ENTRY):
-        current_timestamp = start_time_timestamp + seconds_since_start_for_current_entry + value_second
-        value = get_value_in_range(property_value_range)
-        property_value = {'value': {'doubleValue': value}, 'timestamp':{'timeInSeconds':current_timestamp,'offsetInNanos':0},'quality':'GOOD'}
-        property_values.append(property_value)
-    return property_values
-
-def get_value_in_range(property_value_range):
-    return random.uniform(property_value_range[0], property_value_range[1])
-
-@RateLimiter(max_calls=MAX_REQUESTS_PER_PERIOD, period=PERIOD_LENGTH_IN_SECONDS)
+def get_asset_entries(asset, start_time, base_offset, num_entries_needed):
+    """Returns the entries of all requested properties of an asset from a single describe and download."""
+    desc_asset_response = describe_asset(describe_asset_from_sitewise, asset['asset_id'])
+    get_replay_values = get_replay_values_reader(asset, base_offset)
+    property_names = set(asset['properties'])
+    asset_properties = [asset_property for asset_property in desc_asset_response['assetProperties']
+                        if asset_property['name'] in property_names]
+    return get_entries_for_properties(asset['asset_id'], asset_properties, get_replay_values, start_time, num_entries_needed)
+
+def get_replay_values_reader(asset, base_offset):
+    """Returns a function giving the replay values of a property and the offset to start replaying them at.
+
+    The decoded asset data is cached, so warm invocations make one conditional GET per asset.
+    """
+    bucket, key = asset['asset_data_bucket'], asset['asset_data_path']
+    if asset.get('asset_data_format') == ASSET_DATA_FORMAT_COLUMNAR:
+        # The arrays of a replay dataset are views of the downloaded bytes
+        asset_data = get_asset_data(s3, bucket, key, loader=load_replay_dataset, expansion_factor=1)
+    else:
+        asset_data = get_asset_data(s3, bucket, key)
+    return lambda property_name: (asset_data[property_name], base_offset)
+
+def get_entries_for_properties(asset_id, asset_properties, get_replay_values, start_time, num_entries_needed):
+    num_seconds = num_entries_needed * NUM_VALUES_PER_ENTRY
+    for asset_property in asset_properties:
+        asset_property_values, base_offset = get_replay_values(asset_property['name'])
+        timestamps, values = build_property_values(asset_property_values, start_time, base_offset, num_seconds)
+        yield from get_entries(asset_id, asset_property['id'], timestamps, values)
+
+@TokenBucket(rate=MAX_REQUESTS_PER_PERIOD / PERIOD_LENGTH_IN_SECONDS, capacity=MAX_REQUESTS_PER_PERIOD)
+@quota_coordinator.limit('BatchPutAssetPropertyValue')
 def send_batch_put_asset_property_value(entries):
     return iotsitewise.batch_put_asset_property_value(entries=entries)
 
+@TokenBucket(rate=BACKFILL_MAX_REQUESTS_PER_PERIOD / PERIOD_LENGTH_IN_SECONDS, capacity=BACKFILL_MAX_REQUESTS_PER_PERIOD)
+@quota_coordinator.limit('BatchPutAssetPropertyValue')
+def send_backfill_batch_put_asset_property_value(entries):
+    return iotsitewise.batch_put_asset_property_value(entries=entries)
+
+@quota_coordinator.limit('DescribeAsset')
+def describe_asset_from_sitewise(asset_id):
+    return iotsitewise.describe_asset(assetId=asset_id)
+
+def backfill(assets, start_time, end_time, cursor, context, checkpoint_bucket=None, checkpoint_key=None):
+    """Uploads the replay data of [start_time, end_time) in chunks from cursor on.
+
+    Every chunk is sized to end before the lambda times out, from the time the
+    previous chunk took per minute of data or, for the first one, from the
+    request rate. Returns the cursor to resume from. Every chunk replays the asset
+    data from the minute it is at since start_time, so resuming from a cursor
+    continues the same replay. SiteWise rejects values that are older than its
+    ingestion window, older history needs a bulk import job.
+    """
+    estimated_seconds_per_minute = estimate_backfill_seconds_per_minute(assets)
+    # Until a chunk is measured, assume throttling halves the request rate
+    seconds_per_minute = 2 * estimated_seconds_per_minute
+    while cursor < end_time:
+        chunk_duration = get_backfill_chunk_duration(context.get_remaining_time_in_millis(), seconds_per_minute)
+        if chunk_duration is None:
+            break
+        chunk_end = min(cursor + chunk_duration, end_time)
+        base_offset = int((cursor - start_time).total_seconds()) // SECONDS_PER_MINUTE
+        num_entries_needed = -(-int((chunk_end - cursor).total_seconds()) // NUM_VALUES_PER_ENTRY)
+        chunk_start = time.monotonic()
+        put_all_data(assets, cursor, base_offset, num_entries_needed,
+                     send_batch=send_backfill_batch_put_asset_property_value)
+        # Throttling and retries show in the measured time of the chunk
+        chunk_minutes = (chunk_end - cursor).total_seconds() / SECONDS_PER_MINUTE
+        seconds_per_minute = max(estimated_seconds_per_minute, (time.monotonic() - chunk_start) / chunk_minutes)
+        cursor = chunk_end
+        if checkpoint_bucket is not None:
+            save_backfill_checkpoint(checkpoint_bucket, checkpoint_key, start_time, end_time, cursor)
+        logger.info('Backfilled up to %s', cursor.isoformat())
+    return {'cursor': cursor.isoformat(), 'complete': cursor >= end_time}
+
+def estimate_backfill_seconds_per_minute(assets):
+    """Returns the seconds of requests needed to backfill one minute of data at the backfill request rate."""
+    num_entries = sum(len(asset['properties']) for asset in assets) * -(-SECONDS_PER_MINUTE // NUM_VALUES_PER_ENTRY)
+    num_requests = -(-num_entries // MAX_ENTRIES_IN_BATCH)
+    return num_requests * PERIOD_LENGTH_IN_SECONDS / BACKFILL_MAX_REQUESTS_PER_PERIOD
+
+def get_backfill_chunk_duration(remaining_time_in_millis, seconds_per_minute):
+    """Returns the whole minutes of data that can be backfilled before the safety margin, or None."""
+    available_seconds = (remaining_time_in_millis - BACKFILL_SAFETY_MARGIN_IN_MILLIS) / 1000
+    minutes = min(int(available_seconds // seconds_per_minute), BACKFILL_MAX_CHUNK_DURATION // timedelta(minutes=1))
+    if minutes < 1:
+        return None
+    return timedelta(minutes=minutes)
+
+def save_backfill_checkpoint(bucket, key, start_time, end_time, cursor):
+    body = json.dumps({'start_time': start_time.isoformat(), 'end_time': end_time.isoformat(), 'cursor': cursor.isoformat()})
+    s3.put_object(Bucket=bucket, Key=key, Body=body)
+
+def load_backfill_checkpoint(bucket, key, start_time, end_time):
+    """Returns the cursor of a checkpoint of the same backfill, or None."""
+    try:
+        checkpoint = json.load(s3.get_object(Bucket=bucket, Key=key)['Body'])
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'NoSuchKey':
+            return None
+        raise
+    if checkpoint['start_time'] != start_time.isoformat() or checkpoint['end_time'] != end_time.isoformat():
+        return None
+    return datetime.fromisoformat(checkpoint['cursor'])
+
+
+def get_assets_from_event(event):
+    """Returns the assets to ingest, either from an asset list or from a single property event."""
+    if 'assets' in event:
+        return event['assets']
+    return [
+        {
+            'asset_id': event['asset_id'],
+            'asset_data_bucket': event['asset_data_bucket'],
+            'asset_data_path': event['asset_data_path'],
+            'asset_data_format': event.get('asset_data_format'),
+            'properties': [event['property_to_put_data']],
+        }
+    ]
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
 
 def handler(event, context):
     logger.info('Received event: %s', event)
     now = datetime.now(timezone.utc)
 
-    asset_id = event['asset_id']
-    asset_data_bucket = event['asset_data_bucket']
-    asset_data_path = event['asset_data_path']
-    property_to_put_data = event['property_to_put_data']
+    assets = get_assets_from_event(event)
+    for asset in assets:
+        logger.info('asset_id: %s, properties: %s', asset['asset_id'], asset['properties'])
+    if event.get('mode') == BACKFILL_MODE:
+        checkpoint_bucket = event.get('checkpoint_bucket')
+        checkpoint_key = event.get('checkpoint_key')
+        # Checked before any data is sent, a checkpoint can't be saved without both
+        if (checkpoint_bucket is None) != (checkpoint_key is None):
+            raise ValueError('checkpoint_bucket and checkpoint_key should be given together')
+        start_time = parse_time(event['start_time'])
+        end_time = parse_time(event['end_time'])
+        cursor = parse_time(event['cursor']) if event.get('cursor') else None
+        if cursor is None and checkpoint_bucket is not None:
+            cursor = load_backfill_checkpoint(checkpoint_bucket, checkpoint_key, start_time, end_time)
+        result = backfill(assets, start_time, end_time, cursor or start_time, context,
+                          checkpoint_bucket, checkpoint_key)
+        log_cache_stats()
+        return result
 
-    logger.info('property_to_put_data: %s', property_to_put_data)
     duration_to_upload_data_for = STANDARD_INVOCATION_DURATION_TO_UPLOAD_DATA_FOR
     start_time = now - duration_to_upload_data_for
     base_offset = 0
     num_entries_needed = int(duration_to_upload_data_for.total_seconds() // NUM_VALUES_PER_ENTRY)
-    put_all_data(asset_id, asset_data_bucket, asset_data_path, start_time, base_offset, num_entries_needed, property_to_put_data)
\ No newline at end of file
+    put_all_data(assets, start_time, base_offset, num_entries_needed)
+    log_cache_stats()
@@ -0,0 +1,112 @@
+"""
+Fleet wide quotas for SiteWise API calls made by concurrent lambda containers.
+
+Every container leases tokens of the per second quota of an API from a shared
+backend before calling it, so the fleet as a whole stays under the account limit.
+"""
+import functools
+import threading
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+QUOTA_WINDOW_TTL_IN_SECONDS = 300
+
+
+class LocalQuotaBackend(object):
+    """In-process stand-in for the shared backend, for tests and single container runs."""
+
+    def __init__(self):
+        self._used = {}
+        self._lock = threading.Lock()
+
+    def lease(self, api, window, limit, tokens):
+        """Takes up to tokens of the quota of api in window and returns how many were granted."""
+        with self._lock:
+            used = self._used.get((api, window), 0)
+            granted = max(0, min(tokens, limit - used))
+            self._used[(api, window)] = used + granted
+            return granted
+
+
+class DynamoDBQuotaBackend(object):
+    """Counts the quota used per API and window in a DynamoDB table.
+
+    The table has a string partition key `pk` and expires items through the `expires_at` TTL attribute.
+    """
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self.client = client or boto3.client('dynamodb')
+
+    def lease(self, api, window, limit, tokens):
+        """Takes up to tokens of the quota of api in window and returns how many were granted.
+
+        The conditional update only succeeds while the whole lease fits in the quota, so
+        smaller leases are tried for the tokens left at the end of a window.
+        """
+        while tokens > 0:
+            try:
+                self.client.update_item(
+                    TableName=self.table_name,
+                    Key={'pk': {'S': f'{api}#{window}'}},
+                    UpdateExpression='ADD used :tokens SET expires_at = if_not_exists(expires_at, :expires_at)',
+                    ConditionExpression='attribute_not_exists(used) OR used <= :max_used',
+                    ExpressionAttributeValues={
+                        ':tokens': {'N': str(tokens)},
+                        ':max_used': {'N': str(limit - tokens)},
+                        ':expires_at': {'N': str(int(time.time()) + QUOTA_WINDOW_TTL_IN_SECONDS)},
+                    },
+                )
+                return tokens
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                tokens //= 2
+        return 0
+
+
+class QuotaCoordinator(object):
+    """Leases tokens of per window quotas of SiteWise APIs from a shared backend.
+
+    quotas maps API names to the number of calls the whole fleet may make per window.
+    Tokens are leased lease_size at a time, and a container waits for the next window
+    once the fleet has used up the quota of the current one.
+    """
+
+    def __init__(self, backend, quotas, window_seconds=1, lease_size=1, clock=time.time, sleep=time.sleep):
+        self.backend = backend
+        self.quotas = quotas
+        self.window_seconds = window_seconds
+        self.lease_size = lease_size
+        self._clock = clock
+        self._sleep = sleep
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, api):
+        while True:
+            now = self._clock()
+            window = int(now // self.window_seconds)
+            with self._lock:
+                lease_window, remaining = self._leases.get(api, (None, 0))
+                if lease_window == window and remaining > 0:
+                    self._leases[api] = (window, remaining - 1)
+                    return
+            granted = self.backend.lease(api, window, self.quotas[api], self.lease_size)
+            if granted:
+                with self._lock:
+                    self._leases[api] = (window, granted - 1)
+                return
+            self._sleep(max(0, (window + 1) * self.window_seconds - self._clock()))
+
+    def limit(self, api):
+        """Decorator leasing a token of api before every call."""
+        def decorator(f):
+            @functools.wraps(f)
+            def wrapped(*args, **kwargs):
+                self.acquire(api)
+                return f(*args, **kwargs)
+            return wrapped
+        return decorator
@@ -0,0 +1,28 @@
+"""
+Decodes the columnar replay dataset written by lib/replay_dataset.py at deploy time.
+"""
+import json
+import struct
+
+import numpy as np
+
+MAGIC = b'SWREPLAY'
+PREFIX_SIZE = len(MAGIC) + 4
+DTYPE = np.dtype('<f4')
+
+
+def load_replay_dataset(body):
+    """Returns the float32 array of every sensor of a replay dataset.
+
+    The arrays are views of the downloaded bytes, decoded without copying, so the
+    whole dataset can be kept in the warm container cache.
+    """
+    data = body.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError('Not a replay dataset')
+    header_length, = struct.unpack_from('<I', data, len(MAGIC))
+    header = json.loads(data[PREFIX_SIZE:PREFIX_SIZE + header_length])
+    return {
+        sensor_name: np.frombuffer(data, dtype=DTYPE, count=sensor['length'], offset=sensor['offset'])
+        for sensor_name, sensor in header['sensors'].items()
+    }
@@ -0,0 +1,89 @@
+"""
+Writes BatchPutAssetPropertyValue requests, retrying only the entries that failed transiently.
+
+Shared by the lambdas writing to IoT SiteWise, keep the copies identical.
+"""
+import logging
+import random
+import time
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MAX_ENTRIES_IN_BATCH = 10
+MAX_ATTEMPTS = 5
+BASE_DELAY_IN_SECONDS = 0.2
+MAX_DELAY_IN_SECONDS = 5
+
+RETRYABLE_ERROR_CODES = {
+    'ThrottlingException',
+    'LimitExceededException',
+    'InternalFailureException',
+    'ServiceUnavailableException',
+    'ConflictingOperationException',
+}
+
+
+def get_backoff_delay(attempt, base_delay=BASE_DELAY_IN_SECONDS, max_delay=MAX_DELAY_IN_SECONDS):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def put_asset_property_values(send, entries, max_attempts=MAX_ATTEMPTS):
+    """Sends up to MAX_ENTRIES_IN_BATCH entries and returns the entries SiteWise rejected.
+
+    send is called with the entries of every attempt, so callers can rate limit it.
+    Values rejected with a retryable error are sent again after a jittered backoff,
+    without the values SiteWise accepted. A rejected entry is reported as a dict
+    with entryId, assetId, propertyId, errorCode, errorMessage and timestamps.
+    """
+    entries_by_id = {entry['entryId']: entry for entry in entries}
+    pending = list(entries)
+    rejected = []
+    for attempt in range(max_attempts):
+        if attempt:
+            time.sleep(get_backoff_delay(attempt))
+        last_attempt = attempt + 1 == max_attempts
+        try:
+            response = send(pending)
+        except ClientError as e:
+            if e.response['Error']['Code'] in RETRYABLE_ERROR_CODES and not last_attempt:
+                logger.warning('Retrying %d entries after %s', len(pending), e.response['Error']['Code'])
+                continue
+            raise
+        pending = []
+        for error_entry in response.get('errorEntries', []):
+            entry = entries_by_id[error_entry['entryId']]
+            retry_timestamps = set()
+            for error in error_entry['errors']:
+                timestamps = [(timestamp['timeInSeconds'], timestamp.get('offsetInNanos', 0))
+                              for timestamp in error.get('timestamps', [])]
+                if error['errorCode'] in RETRYABLE_ERROR_CODES and not last_attempt:
+                    retry_timestamps.update(timestamps)
+                    continue
+                rejected.append({
+                    'entryId': entry['entryId'],
+                    'assetId': entry.get('assetId'),
+                    'propertyId': entry.get('propertyId'),
+                    'propertyAlias': entry.get('propertyAlias'),
+                    'errorCode': error['errorCode'],
+                    'errorMessage': error.get('errorMessage'),
+                    'timestamps': timestamps,
+                })
+            if retry_timestamps:
+                retry_entry = dict(entry, propertyValues=[
+                    property_value for property_value in entry['propertyValues']
+                    if (property_value['timestamp']['timeInSeconds'],
+                        property_value['timestamp'].get('offsetInNanos', 0)) in retry_timestamps
+                ])
+                entries_by_id[entry['entryId']] = retry_entry
+                pending.append(retry_entry)
+        if not pending:
+            break
+    for rejected_entry in rejected:
+        logger.error('Rejected entry %s of asset %s property %s: %s %s',
+                     rejected_entry['entryId'], rejected_entry['assetId'], rejected_entry['propertyId'],
+                     rejected_entry['errorCode'], rejected_entry['errorMessage'])
+    return rejected
@@ -9,10 +9,10 @@ from random import randint
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 from botocore.exceptions import ClientError
+from sitewise_writer import put_asset_property_values, MAX_ENTRIES_IN_BATCH
 
 p = '%Y-%m-%dT%H:%M:%S.%f'
 n = 8   #entry id length
-MAX_BATCH_PUT_SIZE = 10
 
 s3 = boto3.client('s3')
 iotsitewise = boto3.client('iotsitewise')
@@ -100,7 +100,7 @@ def lambda_handler(event, context):
     entry = get_batch(asset_id, property_values, asset_L4E_property_name, desc_asset_response)
     print(entry)
     try: 
-        send_batch_put_asset_property_value(entry)
+        put_asset_property_values(send_batch_put_asset_property_value, entry)
     except Exception as e:
         logger.error(e)
     
@@ -113,10 +113,12 @@ def lambda_handler(event, context):
                 sensor_entries(i, j, inference_output_list, asset_id, desc_asset_response, sensor_property_value, entries)
                     
             ##############################devide entries by 10 then send to SiteWise#####################
-            for k in range(len(entries)//MAX_BATCH_PUT_SIZE):
+            for k in range(0, len(entries), MAX_ENTRIES_IN_BATCH):
                 try:
-                    response = send_batch_put_asset_property_value(entries=entries[k*MAX_BATCH_PUT_SIZE:(k+1)*MAX_BATCH_PUT_SIZE])
-                    print(response)
+                    rejected = put_asset_property_values(send_batch_put_asset_property_value, entries[k:k+MAX_ENTRIES_IN_BATCH])
+                    ##The writer logs every rejected entry
+                    if rejected:
+                        logger.warning('SiteWise rejected %d entries', len(rejected))
                 except Exception as e:
                     logger.error(e)
                             
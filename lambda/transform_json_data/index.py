@@ -1,10 +1,14 @@
 """
 Flattens data produced by AWS IoT SiteWise to make it queryable.
 """
-import base64
+import binascii
+import functools
 import json
 import logging
+import math
 import sys
+import time
+from json.encoder import encode_basestring_ascii
 
 # Configure logging
 logger = logging.getLogger()
@@ -15,77 +19,136 @@ formatter = logging.Formatter(
 stream_handler.setFormatter(formatter)
 logger.addHandler(stream_handler)
 
+# Value keys of SiteWise property values, and the data type and the typed
+# value column written for each. When a value has several keys the last one wins.
+VALUE_TYPES = [
+    ('doubleValue', 'double', 'asset_property_double_value'),
+    ('integerValue', 'integer', 'asset_property_integer_value'),
+    ('booleanValue', 'boolean', 'asset_property_boolean_value'),
+    ('stringValue', 'string', 'asset_property_string_value'),
+]
+
+# Output rows are written in the format of json.dumps, from these fragments
+TIME_IN_SECONDS_FRAGMENT = ', "time_in_seconds": '
+OFFSET_IN_NANOS_FRAGMENT = ', "offset_in_nanos": '
+QUALITY_FRAGMENT = ', "asset_property_quality": '
+# The quality fragments of the SiteWise qualities
+QUALITY_FRAGMENTS = {
+    quality: QUALITY_FRAGMENT + encode_basestring_ascii(quality)
+    for quality in ('GOOD', 'BAD', 'UNCERTAIN')
+}
+VALUE_FRAGMENTS = {
+    value_type: ', ' + encode_basestring_ascii(column) + ': '
+    for _, value_type, column in VALUE_TYPES
+}
+DATA_TYPE_FRAGMENTS = {
+    value_type: ', "asset_property_data_type": ' + encode_basestring_ascii(value_type) + '}'
+    for _, value_type, _ in VALUE_TYPES
+}
+
+decode_json = json.JSONDecoder().decode
+
+SECONDS_PER_HOUR = 60 * 60
+
 def handler(event, context):
-    logger.info("event: {}".format(event))
+    logger.debug("event: %s", event)
     output = []
+    # Reused for the rows of every record
+    buffer = []
 
     # Extract the list of records from event, where each
     # record is a json that contains asset data and recordId.
     for record in event['records']:
         # data contains asset property values.
-        data = json.loads(base64.b64decode(record['data']))
-        flat_data = flatten_data(data)
-        output_record = convert_to_out_format(flat_data, record['recordId'])
-        output.append(output_record)
+        data = decode_json(binascii.a2b_base64(record['data']).decode('utf-8'))
+        buffer.clear()
+        write_rows(data, buffer)
+        output.append({
+            'recordId': record['recordId'],
+            'result': 'Ok',
+            'data': binascii.b2a_base64(''.join(buffer).encode('utf-8'), newline=False).decode('ascii'),
+            'metadata': {'partitionKeys': get_partition_keys(data)}
+        })
 
     logger.info('Successfully processed {} records.'.format(
         len(event['records'])))
     return {'records': output}
 
-def convert_to_out_format(flat_data, record_id):
-    # Convert the elements in flat data into a list of jsons.
-    data_list = [json.dumps(row) for row in flat_data]
-
-    # Convert the list of jsons to new line seprated string
-    data = '\n'.join(data_list)
-    output_record = {
-        'recordId': record_id,
-        'result': 'Ok',
-        'data': base64.b64encode(data.encode('utf-8')).decode('utf-8')
-    }
-    return output_record
-
-def flatten_data(data):
-    payload_type = data['type']
-    asset_id = data['payload']['assetId']
-    property_id = data['payload']['propertyId']
-    flat_data = []
+def get_partition_keys(data):
+    """Returns the Firehose dynamic partitioning keys of a record.
 
+    Records are partitioned by asset, and by the date and hour of their first
+    value, or of their arrival if they have none.
+    """
     try:
-        for asset_value in data['payload']['values']:
-            raw_value = {"type": payload_type,
-                        "asset_id": asset_id, "asset_property_id": property_id}
+        time_in_seconds = int(data['payload']['values'][0]['timestamp']['timeInSeconds'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        time_in_seconds = int(time.time())
+    dt, hour = get_date_and_hour(time_in_seconds // SECONDS_PER_HOUR)
+    return {'asset_id': data['payload']['assetId'], 'dt': dt, 'hour': hour}
 
-            time_in_seconds = asset_value['timestamp']['timeInSeconds']
-            offset_in_nanos = asset_value['timestamp']['offsetInNanos']
+@functools.lru_cache(maxsize=64)
+def get_date_and_hour(hours_since_epoch):
+    utc_time = time.gmtime(hours_since_epoch * SECONDS_PER_HOUR)
+    return time.strftime('%Y-%m-%d', utc_time), time.strftime('%H', utc_time)
 
-            value, valuetype = extract_value_and_type(asset_value)
+def write_rows(data, buffer):
+    """Appends the newline separated rows of the values in data to buffer.
 
+    Every row is the json.dumps output of a dict with the type, asset_id,
+    asset_property_id, time_in_seconds, offset_in_nanos, asset_property_quality
+    and asset_property_data_type keys, and the value under the key of the typed
+    value column of its data type. Values after one that can't be flattened are
+    dropped.
+    """
+    payload = data['payload']
+    row_prefix = ('{"type": ' + encode_json(data['type']) +
+                  ', "asset_id": ' + encode_json(payload['assetId']) +
+                  ', "asset_property_id": ' + encode_json(payload['propertyId']) +
+                  TIME_IN_SECONDS_FRAGMENT)
+    separator = row_prefix
+    try:
+        for asset_value in payload['values']:
+            timestamp = asset_value['timestamp']
+            value, valuetype = extract_value_and_type(asset_value)
             quality = asset_value['quality']
-
-            raw_value['time_in_seconds'] = time_in_seconds
-            raw_value['offset_in_nanos'] = offset_in_nanos
-            raw_value['asset_property_quality'] = quality
-            raw_value['asset_property_value'] = str(value)
-            raw_value['asset_property_data_type'] = valuetype
-
-            flat_data.append(raw_value)
-
+            if valuetype == 'string':
+                encoded_value = encode_basestring_ascii(str(value))
+            else:
+                encoded_value = encode_json(value)
+            row = [
+                separator,
+                encode_json(timestamp['timeInSeconds']),
+                OFFSET_IN_NANOS_FRAGMENT,
+                encode_json(timestamp['offsetInNanos']),
+                QUALITY_FRAGMENTS.get(quality) or QUALITY_FRAGMENT + encode_json(quality),
+                VALUE_FRAGMENTS[valuetype],
+                encoded_value,
+                DATA_TYPE_FRAGMENTS[valuetype],
+            ]
+            buffer.extend(row)
+            separator = '\n' + row_prefix
     except Exception as e:
         logger.error(e)
-    return flat_data
+
+def encode_json(value):
+    """Encodes values like json.dumps, with fast paths for strings and numbers.
+
+    NaN and infinite numbers, which the JSON deserializer of Firehose doesn't
+    accept, are encoded as null.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return encode_basestring_ascii(value)
+    if value_type is int:
+        return int.__repr__(value)
+    if value_type is float:
+        return float.__repr__(value) if math.isfinite(value) else 'null'
+    return json.dumps(value)
 
 def extract_value_and_type(asset_value):
-    if 'doubleValue' in asset_value['value']:
-        value = asset_value['value']['doubleValue']
-        valuetype = "double"
-    if 'integerValue' in asset_value['value']:
-        value = asset_value['value']['integerValue']
-        valuetype = "integer"
-    if 'booleanValue' in asset_value['value']:
-        value = asset_value['value']['booleanValue']
-        valuetype = "boolean"
-    if 'stringValue' in asset_value['value']:
-        value = asset_value['value']['stringValue']
-        valuetype = "string"
-    return value, valuetype
\ No newline at end of file
+    for value_key, valuetype, _ in reversed(VALUE_TYPES):
+        if value_key in asset_value['value']:
+            return asset_value['value'][value_key], valuetype
+    raise KeyError('No value in {}'.format(asset_value['value']))
+
@@ -1,4 +1,5 @@
 import json
+import math
 from aws_cdk import (
     aws_kinesisfirehose as firehose,
     aws_iam as iam,
@@ -23,9 +24,83 @@ METADATA_LAMBDA_PATH = "lambda/asset_metadata/"
 INFERENCE_SCHEDULE_LAMBDA_PATH = "lambda/inference_schedule/"
 L4E_TO_SITEWISE_LAMBDA_PATH = "lambda/l4e_to_sitewise/"
 
+# Minutes of data in the Athena Query Engine views
+VIEW_WINDOW_IN_MINUTES = 6
+
+# Seconds records are buffered by Firehose before the transform lambda, and before S3
+FIREHOSE_PROCESSOR_BUFFER_INTERVAL_IN_SECONDS = 60
+FIREHOSE_BUFFER_INTERVAL_IN_SECONDS = 60
+# Minutes the inference schedule waits after the end of a minute before writing it, the
+# time data can spend in the Firehose buffers plus a margin for the transform lambda,
+# the Parquet conversion and the S3 writes
+INFERENCE_GRACE_PERIOD_IN_MINUTES = math.ceil((FIREHOSE_PROCESSOR_BUFFER_INTERVAL_IN_SECONDS + FIREHOSE_BUFFER_INTERVAL_IN_SECONDS) / 60) + 3
+# Minutes between runs of the inference schedule, which is also the L4E data upload frequency
+INFERENCE_UPLOAD_FREQUENCY_IN_MINUTES = 5
+INFERENCE_SCHEDULE_TIMEOUT_IN_SECONDS = 180
+# Minutes L4E waits after the end of an upload period before reading the input files named
+# after its minutes. The inference schedule names a file after the first minute it holds and
+# writes it at most a grace period and an upload period after the end of the upload period
+# of that minute, finishing within its timeout
+INFERENCE_DATA_DELAY_OFFSET_IN_MINUTES = (INFERENCE_GRACE_PERIOD_IN_MINUTES + INFERENCE_UPLOAD_FREQUENCY_IN_MINUTES +
+                                          math.ceil(INFERENCE_SCHEDULE_TIMEOUT_IN_SECONDS / 60))
+
+def get_pivot_view_query(view_name, data_table, metadata_table, asset_ids, property_list, by_asset=False):
+    """Returns the SQL creating a view of the last minutes of the properties of assets, one column per property.
+
+    The asset and time filters apply to the data table before the join, on its partition
+    keys and on the raw time_in_seconds, so Athena prunes partitions and row groups.
+    With by_asset, the rows of the assets are kept apart by an asset_id column.
+    """
+    window_start = f"\"date_trunc\"('minute', current_timestamp) - INTERVAL  '{VIEW_WINDOW_IN_MINUTES}' MINUTE"
+    # The window spans at most the partitions of the current and previous hours
+    partitions_predicate = ' OR '.join(
+        f'''(("data"."dt" = "date_format"({time}, '%Y-%m-%d')) AND ("data"."hour" = "hour"({time})))'''
+        for time in (f"current_timestamp - INTERVAL  '{VIEW_WINDOW_IN_MINUTES}' MINUTE", 'current_timestamp')
+    )
+    time_predicate = f'''("data"."time_in_seconds" >= CAST("to_unixtime"({window_start}) AS integer))'''
+    return f'''CREATE OR REPLACE VIEW {view_name} AS 
+                    ''' + get_pivot_query(data_table, metadata_table, asset_ids, property_list,
+                                         partitions_predicate, time_predicate, by_asset=by_asset)
+
+def get_pivot_window_query(data_table, metadata_table, asset_ids, property_list):
+    """Returns the SQL template of the properties of assets in a window, one column per property.
+
+    The template takes the $window_start and $window_end of the window in seconds since
+    the epoch and the $partitions_predicate of the partitions holding the window. Rows
+    are by asset and by time, not truncated to the minute.
+    """
+    time_predicate = '''("data"."time_in_seconds" >= $window_start) AND ("data"."time_in_seconds" < $window_end)'''
+    return get_pivot_query(data_table, metadata_table, asset_ids, property_list,
+                           '$partitions_predicate', time_predicate, by_asset=True, truncate_to_minute=False)
+
+def get_pivot_query(data_table, metadata_table, asset_ids, property_list, partitions_predicate, time_predicate,
+                    by_asset=False, truncate_to_minute=True):
+    asset_id_list = ', '.join(f"'{asset_id}'" for asset_id in asset_ids)
+    property_columns = ''.join(
+        f'''
+                    , "max"((CASE WHEN ("asset_property_name" = '{property}') THEN "asset_property_double_value" ELSE null END)) "{property}"'''
+        for property in property_list
+    )
+    asset_column = '"asset_id", ' if by_asset else ''
+    timestamp = '"date_trunc"(\'minute\', "timestamp")' if truncate_to_minute else '"timestamp"'
+    return f'''SELECT {asset_column}"date_format"({timestamp}, '%Y-%m-%dT%H:%i:%S.%f') "Timestamp"{property_columns}
+                    FROM( 
+                    SELECT "data"."asset_id", "from_unixtime"(("time_in_seconds" + ("offset_in_nanos" / 1000000000))) "timestamp"
+                    , "metadata"."asset_name", "metadata"."asset_property_name", "data"."asset_property_double_value"
+                    , "metadata"."asset_property_unit", "metadata"."asset_property_alias"
+                    FROM ({data_table} data
+                    INNER JOIN {metadata_table} metadata ON (("data"."asset_id" = "metadata"."asset_id") AND ("data"."asset_property_id" = "metadata"."asset_property_id")))
+                    WHERE (("data"."asset_id" IN ({asset_id_list})) AND ("metadata"."asset_id" IN ({asset_id_list}))
+                    AND ({partitions_predicate})
+                    AND {time_predicate})) 
+                    GROUP BY {asset_column}"timestamp"
+
+                '''
+
+
 class EtlPipeline(Construct):
     
-        def __init__(self, scope: Construct, id: str, *, assets: object, prefix=None):
+        def __init__(self, scope: Construct, id: str, *, assets: object, property_list: list, prefix=None):
             super().__init__(scope, id)
             
             # create S3 bucket for IoT SiteWise data
@@ -55,18 +130,44 @@ class EtlPipeline(Construct):
                                                 parameters={
                                                     'classification': 'parquet',
                                                     'typeOfData': 'file',
-                                                    'parquet.compression': 'SNAPPY'
+                                                    'parquet.compression': 'SNAPPY',
+                                                    # Partitions are projected instead of registered
+                                                    'projection.enabled': 'true',
+                                                    'projection.asset_id.type': 'enum',
+                                                    'projection.asset_id.values': ','.join(
+                                                        [engine_asset.ref for engine_asset in assets.engine_assets] +
+                                                        [assets.vessel_asset.ref]
+                                                    ),
+                                                    'projection.dt.type': 'date',
+                                                    'projection.dt.format': 'yyyy-MM-dd',
+                                                    'projection.dt.range': 'NOW-1YEARS,NOW',
+                                                    'projection.hour.type': 'integer',
+                                                    'projection.hour.range': '0,23',
+                                                    'projection.hour.digits': '2',
+                                                    'storage.location.template': f's3://{self.data_bucket.bucket_name}/asset-property-updates/asset_id=${{asset_id}}/dt=${{dt}}/hour=${{hour}}/'
                                                 },
+                                                # Set by the Firehose dynamic partitioning from the keys
+                                                # returned by the transform lambda
+                                                partition_keys=[
+                                                    glue.CfnTable.ColumnProperty(
+                                                        name='asset_id',
+                                                        type='string'
+                                                    ),
+                                                    glue.CfnTable.ColumnProperty(
+                                                        name='dt',
+                                                        type='string'
+                                                    ),
+                                                    glue.CfnTable.ColumnProperty(
+                                                        name='hour',
+                                                        type='int'
+                                                    )
+                                                ],
                                                 storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
                                                     columns=[
                                                         glue.CfnTable.ColumnProperty(
                                                             name='type',
                                                             type='string'
                                                         ),
-                                                        glue.CfnTable.ColumnProperty(
-                                                            name='asset_id',
-                                                            type='string'
-                                                        ),
                                                         glue.CfnTable.ColumnProperty(
                                                             name='asset_property_id',
                                                             type='string'
@@ -85,6 +186,23 @@ class EtlPipeline(Construct):
                                                         ),
                                                         glue.CfnTable.ColumnProperty(
                                                             name='asset_property_value',
+                                                            type='string',
+                                                            comment='Value as a string, only set in data written before the typed value columns'
+                                                        ),
+                                                        glue.CfnTable.ColumnProperty(
+                                                            name='asset_property_double_value',
+                                                            type='double'
+                                                        ),
+                                                        glue.CfnTable.ColumnProperty(
+                                                            name='asset_property_integer_value',
+                                                            type='bigint'
+                                                        ),
+                                                        glue.CfnTable.ColumnProperty(
+                                                            name='asset_property_boolean_value',
+                                                            type='boolean'
+                                                        ),
+                                                        glue.CfnTable.ColumnProperty(
+                                                            name='asset_property_string_value',
                                                             type='string'
                                                         ),
                                                         glue.CfnTable.ColumnProperty(
@@ -114,7 +232,7 @@ class EtlPipeline(Construct):
                                                 name=f'{prefix}_firehose_metadata_glue_table',
                                                 table_type='EXTERNAL_TABLE',
                                                 parameters={
-                                                    'classification': 'json'
+                                                    'classification': 'parquet'
                                                 },
                                                 storage_descriptor=glue.CfnTable.StorageDescriptorProperty(
                                                     columns=[
@@ -151,14 +269,15 @@ class EtlPipeline(Construct):
                                                             type='string'
                                                         )
                                                     ],
-                                                    input_format='org.apache.hadoop.mapred.TextInputFormat',
+                                                    # The symlink file under current/ lists the Parquet snapshot
+                                                    # written by the latest metadata export
+                                                    input_format='org.apache.hadoop.hive.ql.io.SymlinkTextInputFormat',
                                                     output_format='org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat',
-                                                    location=f's3://{self.data_bucket.bucket_name}/asset-metadata/',
+                                                    location=f's3://{self.data_bucket.bucket_name}/asset-metadata/current/',
                                                     serde_info=glue.CfnTable.SerdeInfoProperty(
-                                                        serialization_library='org.openx.data.jsonserde.JsonSerDe',
+                                                        serialization_library='org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe',
                                                         parameters={
-                                                            'serialization.format': '1',
-                                                            'paths': 'asset_id,asset_name,asset_model_id,asset_properties.asset_property_id,asset_properties.asset_property_name,asset_properties.asset_property_data_type,asset_properties.asset_property_unit,asset_properties.asset_property_alias'
+                                                            'serialization.format': '1'
                                                         }
                                                     )
                                                 )
@@ -185,6 +304,7 @@ class EtlPipeline(Construct):
                 effect=iam.Effect.ALLOW,
                 actions=[
                     's3:PutObject',
+                    's3:DeleteObject',
                     's3:GetBucketLocation',
                     's3:GetObject',
                     's3:ListBucket'
@@ -210,6 +330,20 @@ class EtlPipeline(Construct):
 
 
 
+            # Panda Layer from S3 bucket, provides PyArrow to the metadata function and NumPy to the ingest data lambda
+            self.panda_layer_bucket='aws-data-wrangler-public-artifacts'
+            self.panda_layer_key='releases/3.0.0/awswrangler-layer-3.0.0-py3.8.zip'
+            self.panda_layer = _lambda.CfnLayerVersion(
+                self,
+                f'{id}PandaLayer',
+                content=_lambda.CfnLayerVersion.ContentProperty(
+                    s3_bucket=self.panda_layer_bucket,
+                    s3_key=self.panda_layer_key
+                ),
+                layer_name=f'{id}PandaLayer',
+                license_info='Apache-2.0'
+            )
+
             # IoT SiteWise Export To S3 Metadata Function
             self.metadata_function = _lambda.Function(self, f'{id}MetadataFunction',
                 function_name=f'{prefix}_sitewise_metadata_function',
@@ -217,8 +351,14 @@ class EtlPipeline(Construct):
                 handler='asset_metadata_lambda.lambda_handler',
                 code=_lambda.Code.from_asset(METADATA_LAMBDA_PATH),
                 timeout=Duration.seconds(900),
-                memory_size=128,
-                role=self.metadata_function_role
+                memory_size=512,
+                role=self.metadata_function_role,
+                layers=[_lambda.LayerVersion.from_layer_version_arn(self, f'{id}PandaLayerVersion', self.panda_layer.ref)],
+                # One crawl at a time owns the checkpoint and the manifest, scheduled
+                # invocations throttled by a running crawl are dropped after a minute
+                reserved_concurrent_executions=1,
+                max_event_age=Duration.minutes(1),
+                retry_attempts=0
             )
             
             # IoT SiteWise Export To S3 Metadata Scheduled Rule
@@ -229,7 +369,10 @@ class EtlPipeline(Construct):
                     targets.LambdaFunction(self.metadata_function,
                         event=events.RuleTargetInput.from_object({
                             'bucket_name': self.data_bucket.bucket_name,
-                            'key_name_prefix': 'asset-metadata'
+                            'key_name_prefix': 'asset-metadata',
+                            # Only the vessel hierarchy feeds the ETL pipeline
+                            'root_asset_ids': [assets.vessel_asset.ref],
+                            'asset_model_ids': [assets.vessel_model_id, assets.engine_model_id]
                         })
                     )
                 ],
@@ -361,16 +504,25 @@ class EtlPipeline(Construct):
             )
 
             # kinesis firehose delivery stream
-            self.firehose_stream = firehose.CfnDeliveryStream(self, f'{id}FirehoseStream',
-                delivery_stream_name=f'{prefix}_firehose_stream',
+            # Dynamic partitioning can't be enabled on an existing delivery stream, so the stream
+            # has a new logical ID and name to replace the un-partitioned one of earlier deployments,
+            # see Upgrading in the README
+            self.firehose_stream = firehose.CfnDeliveryStream(self, f'{id}PartitionedFirehoseStream',
+                delivery_stream_name=f'{prefix}_partitioned_firehose_stream',
                 delivery_stream_type='DirectPut',
                 extended_s3_destination_configuration=firehose.CfnDeliveryStream.ExtendedS3DestinationConfigurationProperty(
                     role_arn=self.firehose_delivery_role.attr_arn,
                     bucket_arn=self.data_bucket.bucket_arn,
-                    prefix='asset-property-updates/year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/hour=!{timestamp:HH}/',
-                    error_output_prefix='asset-property-errors/',
+                    prefix='asset-property-updates/asset_id=!{partitionKeyFromLambda:asset_id}/dt=!{partitionKeyFromLambda:dt}/hour=!{partitionKeyFromLambda:hour}/',
+                    error_output_prefix='asset-property-errors/!{firehose:error-output-type}/',
+                    dynamic_partitioning_configuration=firehose.CfnDeliveryStream.DynamicPartitioningConfigurationProperty(
+                        enabled=True,
+                        retry_options=firehose.CfnDeliveryStream.RetryOptionsProperty(
+                            duration_in_seconds=300
+                        )
+                    ),
                     buffering_hints=firehose.CfnDeliveryStream.BufferingHintsProperty(
-                        interval_in_seconds=60,
+                        interval_in_seconds=FIREHOSE_BUFFER_INTERVAL_IN_SECONDS,
                         size_in_m_bs=64
                     ),
                     compression_format='UNCOMPRESSED',
@@ -395,7 +547,7 @@ class EtlPipeline(Construct):
                                     ),
                                     firehose.CfnDeliveryStream.ProcessorParameterProperty(
                                         parameter_name='BufferIntervalInSeconds',
-                                        parameter_value='60'
+                                        parameter_value=str(FIREHOSE_PROCESSOR_BUFFER_INTERVAL_IN_SECONDS)
                                     )
                                 ]
                             )
@@ -489,101 +641,50 @@ class EtlPipeline(Construct):
                 )
             )
 
-            # Athena Query Engine0
-            self.athena_query_engine0 = athena.CfnNamedQuery(self, f'{id}AthenaQueryEngine0',
-                database=self.glue_database.ref,
-                description='IoT SiteWise Query Engine',
-                name=f'{prefix}_l4esitewisequery_engine0',
-                query_string=f'''CREATE OR REPLACE VIEW {prefix}_l4esitewisequery_engine0 AS 
-                    SELECT "date_format"("date_trunc"('minute', "timestamp"), '%Y-%m-%dT%H:%i:%S.%f') "Timestamp"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor0') THEN "asset_property_value" ELSE null END)) AS double) "Sensor0"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor1') THEN "asset_property_value" ELSE null END)) AS double) "Sensor1"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor2') THEN "asset_property_value" ELSE null END)) AS double) "Sensor2"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor3') THEN "asset_property_value" ELSE null END)) AS double) "Sensor3"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor4') THEN "asset_property_value" ELSE null END)) AS double) "Sensor4"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor5') THEN "asset_property_value" ELSE null END)) AS double) "Sensor5"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor6') THEN "asset_property_value" ELSE null END)) AS double) "Sensor6"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor7') THEN "asset_property_value" ELSE null END)) AS double) "Sensor7"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor8') THEN "asset_property_value" ELSE null END)) AS double) "Sensor8"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor9') THEN "asset_property_value" ELSE null END)) AS double) "Sensor9"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor10') THEN "asset_property_value" ELSE null END)) AS double) "Sensor10"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor11') THEN "asset_property_value" ELSE null END)) AS double) "Sensor11"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor12') THEN "asset_property_value" ELSE null END)) AS double) "Sensor12"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor13') THEN "asset_property_value" ELSE null END)) AS double) "Sensor13"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor14') THEN "asset_property_value" ELSE null END)) AS double) "Sensor14"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor15') THEN "asset_property_value" ELSE null END)) AS double) "Sensor15"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor16') THEN "asset_property_value" ELSE null END)) AS double) "Sensor16"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor17') THEN "asset_property_value" ELSE null END)) AS double) "Sensor17"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor18') THEN "asset_property_value" ELSE null END)) AS double) "Sensor18"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor19') THEN "asset_property_value" ELSE null END)) AS double) "Sensor19"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor20') THEN "asset_property_value" ELSE null END)) AS double) "Sensor20"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor21') THEN "asset_property_value" ELSE null END)) AS double) "Sensor21"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor22') THEN "asset_property_value" ELSE null END)) AS double) "Sensor22"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor23') THEN "asset_property_value" ELSE null END)) AS double) "Sensor23"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor24') THEN "asset_property_value" ELSE null END)) AS double) "Sensor24"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor25') THEN "asset_property_value" ELSE null END)) AS double) "Sensor25"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor26') THEN "asset_property_value" ELSE null END)) AS double) "Sensor26"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor27') THEN "asset_property_value" ELSE null END)) AS double) "Sensor27"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor28') THEN "asset_property_value" ELSE null END)) AS double) "Sensor28"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor29') THEN "asset_property_value" ELSE null END)) AS double) "Sensor29"
-                    FROM( 
-                    SELECT "from_unixtime"(("time_in_seconds" + ("offset_in_nanos" / 1000000000))) "timestamp"
-                    , "metadata"."asset_name", "metadata"."asset_property_name", "data"."asset_property_value"
-                    , "metadata"."asset_property_unit", "metadata"."asset_property_alias"
-                    FROM ({self.glue_database.ref}.{self.glue_table.ref} data
-                    INNER JOIN {self.glue_database.ref}.{self.glue_metadata_table.ref} metadata ON (("data"."asset_id" = "metadata"."asset_id") AND ("data"."asset_property_id" = "metadata"."asset_property_id")))) 
-                    WHERE (("timestamp" > ("date_trunc"('minute', current_timestamp) - INTERVAL  '6' MINUTE)) AND ("asset_name" = '{assets.engine_asset0_name}')) GROUP BY "timestamp"
+            # Athena Query Engine views, one per engine asset
+            self.athena_queries = []
+            for i, engine_asset in enumerate(assets.engine_assets):
+                self.athena_queries.append(athena.CfnNamedQuery(self, f'{id}AthenaQueryEngine{i}',
+                    database=self.glue_database.ref,
+                    description='IoT SiteWise Query Engine',
+                    name=f'{prefix}_l4esitewisequery_engine{i}',
+                    query_string=get_pivot_view_query(
+                        f'{prefix}_l4esitewisequery_engine{i}',
+                        f'{self.glue_database.ref}.{self.glue_table.ref}',
+                        f'{self.glue_database.ref}.{self.glue_metadata_table.ref}',
+                        [engine_asset.ref],
+                        property_list
+                    ),
+                    work_group=self.athena_workgroup.name
+                ))
 
-                ''',
+            # Athena Query Fleet view, the engine views of all the engine assets in one
+            self.athena_query_fleet = athena.CfnNamedQuery(self, f'{id}AthenaQueryFleet',
+                database=self.glue_database.ref,
+                description='IoT SiteWise Query Fleet',
+                name=f'{prefix}_l4esitewisequery_fleet',
+                query_string=get_pivot_view_query(
+                    f'{prefix}_l4esitewisequery_fleet',
+                    f'{self.glue_database.ref}.{self.glue_table.ref}',
+                    f'{self.glue_database.ref}.{self.glue_metadata_table.ref}',
+                    [engine_asset.ref for engine_asset in assets.engine_assets],
+                    property_list,
+                    by_asset=True
+                ),
                 work_group=self.athena_workgroup.name
             )
 
-            # Athena Query Engine1
-            self.athena_query_engine1 = athena.CfnNamedQuery(self, f'{id}AthenaQueryEngine1',
+            # Athena Query Fleet window template, the engine rows since the inference watermarks
+            self.athena_query_fleet_window = athena.CfnNamedQuery(self, f'{id}AthenaQueryFleetWindow',
                 database=self.glue_database.ref,
-                description='IoT SiteWise Query Engine',
-                name=f'{prefix}_l4esitewisequery_engine1',
-                query_string=f'''CREATE OR REPLACE VIEW {prefix}_l4esitewisequery_engine1 AS 
-                    SELECT "date_format"("date_trunc"('minute', "timestamp"), '%Y-%m-%dT%H:%i:%S.%f') "Timestamp"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor0') THEN "asset_property_value" ELSE null END)) AS double) "Sensor0"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor1') THEN "asset_property_value" ELSE null END)) AS double) "Sensor1"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor2') THEN "asset_property_value" ELSE null END)) AS double) "Sensor2"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor3') THEN "asset_property_value" ELSE null END)) AS double) "Sensor3"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor4') THEN "asset_property_value" ELSE null END)) AS double) "Sensor4"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor5') THEN "asset_property_value" ELSE null END)) AS double) "Sensor5"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor6') THEN "asset_property_value" ELSE null END)) AS double) "Sensor6"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor7') THEN "asset_property_value" ELSE null END)) AS double) "Sensor7"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor8') THEN "asset_property_value" ELSE null END)) AS double) "Sensor8"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor9') THEN "asset_property_value" ELSE null END)) AS double) "Sensor9"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor10') THEN "asset_property_value" ELSE null END)) AS double) "Sensor10"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor11') THEN "asset_property_value" ELSE null END)) AS double) "Sensor11"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor12') THEN "asset_property_value" ELSE null END)) AS double) "Sensor12"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor13') THEN "asset_property_value" ELSE null END)) AS double) "Sensor13"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor14') THEN "asset_property_value" ELSE null END)) AS double) "Sensor14"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor15') THEN "asset_property_value" ELSE null END)) AS double) "Sensor15"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor16') THEN "asset_property_value" ELSE null END)) AS double) "Sensor16"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor17') THEN "asset_property_value" ELSE null END)) AS double) "Sensor17"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor18') THEN "asset_property_value" ELSE null END)) AS double) "Sensor18"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor19') THEN "asset_property_value" ELSE null END)) AS double) "Sensor19"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor20') THEN "asset_property_value" ELSE null END)) AS double) "Sensor20"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor21') THEN "asset_property_value" ELSE null END)) AS double) "Sensor21"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor22') THEN "asset_property_value" ELSE null END)) AS double) "Sensor22"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor23') THEN "asset_property_value" ELSE null END)) AS double) "Sensor23"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor24') THEN "asset_property_value" ELSE null END)) AS double) "Sensor24"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor25') THEN "asset_property_value" ELSE null END)) AS double) "Sensor25"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor26') THEN "asset_property_value" ELSE null END)) AS double) "Sensor26"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor27') THEN "asset_property_value" ELSE null END)) AS double) "Sensor27"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor28') THEN "asset_property_value" ELSE null END)) AS double) "Sensor28"
-                    , CAST("max"((CASE WHEN ("asset_property_name" = 'Sensor29') THEN "asset_property_value" ELSE null END)) AS double) "Sensor29"
-                    FROM( 
-                    SELECT "from_unixtime"(("time_in_seconds" + ("offset_in_nanos" / 1000000000))) "timestamp"
-                    , "metadata"."asset_name", "metadata"."asset_property_name", "data"."asset_property_value"
-                    , "metadata"."asset_property_unit", "metadata"."asset_property_alias"
-                    FROM ({self.glue_database.ref}.{self.glue_table.ref} data
-                    INNER JOIN {self.glue_database.ref}.{self.glue_metadata_table.ref} metadata ON (("data"."asset_id" = "metadata"."asset_id") AND ("data"."asset_property_id" = "metadata"."asset_property_id")))) 
-                    WHERE (("timestamp" > ("date_trunc"('minute', current_timestamp) - INTERVAL  '6' MINUTE)) AND ("asset_name" = '{assets.engine_asset1_name}')) GROUP BY "timestamp"
-
-                ''',
+                description='IoT SiteWise Query Fleet Window',
+                name=f'{prefix}_l4esitewisequery_fleet_window',
+                query_string=get_pivot_window_query(
+                    f'{self.glue_database.ref}.{self.glue_table.ref}',
+                    f'{self.glue_database.ref}.{self.glue_metadata_table.ref}',
+                    [engine_asset.ref for engine_asset in assets.engine_assets],
+                    property_list
+                ),
                 work_group=self.athena_workgroup.name
             )
 
@@ -611,20 +712,6 @@ class EtlPipeline(Construct):
                 )
             )
 
-            # Panda Layer from S3 bucket
-            self.panda_layer_bucket='aws-data-wrangler-public-artifacts'
-            self.panda_layer_key='releases/3.0.0/awswrangler-layer-3.0.0-py3.8.zip'
-            self.panda_layer = _lambda.CfnLayerVersion(
-                self,
-                f'{id}PandaLayer',
-                content=_lambda.CfnLayerVersion.ContentProperty(
-                    s3_bucket=self.panda_layer_bucket,
-                    s3_key=self.panda_layer_key
-                ),
-                layer_name=f'{id}PandaLayer',
-                license_info='Apache-2.0'
-            )
-
             # l4e inference schedule lambda
             self.inference_schedule_function_code = s3_assets.Asset(
                 self,
@@ -641,30 +728,24 @@ class EtlPipeline(Construct):
                     s3_bucket=self.inference_schedule_function_code.s3_bucket_name,
                     s3_key=self.inference_schedule_function_code.s3_object_key
                 ),
-                timeout=180,
+                timeout=INFERENCE_SCHEDULE_TIMEOUT_IN_SECONDS,
                 memory_size=128,
                 role=self.inference_schedule_lambda_execution_role.role_arn,
-                layers=[self.panda_layer.ref],
             )
 
-            self.inference_schedule_lambda_permission0 = _lambda.CfnPermission(self,
-                f'{id}InferenceScheduleLambdaPermission0',
-                function_name=self.inference_schedule_lambda.function_name,
-                action='lambda:InvokeFunction',
-                principal='s3.amazonaws.com',
-                source_account=Aws.ACCOUNT_ID,
-                source_arn=f'arn:aws:s3:::{prefix}-l4e-bucket0'
-            )
-            self.inference_schedule_lambda_permission1 = _lambda.CfnPermission(self,
-                f'{id}InferenceScheduleLambdaPermission1',
-                function_name=self.inference_schedule_lambda.function_name,
-                action='lambda:InvokeFunction',
-                principal='s3.amazonaws.com',
-                source_account=Aws.ACCOUNT_ID,
-                source_arn=f'arn:aws:s3:::{prefix}-l4e-bucket1'
-            )
-            self.inference_schedule_lambda_permission0.add_dependency(self.inference_schedule_lambda)
-            self.inference_schedule_lambda_permission1.add_dependency(self.inference_schedule_lambda)
+            # S3 permissions of the L4E buckets of the engine assets
+            self.inference_schedule_lambda_permissions = []
+            for i, _ in enumerate(assets.engine_assets):
+                inference_schedule_lambda_permission = _lambda.CfnPermission(self,
+                    f'{id}InferenceScheduleLambdaPermission{i}',
+                    function_name=self.inference_schedule_lambda.function_name,
+                    action='lambda:InvokeFunction',
+                    principal='s3.amazonaws.com',
+                    source_account=Aws.ACCOUNT_ID,
+                    source_arn=f'arn:aws:s3:::{prefix}-l4e-bucket{i}'
+                )
+                inference_schedule_lambda_permission.add_dependency(self.inference_schedule_lambda)
+                self.inference_schedule_lambda_permissions.append(inference_schedule_lambda_permission)
 
             # Inference Schedule Lambda Execution Role
             self.l4e_to_sitewise_lambda_permission_role = iam.Role(
@@ -706,104 +787,61 @@ class EtlPipeline(Construct):
                 role=self.l4e_to_sitewise_lambda_permission_role,
             )
 
-            self.l4e_to_sitewise_lambda_permission0 = _lambda.CfnPermission(self,
-                f'{id}L4EToSitewiseLambdaPermission0',
-                function_name=self.l4e_to_sitewise_lambda.function_name,
-                action='lambda:InvokeFunction',
-                principal='s3.amazonaws.com',
-                source_account=Aws.ACCOUNT_ID,
-                source_arn=f'arn:aws:s3:::{prefix}-l4e-bucket0'
-            )
-            self.l4e_to_sitewise_lambda_permission1 = _lambda.CfnPermission(self,
-                f'{id}L4EToSitewiseLambdaPermission1',
-                function_name=self.l4e_to_sitewise_lambda.function_name,
-                action='lambda:InvokeFunction',
-                principal='s3.amazonaws.com',
-                source_account=Aws.ACCOUNT_ID,
-                source_arn=f'arn:aws:s3:::{prefix}-l4e-bucket1'
-            )
-
-            # L4e Bucket Engine0 with event notification
-            self.l4e_bucket0 = s3.CfnBucket(
-                self,
-                f'{id}L4eBucket0',
-                bucket_name=f'{prefix}-l4e-bucket0',
-                public_access_block_configuration=s3.CfnBucket.PublicAccessBlockConfigurationProperty(
-                    block_public_acls=True,
-                    block_public_policy=True,
-                    ignore_public_acls=True,
-                    restrict_public_buckets=True
-                ),
-                notification_configuration=s3.CfnBucket.NotificationConfigurationProperty(
-                    lambda_configurations=[
-                        s3.CfnBucket.LambdaConfigurationProperty(
-                            event='s3:ObjectCreated:Put',
-                            filter=s3.CfnBucket.NotificationFilterProperty(
-                                s3_key=s3.CfnBucket.S3KeyFilterProperty(
-                                    rules=[
-                                        s3.CfnBucket.FilterRuleProperty(
-                                            name='suffix',
-                                            value='.jsonl'
-                                        ),
-                                        s3.CfnBucket.FilterRuleProperty(
-                                            name='prefix',
-                                            value=f'{assets.engine_asset0.ref}/inference-data/output/'
-                                        )
-                                    ]
-                                )
-                            ),
-                            function=self.l4e_to_sitewise_lambda.function_arn
-                        ),
-                                          
-                    ]
+            # L4e Bucket of each engine asset with event notification, in the order of assets.engine_assets
+            self.l4e_to_sitewise_lambda_permissions = []
+            self.l4e_buckets = []
+            for i, engine_asset in enumerate(assets.engine_assets):
+                l4e_to_sitewise_lambda_permission = _lambda.CfnPermission(self,
+                    f'{id}L4EToSitewiseLambdaPermission{i}',
+                    function_name=self.l4e_to_sitewise_lambda.function_name,
+                    action='lambda:InvokeFunction',
+                    principal='s3.amazonaws.com',
+                    source_account=Aws.ACCOUNT_ID,
+                    source_arn=f'arn:aws:s3:::{prefix}-l4e-bucket{i}'
                 )
-            )
-
-            # L4e Bucket asset1 with event notification
-            self.l4e_bucket1 = s3.CfnBucket(
-                self,
-                f'{id}L4eBucket1',
-                bucket_name=f'{prefix}-l4e-bucket1',
-                public_access_block_configuration=s3.CfnBucket.PublicAccessBlockConfigurationProperty(
-                    block_public_acls=True,
-                    block_public_policy=True,
-                    ignore_public_acls=True,
-                    restrict_public_buckets=True
-                ),
-                notification_configuration=s3.CfnBucket.NotificationConfigurationProperty(
-                    lambda_configurations=[
-                        s3.CfnBucket.LambdaConfigurationProperty(
-                            event='s3:ObjectCreated:Put',
-                            filter=s3.CfnBucket.NotificationFilterProperty(
-                                s3_key=s3.CfnBucket.S3KeyFilterProperty(
-                                    rules=[
-                                        s3.CfnBucket.FilterRuleProperty(
-                                            name='suffix',
-                                            value='.jsonl'
-                                        ),
-                                        s3.CfnBucket.FilterRuleProperty(
-                                            name='prefix',
-                                            value=f'{assets.engine_asset1.ref}/inference-data/output/'
-                                        )
-                                    ]
-                                )
-                            ),
-                            function=self.l4e_to_sitewise_lambda.function_arn
-                        )
-                    ]
+                l4e_bucket = s3.CfnBucket(
+                    self,
+                    f'{id}L4eBucket{i}',
+                    bucket_name=f'{prefix}-l4e-bucket{i}',
+                    public_access_block_configuration=s3.CfnBucket.PublicAccessBlockConfigurationProperty(
+                        block_public_acls=True,
+                        block_public_policy=True,
+                        ignore_public_acls=True,
+                        restrict_public_buckets=True
+                    ),
+                    notification_configuration=s3.CfnBucket.NotificationConfigurationProperty(
+                        lambda_configurations=[
+                            s3.CfnBucket.LambdaConfigurationProperty(
+                                event='s3:ObjectCreated:Put',
+                                filter=s3.CfnBucket.NotificationFilterProperty(
+                                    s3_key=s3.CfnBucket.S3KeyFilterProperty(
+                                        rules=[
+                                            s3.CfnBucket.FilterRuleProperty(
+                                                name='suffix',
+                                                value='.jsonl'
+                                            ),
+                                            s3.CfnBucket.FilterRuleProperty(
+                                                name='prefix',
+                                                value=f'{engine_asset.ref}/inference-data/output/'
+                                            )
+                                        ]
+                                    )
+                                ),
+                                function=self.l4e_to_sitewise_lambda.function_arn
+                            )
+                        ]
+                    )
                 )
-            )
-
-
-            self.l4e_bucket0.add_dependency(self.l4e_to_sitewise_lambda_permission0)
-            self.l4e_bucket1.add_dependency(self.l4e_to_sitewise_lambda_permission1)
+                l4e_bucket.add_dependency(l4e_to_sitewise_lambda_permission)
+                self.l4e_to_sitewise_lambda_permissions.append(l4e_to_sitewise_lambda_permission)
+                self.l4e_buckets.append(l4e_bucket)
 
-            # Inference Schedule Lambda Event Rule Engine0
-            self.inference_schedule_lambda_event_rule0 = events.CfnRule(
+            # Inference Schedule Lambda Event Rule, one query of the fleet window per tick for all the engines
+            self.inference_schedule_lambda_event_rule = events.CfnRule(
                 self,
-                f'{id}InferenceScheduleLambdaEventRule0',
-                name=f'{prefix}_inference_schedule_lambda_event_rule0',
-                schedule_expression='rate(5 minutes)',
+                f'{id}InferenceScheduleLambdaEventRule',
+                name=f'{prefix}_inference_schedule_lambda_event_rule',
+                schedule_expression=f'rate({INFERENCE_UPLOAD_FREQUENCY_IN_MINUTES} minutes)',
                 state='ENABLED',
                 targets=[
                     events.CfnRule.TargetProperty(
@@ -811,56 +849,30 @@ class EtlPipeline(Construct):
                         id='Target0',
                         input=json.dumps({
                             'athena_output_bucket': self.data_bucket.bucket_name,
-                            'view_query_id': self.athena_query_engine0.ref,
-                            'l4e_bucket': self.l4e_bucket0.bucket_name,
-                            'assetId': assets.engine_asset0.ref,
+                            'view_query_id': self.athena_query_fleet.ref,
+                            'window_query_id': self.athena_query_fleet_window.ref,
+                            'grace_period_in_minutes': INFERENCE_GRACE_PERIOD_IN_MINUTES,
+                            'watermark_key': 'inference-state/watermarks.json',
+                            'assets': [
+                                {
+                                    'assetId': engine_asset.ref,
+                                    'asset_name': 'engine',
+                                    'l4e_bucket': l4e_bucket.bucket_name,
+                                }
+                                for engine_asset, l4e_bucket in zip(assets.engine_assets, self.l4e_buckets)
+                            ],
                             'work_group': self.athena_workgroup.name,
                             'database': self.glue_database.ref,
-                            'asset_name': 'engine',
                         })
                     )
                 ]
             )
-            # Lambda Permission for Inference Schedule Lambda Event Rule Engine0
-            self.inference_schedule_lambda_event_rule0_permission = _lambda.CfnPermission(
-                self,
-                f'{id}InferenceScheduleLambdaEventRule0Permission',
-                action='lambda:InvokeFunction',
-                function_name=self.inference_schedule_lambda.ref,
-                principal='events.amazonaws.com',
-                source_arn=self.inference_schedule_lambda_event_rule0.attr_arn
-            )
-
-            # Inference Schedule Lambda Event Rule Engine1
-            self.inference_schedule_lambda_event_rule1 = events.CfnRule(
-                self,
-                f'{id}InferenceScheduleLambdaEventRule1',
-                name=f'{prefix}_inference_schedule_lambda_event_rule1',
-                schedule_expression='rate(5 minutes)',
-                state='ENABLED',
-                targets=[
-                    events.CfnRule.TargetProperty(
-                        arn=self.inference_schedule_lambda.attr_arn,
-                        id='Target1',
-                        input=json.dumps({
-                            'athena_output_bucket': self.data_bucket.bucket_name,
-                            'view_query_id': self.athena_query_engine1.ref,
-                            'l4e_bucket': self.l4e_bucket1.bucket_name,
-                            'assetId': assets.engine_asset1.ref,
-                            'work_group': self.athena_workgroup.name,
-                            'database': self.glue_database.ref,
-                            'asset_name': 'engine',
-                        })
-                    )
-                ]
-            )
-
-            # Lambda Permission for Inference Schedule Lambda Event Rule Engine1
-            self.inference_schedule_lambda_event_rule1_permission = _lambda.CfnPermission(
+            # Lambda Permission for Inference Schedule Lambda Event Rule
+            self.inference_schedule_lambda_event_rule_permission = _lambda.CfnPermission(
                 self,
-                f'{id}InferenceScheduleLambdaEventRule1Permission',
+                f'{id}InferenceScheduleLambdaEventRulePermission',
                 action='lambda:InvokeFunction',
                 function_name=self.inference_schedule_lambda.ref,
                 principal='events.amazonaws.com',
-                source_arn=self.inference_schedule_lambda_event_rule1.attr_arn
+                source_arn=self.inference_schedule_lambda_event_rule.attr_arn
             )
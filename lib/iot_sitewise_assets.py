@@ -53,6 +53,7 @@ class TwoEngineVesselIoTSiteWiseAsset(Construct):
             asset_name=self.engine_asset1_name,
             asset_properties=asset_properties
         )
+        self.engine_assets = [self.engine_asset0, self.engine_asset1]
         self.vessel_asset = iotsitewise.CfnAsset(self, f'{id}VesselAsset',
             asset_model_id=self.vessel_model_id,
             asset_name=self.vessel_asset_name,
@@ -1,5 +1,9 @@
+import os
 from aws_cdk import (
     Duration,
+    RemovalPolicy,
+    Stage,
+    aws_dynamodb as dynamodb,
     aws_iotsitewise as iotsitewise,
     aws_s3_assets as s3_assets,
     aws_lambda as _lambda,
@@ -11,8 +15,18 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+from lib.replay_dataset import write_replay_dataset
+
 INGEST_DATA_LAMBDA_PATH = "lambda/ingest_data"
 
+# One ingest invocation per (asset, property) or per group of assets
+INGEST_MODE_PROPERTY = "property"
+INGEST_MODE_ASSET = "asset"
+
+# Asset data uploaded as the raw JSON files or as columnar replay datasets
+ASSET_DATA_FORMAT_JSON = "json"
+ASSET_DATA_FORMAT_COLUMNAR = "columnar"
+
 class DataIngestToIoTSiteWiseAsset(Construct):
     """
     This construct creates a state machine to ingest data to IoT SiteWise asset
@@ -32,30 +46,56 @@ class DataIngestToIoTSiteWiseAsset(Construct):
                     "data": "data/EngineAsset1.txt"
                 }
             ]
+        ingest_mode (str): INGEST_MODE_ASSET to ingest all properties of
+            assets_per_invocation assets in one lambda invocation,
+            INGEST_MODE_PROPERTY to ingest one property per invocation
+        assets_per_invocation (int): Number of assets per invocation in INGEST_MODE_ASSET
+        asset_data_format (str): ASSET_DATA_FORMAT_COLUMNAR to convert the asset data
+            files to columnar replay datasets at synth time, ASSET_DATA_FORMAT_JSON
+            to upload them as they are
+        numpy_layer_arn (str): ARN of a layer providing NumPy to the ingest data
+            lambda, such as the AWS SDK for pandas layer of the ETL pipeline
     """
 
-    def __init__(self, scope: Construct, id: str, property_list: list, asset_data: dict, *, prefix=None):
+    def __init__(self, scope: Construct, id: str, property_list: list, asset_data: dict, *, numpy_layer_arn: str,
+                 prefix=None, ingest_mode=INGEST_MODE_ASSET, assets_per_invocation=1,
+                 asset_data_format=ASSET_DATA_FORMAT_COLUMNAR):
         super().__init__(scope, id)
+        self.numpy_layer_arn = numpy_layer_arn
         self.asset_data = asset_data
         self.property_list = property_list
+        self.ingest_mode = ingest_mode
+        self.assets_per_invocation = assets_per_invocation
+        self.asset_data_format = asset_data_format
 
         self.ingest_data_lambda = self._create_ingest_data_lambda()
         self.s3_asset_data = self._store_asset_data_in_s3()
         self.property_list_and_s3_asset_data = self._merge_property_list_and_s3_asset_data()
         self.ingest_data_state_machine = self._create_ingest_data_step_function()
+        self.backfill_state_machine = self._create_backfill_step_function()
 
     # function to Store asset data in S3 with read permissions to ingest data lambda
     def _store_asset_data_in_s3(self):
         asset_data = []
+        if self.asset_data_format == ASSET_DATA_FORMAT_COLUMNAR:
+            # Rewritten on every synth, next to the staged assets of the cloud assembly
+            replay_dataset_dir = os.path.join(Stage.of(self).outdir, "replay-datasets")
+            os.makedirs(replay_dataset_dir, exist_ok=True)
         for asset in self.asset_data:
+            data_path = asset["data_path"]
+            if self.asset_data_format == ASSET_DATA_FORMAT_COLUMNAR:
+                data_path = write_replay_dataset(data_path,
+                    os.path.join(replay_dataset_dir, os.path.basename(data_path) + ".bin")
+                )
             asset_obj = s3_assets.Asset(self, f'AssetData{asset["asset_id"]}',
-                path=asset["data_path"]
+                path=data_path
             )
             asset_data.append(
                 {
                     "asset_id": asset["asset_id"],
                     "asset_data_path": asset_obj.s3_object_key,
-                    "asset_data_bucket": asset_obj.s3_bucket_name
+                    "asset_data_bucket": asset_obj.s3_bucket_name,
+                    "asset_data_format": self.asset_data_format
                 }
             )
             asset_obj.grant_read(self.ingest_data_lambda)
@@ -63,13 +103,25 @@ class DataIngestToIoTSiteWiseAsset(Construct):
     
     # function to ingest data to IoT SiteWise
     def _create_ingest_data_lambda(self):
+        # Fleet wide SiteWise API quotas leased by every ingest data lambda container
+        self.quota_table = dynamodb.Table(self, "QuotaTable",
+            partition_key=dynamodb.Attribute(name="pk", type=dynamodb.AttributeType.STRING),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            time_to_live_attribute="expires_at",
+            removal_policy=RemovalPolicy.DESTROY
+        )
         ingest_data_lambda  = _lambda.Function(self, "IngestDataLambda",
             code=_lambda.Code.from_asset(INGEST_DATA_LAMBDA_PATH),
             handler="index.handler",
             runtime=_lambda.Runtime.PYTHON_3_8,
             timeout=Duration.seconds(90),
             memory_size=512,
+            layers=[_lambda.LayerVersion.from_layer_version_arn(self, "NumpyLayerVersion", self.numpy_layer_arn)],
+            environment={
+                "QUOTA_TABLE_NAME": self.quota_table.table_name,
+            },
         )
+        self.quota_table.grant_read_write_data(ingest_data_lambda)
         # Lambda function permissions to ingest data to IoT SiteWise
         ingest_data_lambda.add_to_role_policy(
             iam.PolicyStatement(
@@ -84,16 +136,32 @@ class DataIngestToIoTSiteWiseAsset(Construct):
     
     # function to merge property list and s3 asset data
     def _merge_property_list_and_s3_asset_data(self):
-        assets_properties = []
-        for asset in self.s3_asset_data:
-            for propoerty_name in self.property_list:
-                assets_properties.append({
-                    "property_to_put_data": propoerty_name,
-                    "asset_id": asset["asset_id"],
-                    "asset_data_bucket": asset["asset_data_bucket"],
-                    "asset_data_path": asset["asset_data_path"],
-                })
-        return assets_properties
+        if self.ingest_mode == INGEST_MODE_PROPERTY:
+            assets_properties = []
+            for asset in self.s3_asset_data:
+                for propoerty_name in self.property_list:
+                    assets_properties.append({
+                        "property_to_put_data": propoerty_name,
+                        "asset_id": asset["asset_id"],
+                        "asset_data_bucket": asset["asset_data_bucket"],
+                        "asset_data_path": asset["asset_data_path"],
+                        "asset_data_format": asset["asset_data_format"],
+                    })
+            return assets_properties
+        assets = [
+            {
+                "asset_id": asset["asset_id"],
+                "asset_data_bucket": asset["asset_data_bucket"],
+                "asset_data_path": asset["asset_data_path"],
+                "asset_data_format": asset["asset_data_format"],
+                "properties": self.property_list,
+            }
+            for asset in self.s3_asset_data
+        ]
+        return [
+            {"assets": assets[i:i + self.assets_per_invocation]}
+            for i in range(0, len(assets), self.assets_per_invocation)
+        ]
     
     # Step function to ingest data to IoT SiteWise
     def _create_ingest_data_step_function(self):
@@ -118,4 +186,79 @@ class DataIngestToIoTSiteWiseAsset(Construct):
             schedule=events.Schedule.expression("cron(* * * * ? *)"),
             targets=[targets.SfnStateMachine(ingest_data_state_machine)]
         )
-        return ingest_data_state_machine
\ No newline at end of file
+        return ingest_data_state_machine
+    # Step function to backfill a historical time range, started with {"start_time": ..., "end_time": ...}
+    # and optionally "cursor" to resume a previous backfill
+    def _create_backfill_step_function(self):
+        assets = [
+            {
+                "asset_id": asset["asset_id"],
+                "asset_data_bucket": asset["asset_data_bucket"],
+                "asset_data_path": asset["asset_data_path"],
+                "asset_data_format": asset["asset_data_format"],
+                "properties": self.property_list,
+            }
+            for asset in self.s3_asset_data
+        ]
+        start_step = sfn.Pass(self, "BackfillStart",
+            parameters={
+                "mode": "backfill",
+                "start_time.$": "$.start_time",
+                "end_time.$": "$.end_time",
+                "cursor.$": "$.start_time",
+                "assets": assets
+            }
+        )
+        resume_step = sfn.Pass(self, "BackfillResume",
+            parameters={
+                "mode": "backfill",
+                "start_time.$": "$.start_time",
+                "end_time.$": "$.end_time",
+                "cursor.$": "$.cursor",
+                "assets": assets
+            }
+        )
+        backfill_step = sfn_tasks.LambdaInvoke(self, "Backfill",
+            lambda_function=self.ingest_data_lambda,
+            result_selector={
+                "cursor.$": "$.Payload.cursor",
+                "complete.$": "$.Payload.complete"
+            },
+            result_path="$.BackfillResult"
+        )
+        # Lambda.Unknown and Sandbox.Timedout are reported for invocations that time out,
+        # the retry resumes from the same cursor
+        backfill_step.add_retry(
+            errors=["Lambda.TooManyRequestsException", "Lambda.Unknown", "Sandbox.Timedout"],
+            interval=Duration.seconds(5),
+            max_attempts=3,
+            backoff_rate=2
+        )
+        next_cursor_step = sfn.Pass(self, "BackfillNextCursor",
+            parameters={
+                "mode.$": "$.mode",
+                "start_time.$": "$.start_time",
+                "end_time.$": "$.end_time",
+                "cursor.$": "$.BackfillResult.cursor",
+                "assets.$": "$.assets"
+            }
+        )
+        backfill_step.next(
+            sfn.Choice(self, "Backfill Complete?").when(
+                sfn.Condition.boolean_equals("$.BackfillResult.complete", True),
+                sfn.Succeed(self, "Backfill Succeeded")
+            ).otherwise(
+                next_cursor_step.next(backfill_step)
+            )
+        )
+        cfn_chain = sfn.Chain.start(
+            sfn.Choice(self, "Resume Backfill?").when(
+                sfn.Condition.is_present("$.cursor"),
+                resume_step.next(backfill_step)
+            ).otherwise(
+                start_step.next(backfill_step)
+            )
+        )
+        return sfn.StateMachine(self, "BackfillStateMachine",
+            definition=cfn_chain
+        )
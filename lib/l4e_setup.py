@@ -11,6 +11,8 @@ from aws_cdk import (
 )
 from constructs import Construct
 
+from lib.etl_pipeline import INFERENCE_DATA_DELAY_OFFSET_IN_MINUTES, INFERENCE_UPLOAD_FREQUENCY_IN_MINUTES
+
 L4E_DATASET_LAMBDA_PATH = "lambda/l4e_dataset"
 
 
@@ -195,8 +197,9 @@ class L4ESetup(Construct):
                 "ModelName": sfn.JsonPath.string_at("$.Input.Name"),
                 "ClientToken": sfn.JsonPath.string_at("$.Input.Name"),
                 "InferenceSchedulerName": sfn.JsonPath.string_at("$.Input.Name"),
-                "DataDelayOffsetInMinutes": 2,
-                "DataUploadFrequency": "PT5M",
+                # Waits for the inference input written by the inference schedule of the ETL pipeline
+                "DataDelayOffsetInMinutes": INFERENCE_DATA_DELAY_OFFSET_IN_MINUTES,
+                "DataUploadFrequency": f"PT{INFERENCE_UPLOAD_FREQUENCY_IN_MINUTES}M",
                 
                 "RoleArn": self.sfn_iam_role_arn.role_arn,
                 "DataInputConfiguration": {
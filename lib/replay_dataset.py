@@ -0,0 +1,58 @@
+"""
+Converts asset data files to the columnar replay dataset read by the ingest data lambda.
+
+Layout (little endian):
+    8 bytes   magic b"SWREPLAY"
+    4 bytes   uint32 length of the JSON header
+    n bytes   JSON header {"version": 1, "dtype": "<f4", "sensors": {name: {"offset": int, "length": int}}}
+    padding   to an 8 byte boundary
+    float32 array of every sensor, at the byte offset recorded in the header
+"""
+import json
+import struct
+import sys
+from array import array
+
+MAGIC = b"SWREPLAY"
+VERSION = 1
+PREFIX_SIZE = len(MAGIC) + 4
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def write_replay_dataset(asset_data_path, output_path):
+    """Writes the columnar replay dataset of a JSON asset data file and returns output_path."""
+    with open(asset_data_path) as f:
+        asset_data = json.load(f)
+
+    sensor_arrays = {}
+    for sensor_name, values in asset_data.items():
+        sensor_array = array("f", values)
+        if sys.byteorder == "big":
+            sensor_array.byteswap()
+        sensor_arrays[sensor_name] = sensor_array
+
+    # Offsets depend on the header length, which depends on the offsets,
+    # so grow the data start until the header fits in front of it.
+    data_start = _align(PREFIX_SIZE)
+    while True:
+        sensors = {}
+        offset = data_start
+        for sensor_name, sensor_array in sensor_arrays.items():
+            sensors[sensor_name] = {"offset": offset, "length": len(sensor_array)}
+            offset += len(sensor_array) * sensor_array.itemsize
+        header = json.dumps({"version": VERSION, "dtype": "<f4", "sensors": sensors}).encode("utf-8")
+        if PREFIX_SIZE + len(header) <= data_start:
+            break
+        data_start = _align(PREFIX_SIZE + len(header))
+
+    with open(output_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.write(b"\0" * (data_start - PREFIX_SIZE - len(header)))
+        for sensor_array in sensor_arrays.values():
+            sensor_array.tofile(f)
+    return output_path
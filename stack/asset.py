@@ -54,13 +54,15 @@ class AwsAssetStack(Stack):
             }
         ]
 
+        etl_pipeline = EtlPipeline(self, "EtlPipeline", assets=vessel_asset, property_list=self.property_list, prefix="etlpipeline",)
+
+        # The ingest data lambda gets NumPy from the AWS SDK for pandas layer of the ETL pipeline
         ingestion_construct = DataIngestToIoTSiteWiseAsset(self, "DataIngestToIoTSiteWiseAsset",
             self.property_list,
-            engine_asset_data
+            engine_asset_data,
+            numpy_layer_arn=etl_pipeline.panda_layer.ref
         )
 
-        etl_pipeline = EtlPipeline(self, "EtlPipeline", assets=vessel_asset, prefix="etlpipeline",)
-
         # notebook = SiteWiseNotebook(self, "SiteWiseNotebook", prefix="sitewisenotebook")
 
         l4e_inference = L4ESetup(self, "L4ETrain", self.property_list, engine_asset_data, prefix="l4etrain")
@@ -0,0 +1,38 @@
+import pytest
+
+
+class FakeClock(object):
+    """A monotonic clock that only moves when slept on or advanced."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeContext(object):
+    """A lambda context whose remaining time runs down with a fake clock."""
+
+    def __init__(self, timeout_in_seconds, clock):
+        self.deadline = clock.now + timeout_in_seconds
+        self.clock = clock
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - self.clock.now) * 1000)
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def lambda_context(fake_clock):
+    """Returns a factory of lambda contexts timing out timeout_in_seconds from now on fake_clock."""
+    return lambda timeout_in_seconds: FakeContext(timeout_in_seconds, fake_clock)
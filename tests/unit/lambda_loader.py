@@ -0,0 +1,27 @@
+"""
+Imports the modules of the lambda functions, which import their siblings by plain name.
+"""
+import importlib.util
+import os
+import sys
+
+LAMBDA_ROOT = os.path.join(os.path.dirname(__file__), '..', '..', 'lambda')
+
+
+def load_lambda_module(lambda_name, module_name):
+    """Returns module_name of lambda/<lambda_name>, imported with its directory on sys.path.
+
+    The module is registered as <lambda_name>.<module_name>, so modules of the same
+    name in different lambdas don't clash.
+    """
+    lambda_path = os.path.abspath(os.path.join(LAMBDA_ROOT, lambda_name))
+    qualified_name = f'{lambda_name}.{module_name}'
+    if qualified_name in sys.modules:
+        return sys.modules[qualified_name]
+    if lambda_path not in sys.path:
+        sys.path.insert(0, lambda_path)
+    spec = importlib.util.spec_from_file_location(qualified_name, os.path.join(lambda_path, module_name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[qualified_name] = module
+    spec.loader.exec_module(module)
+    return module
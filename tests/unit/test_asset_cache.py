@@ -0,0 +1,79 @@
+import io
+
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_loader import load_lambda_module
+
+asset_cache = load_lambda_module('ingest_data', 'asset_cache')
+
+
+class FakeS3(object):
+    def __init__(self, body, etag):
+        self.body = body
+        self.etag = etag
+        self.requests = []
+
+    def get_object(self, **request):
+        self.requests.append(request)
+        if request.get('IfNoneMatch') == self.etag:
+            raise ClientError({'Error': {'Code': '304'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.body), 'ETag': self.etag, 'ContentLength': len(self.body)}
+
+
+def test_get_asset_data_decodes_once_and_revalidates():
+    asset_cache.asset_data_cache.clear()
+    s3 = FakeS3(b'{"Sensor0": [1.0, 2.0]}', '"etag0"')
+    loads = []
+
+    def loader(body):
+        loads.append(body)
+        return {'Sensor0': [1.0, 2.0]}
+
+    for _ in range(3):
+        assert asset_cache.get_asset_data(s3, 'bucket', 'key', loader=loader) == {'Sensor0': [1.0, 2.0]}
+    assert len(loads) == 1
+    assert [request.get('IfNoneMatch') for request in s3.requests] == [None, '"etag0"', '"etag0"']
+
+
+def test_get_asset_data_reloads_changed_data():
+    asset_cache.asset_data_cache.clear()
+    s3 = FakeS3(b'{"Sensor0": [1.0]}', '"etag0"')
+    assert asset_cache.get_asset_data(s3, 'bucket', 'key') == {'Sensor0': [1.0]}
+    s3.body, s3.etag = b'{"Sensor0": [2.0]}', '"etag1"'
+    assert asset_cache.get_asset_data(s3, 'bucket', 'key') == {'Sensor0': [2.0]}
+
+
+def load_bytes(body):
+    return body.read()
+
+
+def test_get_asset_data_evicts_the_least_recently_used(monkeypatch):
+    asset_cache.asset_data_cache.clear()
+    monkeypatch.setattr(asset_cache, 'ASSET_DATA_CACHE_BYTES', 250)
+    s3 = FakeS3(b'x' * 100, '"etag0"')
+    for key in ('asset0', 'asset1', 'asset0', 'asset2'):
+        asset_cache.get_asset_data(s3, 'bucket', key, loader=load_bytes, expansion_factor=1)
+    assert list(asset_cache.asset_data_cache) == [('bucket', 'asset0'), ('bucket', 'asset2')]
+    # asset1 was evicted and is downloaded again
+    asset_cache.get_asset_data(s3, 'bucket', 'asset1', loader=load_bytes, expansion_factor=1)
+    assert s3.requests[-1] == {'Bucket': 'bucket', 'Key': 'asset1'}
+    assert list(asset_cache.asset_data_cache) == [('bucket', 'asset2'), ('bucket', 'asset1')]
+
+
+def test_get_asset_data_does_not_cache_files_larger_than_the_cache(monkeypatch):
+    asset_cache.asset_data_cache.clear()
+    monkeypatch.setattr(asset_cache, 'ASSET_DATA_CACHE_BYTES', 250)
+    s3 = FakeS3(b'x' * 100, '"etag0"')
+    asset_cache.get_asset_data(s3, 'bucket', 'small', loader=load_bytes, expansion_factor=1)
+    assert asset_cache.get_asset_data(s3, 'bucket', 'large', loader=load_bytes) == b'x' * 100
+    assert list(asset_cache.asset_data_cache) == [('bucket', 'small')]
+
+
+def test_get_asset_data_drops_stale_copies(monkeypatch):
+    asset_cache.asset_data_cache.clear()
+    monkeypatch.setattr(asset_cache, 'ASSET_DATA_CACHE_BYTES', 150)
+    s3 = FakeS3(b'x' * 100, '"etag0"')
+    asset_cache.get_asset_data(s3, 'bucket', 'asset0', loader=load_bytes, expansion_factor=1)
+    s3.body, s3.etag = b'y' * 100, '"etag1"'
+    assert asset_cache.get_asset_data(s3, 'bucket', 'asset0', loader=load_bytes, expansion_factor=1) == b'y' * 100
+    assert asset_cache.asset_data_cache[('bucket', 'asset0')][0] == '"etag1"'
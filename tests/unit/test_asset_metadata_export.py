@@ -0,0 +1,221 @@
+import datetime
+import io
+import json
+import os
+import threading
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_loader import load_lambda_module
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+pq = pytest.importorskip('pyarrow.parquet')
+asset_metadata_lambda = load_lambda_module('asset_metadata', 'asset_metadata_lambda')
+
+LAST_UPDATE_DATE = datetime.datetime(2024, 1, 1)
+
+
+class FakeS3(object):
+    def __init__(self):
+        self.objects = {}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body.encode('utf-8') if isinstance(Body, str) else Body
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+class FakeSiteWise(object):
+    """Assets of one asset model, listed page_size at a time."""
+
+    def __init__(self, num_assets, page_size=2):
+        self.assets = {f'asset{i}': LAST_UPDATE_DATE for i in range(num_assets)}
+        self.page_size = page_size
+        self.described = []
+
+    def list_asset_models(self, maxResults, nextToken=None):
+        return {'assetModelSummaries': [{'id': 'engine_model'}]}
+
+    def list_assets(self, assetModelId, maxResults, nextToken=None):
+        asset_ids = sorted(self.assets)
+        start = int(nextToken or 0)
+        response = {'assetSummaries': [{'id': asset_id, 'name': asset_id, 'assetModelId': assetModelId,
+                                        'lastUpdateDate': self.assets[asset_id]}
+                                       for asset_id in asset_ids[start:start + self.page_size]]}
+        if start + self.page_size < len(asset_ids):
+            response['nextToken'] = str(start + self.page_size)
+        return response
+
+    def describe_asset(self, assetId):
+        self.described.append(assetId)
+        return {'assetProperties': [{'id': f'{assetId}-property', 'name': 'Sensor0', 'dataType': 'DOUBLE'}]}
+
+
+class SlowSiteWise(FakeSiteWise):
+    """Takes describe_time seconds of clock to describe an asset."""
+
+    def __init__(self, num_assets, page_size, clock, describe_time):
+        super(SlowSiteWise, self).__init__(num_assets, page_size)
+        self.clock = clock
+        self.describe_time = describe_time
+        self.lock = threading.Lock()
+
+    def describe_asset(self, assetId):
+        with self.lock:
+            self.clock.now += self.describe_time
+        return super(SlowSiteWise, self).describe_asset(assetId)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(asset_metadata_lambda, 's3', s3)
+    return s3
+
+
+@pytest.fixture
+def run_handler(monkeypatch, lambda_context):
+    """Returns a function running the handler once a minute, in invocations of timeout_in_seconds."""
+    wall_clock = SimpleNamespace(now=1.7e9)
+    monkeypatch.setattr(asset_metadata_lambda, 'time', SimpleNamespace(time=lambda: wall_clock.now))
+    # The deadlines set by the handler are cleared after the test
+    for policy in (asset_metadata_lambda.retry_policy, asset_metadata_lambda.write_retry_policy):
+        monkeypatch.setattr(policy, 'deadline', None)
+
+    def run_handler(event, timeout_in_seconds=900):
+        asset_metadata_lambda.lambda_handler(event, lambda_context(timeout_in_seconds))
+        wall_clock.now += 60
+    return run_handler
+
+
+def read_snapshot(s3, bucket_name, key_name_prefix):
+    """Returns the table read through the symlink file, like the Glue table does."""
+    symlink = s3.objects[(bucket_name, key_name_prefix + '/current/symlink.txt')].decode('utf-8')
+    snapshot_location, = symlink.splitlines()
+    snapshot_bucket, snapshot_key = snapshot_location[len('s3://'):].split('/', 1)
+    return pq.read_table(io.BytesIO(s3.objects[(snapshot_bucket, snapshot_key)]))
+
+
+def test_snapshot_is_read_by_the_glue_metadata_table(monkeypatch, s3, run_handler):
+    import aws_cdk as cdk
+    from aws_cdk.assertions import Template
+    from lib.etl_pipeline import EtlPipeline
+
+    app = cdk.App()
+    stack = cdk.Stack(app, 'EtlPipelineStack')
+    assets = SimpleNamespace(engine_assets=[SimpleNamespace(ref='engine0')], vessel_asset=SimpleNamespace(ref='vessel'),
+                             vessel_model_id='vessel_model', engine_model_id='engine_model')
+    EtlPipeline(stack, 'EtlPipeline', assets=assets, property_list=['Sensor0'], prefix='etlpipeline')
+    template = Template.from_stack(stack)
+    # References, like the data bucket name, are replaced by a placeholder
+    join = lambda value: value if isinstance(value, str) else ''.join(
+        part if isinstance(part, str) else 'reference' for part in value['Fn::Join'][1])
+    rule, = template.find_resources('AWS::Events::Rule', {'Properties': {'Name': 'etlpipeline_sitewise_metadata_rule'}}).values()
+    event = json.loads(join(rule['Properties']['Targets'][0]['Input']))
+    table, = template.find_resources('AWS::Glue::Table', {'Properties': {'TableInput': {
+        'Name': 'etlpipeline_firehose_metadata_glue_table'}}}).values()
+    storage_descriptor = table['Properties']['TableInput']['StorageDescriptor']
+    assert storage_descriptor['InputFormat'] == 'org.apache.hadoop.hive.ql.io.SymlinkTextInputFormat'
+
+    # The rule walks the vessel hierarchy, the table only sees the exported records
+    monkeypatch.setattr(asset_metadata_lambda, 'sitewise', FakeSiteWise(num_assets=3))
+    del event['root_asset_ids']
+    run_handler(dict(event, asset_model_ids=['engine_model']))
+
+    location = join(storage_descriptor['Location'])
+    symlinks = [key for bucket_name, key in s3.objects
+                if 's3://' + bucket_name + '/' + key == location + 'symlink.txt']
+    assert symlinks == [event['key_name_prefix'] + '/current/symlink.txt']
+    # SymlinkTextInputFormat reads every file under the location, the snapshots are kept out of it
+    assert [key for _, key in s3.objects if ('s3://reference/' + key).startswith(location)] == symlinks
+    snapshot = read_snapshot(s3, event['bucket_name'], event['key_name_prefix'])
+    assert [(field.name, str(field.type)) for field in snapshot.schema] == \
+        [(column['Name'], column['Type']) for column in storage_descriptor['Columns']]
+    assert snapshot.column('asset_property_id').to_pylist() == [f'asset{i}-property' for i in range(3)]
+
+
+def load_manifest(s3):
+    return json.loads(s3.objects[('bucket', 'asset-metadata-state/manifest.json')])
+
+
+def test_unchanged_assets_are_not_described_again(monkeypatch, s3, run_handler):
+    sitewise = FakeSiteWise(num_assets=5)
+    monkeypatch.setattr(asset_metadata_lambda, 'sitewise', sitewise)
+    event = {'bucket_name': 'bucket', 'key_name_prefix': 'asset-metadata'}
+    run_handler(event)
+    assert sorted(sitewise.described) == [f'asset{i}' for i in range(5)]
+    snapshot_keys = load_manifest(s3)['snapshot_keys']
+
+    sitewise.described = []
+    run_handler(event)
+    assert sitewise.described == []
+    # Nothing changed, so no snapshot is written
+    assert load_manifest(s3)['snapshot_keys'] == snapshot_keys
+
+    sitewise.assets['asset2'] = LAST_UPDATE_DATE + datetime.timedelta(days=1)
+    run_handler(event)
+    assert sitewise.described == ['asset2']
+
+
+def test_deleted_assets_are_pruned(monkeypatch, s3, run_handler):
+    sitewise = FakeSiteWise(num_assets=5)
+    monkeypatch.setattr(asset_metadata_lambda, 'sitewise', sitewise)
+    event = {'bucket_name': 'bucket', 'key_name_prefix': 'asset-metadata'}
+    run_handler(event)
+
+    del sitewise.assets['asset1']
+    run_handler(event)
+    assert sorted(load_manifest(s3)['assets']) == ['asset0', 'asset2', 'asset3', 'asset4']
+    snapshot = read_snapshot(s3, 'bucket', 'asset-metadata')
+    assert snapshot.column('asset_id').to_pylist() == ['asset0', 'asset2', 'asset3', 'asset4']
+
+
+def test_v1_manifest_is_upgraded(monkeypatch, s3, run_handler):
+    sitewise = FakeSiteWise(num_assets=3)
+    monkeypatch.setattr(asset_metadata_lambda, 'sitewise', sitewise)
+    # The manifest of the per asset files, without records to build a snapshot from
+    s3.put_object(Bucket='bucket', Key='asset-metadata-state/manifest.json', Body=json.dumps({
+        'full_refresh_at': 1.7e9 - 60,
+        'assets': {f'asset{i}': {'last_update_date': LAST_UPDATE_DATE.isoformat(), 'hash': 'hash'} for i in range(3)},
+    }))
+    run_handler({'bucket_name': 'bucket', 'key_name_prefix': 'asset-metadata'})
+
+    assert sorted(sitewise.described) == ['asset0', 'asset1', 'asset2']
+    manifest = load_manifest(s3)
+    assert manifest['version'] == asset_metadata_lambda.MANIFEST_VERSION
+    assert manifest['assets']['asset1']['records'][0]['asset_property_id'] == 'asset1-property'
+    assert read_snapshot(s3, 'bucket', 'asset-metadata').num_rows == 3
+
+
+def test_crawl_is_resumed_from_its_checkpoint(monkeypatch, s3, fake_clock, run_handler):
+    sitewise = SlowSiteWise(num_assets=10, page_size=3, clock=fake_clock, describe_time=10)
+    monkeypatch.setattr(asset_metadata_lambda, 'sitewise', sitewise)
+    for policy in (asset_metadata_lambda.retry_policy, asset_metadata_lambda.write_retry_policy):
+        monkeypatch.setattr(policy, '_clock', fake_clock)
+    event = {'bucket_name': 'bucket', 'key_name_prefix': 'asset-metadata'}
+    checkpoint_key = ('bucket', 'asset-metadata-state/checkpoint.json')
+
+    # The deadline is 30s into each invocation of 60s, about 3 assets in
+    run_handler(event, timeout_in_seconds=60)
+    assert checkpoint_key in s3.objects
+    assert 0 < len(load_manifest(s3)['assets']) < 10
+    invocations = 1
+    while checkpoint_key in s3.objects:
+        assert invocations < 10
+        run_handler(event, timeout_in_seconds=60)
+        invocations += 1
+
+    assert invocations > 2
+    assert Counter(sitewise.described) == {f'asset{i}': 1 for i in range(10)}
+    assert sorted(load_manifest(s3)['assets']) == sorted(sitewise.assets)
+    snapshot = read_snapshot(s3, 'bucket', 'asset-metadata')
+    assert snapshot.column('asset_id').to_pylist() == sorted(sitewise.assets)
@@ -0,0 +1,88 @@
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.unit.lambda_loader import load_lambda_module
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+pytest.importorskip('pyarrow')
+asset_metadata_lambda = load_lambda_module('asset_metadata', 'asset_metadata_lambda')
+
+LAST_UPDATE_DATE = datetime.datetime(2024, 1, 1)
+
+
+def asset_summary(asset_id, asset_model_id, hierarchy_ids=()):
+    return {
+        'id': asset_id,
+        'name': asset_id,
+        'assetModelId': asset_model_id,
+        'lastUpdateDate': LAST_UPDATE_DATE,
+        'hierarchies': [{'id': hierarchy_id, 'name': hierarchy_id} for hierarchy_id in hierarchy_ids],
+    }
+
+
+class FakeSiteWise(object):
+    """A vessel with engines, each with a sensor asset of another model."""
+
+    def __init__(self, num_engines):
+        self.children = {('vessel', 'Engines'): [asset_summary(f'engine{i}', 'engine_model', ['Sensors'])
+                                                 for i in range(num_engines)]}
+        for i in range(num_engines):
+            self.children[(f'engine{i}', 'Sensors')] = [asset_summary(f'engine{i}-sensor', 'sensor_model')]
+        self.described = []
+        self.threads = set()
+
+    def describe_asset(self, assetId):
+        self.threads.add(threading.get_ident())
+        self.described.append(assetId)
+        description = {
+            'assetId': assetId,
+            'assetName': assetId,
+            'assetModelId': 'vessel_model' if assetId == 'vessel' else 'engine_model',
+            'assetLastUpdateDate': LAST_UPDATE_DATE,
+            'assetHierarchies': [{'id': 'Engines', 'name': 'Engines'}] if assetId == 'vessel' else [],
+            'assetProperties': [{'id': f'{assetId}-property', 'name': 'Sensor0', 'dataType': 'DOUBLE'}],
+        }
+        return description
+
+    def list_associated_assets(self, assetId, hierarchyId, traversalDirection, maxResults, nextToken=None):
+        self.threads.add(threading.get_ident())
+        # Keeps the call running while the other workers start
+        time.sleep(0.01)
+        return {'assetSummaries': self.children[(assetId, hierarchyId)]}
+
+
+def test_hierarchy_assets_are_described_once(monkeypatch):
+    sitewise = FakeSiteWise(num_engines=3)
+    monkeypatch.setattr(asset_metadata_lambda, 'sitewise', sitewise)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assets = [asset for _, asset in asset_metadata_lambda.list_hierarchy_asset_generator(
+            executor, ['vessel'], ['vessel_model', 'engine_model'])]
+    assert sorted(asset['id'] for asset in assets) == ['engine0', 'engine1', 'engine2', 'vessel']
+
+    records = {}
+    for asset in assets:
+        records.update(asset_metadata_lambda.describe_asset_records(asset, 'crawl'))
+    assert sorted(sitewise.described) == ['engine0', 'engine1', 'engine2', 'vessel']
+    assert records['vessel']['records'][0]['asset_property_id'] == 'vessel-property'
+    assert records['engine1']['records'][0]['asset_property_id'] == 'engine1-property'
+
+
+def test_hierarchy_is_listed_by_the_workers_describing_assets(monkeypatch):
+    sitewise = FakeSiteWise(num_engines=8)
+    monkeypatch.setattr(asset_metadata_lambda, 'sitewise', sitewise)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [executor.submit(asset_metadata_lambda.describe_asset_records, asset, 'crawl')
+                   for _, asset in asset_metadata_lambda.list_hierarchy_asset_generator(executor, ['vessel'])]
+        records = {}
+        for future in futures:
+            records.update(future.result())
+    assert len(records) == 1 + 2 * 8
+    # The root asset is described on the listing thread, every other call on one of the workers
+    assert len(sitewise.threads - {threading.get_ident()}) <= 2
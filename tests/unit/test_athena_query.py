@@ -0,0 +1,58 @@
+import pytest
+
+from tests.unit.lambda_loader import load_lambda_module
+
+athena_query = load_lambda_module('inference_schedule', 'athena_query')
+
+
+class FakeAthena(object):
+    """An Athena client whose query runs through the states, one per get_query_execution."""
+
+    def __init__(self, states):
+        self.states = list(states)
+        self.polls = 0
+        self.stopped = []
+
+    def start_query_execution(self, **kwargs):
+        return {'QueryExecutionId': 'query'}
+
+    def get_query_execution(self, QueryExecutionId):
+        state = self.states[min(self.polls, len(self.states) - 1)]
+        self.polls += 1
+        return {'QueryExecution': {
+            'QueryExecutionId': QueryExecutionId,
+            'Status': {'State': state, 'StateChangeReason': 'reason'},
+        }}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(athena_query.time, 'sleep', fake_clock.sleep)
+    return fake_clock
+
+
+def test_polls_with_backoff_until_the_query_succeeds(clock):
+    client = FakeAthena(['QUEUED', 'RUNNING', 'RUNNING', 'SUCCEEDED'])
+    execution = athena_query.AthenaQuery(client, clock=clock).run(deadline=60, QueryString='SELECT 1')
+    assert execution['Status']['State'] == 'SUCCEEDED'
+    assert client.polls == 4
+    assert clock.now == pytest.approx(0.2 + 0.3 + 0.45)
+    assert client.stopped == []
+
+
+def test_failed_query_raises(clock):
+    client = FakeAthena(['RUNNING', 'FAILED'])
+    with pytest.raises(athena_query.QueryFailedError) as excinfo:
+        athena_query.AthenaQuery(client, clock=clock).run(QueryString='SELECT 1')
+    assert (excinfo.value.state, excinfo.value.reason) == ('FAILED', 'reason')
+
+
+def test_query_running_at_the_deadline_is_stopped(clock):
+    client = FakeAthena(['RUNNING'])
+    with pytest.raises(athena_query.QueryTimeoutError):
+        athena_query.AthenaQuery(client, clock=clock).run(deadline=10, QueryString='SELECT 1')
+    assert client.stopped == ['query']
+    assert clock.now < 10
@@ -0,0 +1,32 @@
+import json
+from types import SimpleNamespace
+
+import aws_cdk as cdk
+from aws_cdk.assertions import Template
+
+from lib.etl_pipeline import EtlPipeline
+
+
+def test_every_engine_asset_gets_an_l4e_bucket_and_inference():
+    app = cdk.App()
+    stack = cdk.Stack(app, 'EtlPipelineStack')
+    assets = SimpleNamespace(
+        engine_assets=[SimpleNamespace(ref=f'engine{i}') for i in range(3)],
+        vessel_asset=SimpleNamespace(ref='vessel'),
+        vessel_model_id='vessel_model',
+        engine_model_id='engine_model',
+    )
+    etl_pipeline = EtlPipeline(stack, 'EtlPipeline', assets=assets, property_list=['Sensor0'], prefix='etlpipeline')
+    template = Template.from_stack(stack)
+
+    bucket_names = [bucket['Properties'].get('BucketName') for bucket in template.find_resources('AWS::S3::Bucket').values()]
+    assert sorted(name for name in bucket_names if isinstance(name, str) and '-l4e-' in name) == \
+        [f'etlpipeline-l4e-bucket{i}' for i in range(3)]
+    assert len(etl_pipeline.l4e_to_sitewise_lambda_permissions) == 3
+    assert len(etl_pipeline.inference_schedule_lambda_permissions) == 3
+    rule, = template.find_resources('AWS::Events::Rule', {'Properties': {'Name': 'etlpipeline_inference_schedule_lambda_event_rule'}}).values()
+    # The input with the references it holds replaced by a placeholder
+    rule_input = json.loads(''.join(part if isinstance(part, str) else 'reference'
+                                    for part in rule['Properties']['Targets'][0]['Input']['Fn::Join'][1]))
+    assert [(asset['assetId'], asset['l4e_bucket']) for asset in rule_input['assets']] == [
+        (f'engine{i}', f'etlpipeline-l4e-bucket{i}') for i in range(3)]
@@ -0,0 +1,107 @@
+import datetime
+
+import pytest
+
+from benchmarks.inference_input import Body, csv_rows_match, get_inference_csv_with_pandas, make_result_csv
+from tests.unit.lambda_loader import load_lambda_module
+
+inference_data = load_lambda_module('inference_schedule', 'inference_data')
+
+RESULT_CSV = '''"Timestamp","Sensor0","Sensor1"
+"2024-01-01T12:02:10.000","3.0",""
+"2024-01-01T12:00:30.000","1.0","10.0"
+"2024-01-01T12:00:50.000","2.0",""
+"2024-01-01T12:03:59.000","",""
+'''
+
+
+def get_inference_csv(result_csv, minutes=5):
+    header, rows = inference_data.read_result_csv(Body(result_csv))
+    return inference_data.to_csv(*inference_data.get_inference_rows(header, rows, minutes))
+
+
+def test_inference_rows_are_filled_and_averaged_per_minute():
+    assert get_inference_csv(RESULT_CSV) == (
+        'Timestamp,Sensor0,Sensor1\n'
+        '2024-01-01T12:03:00.000000,3.0,10.0\n'
+        '2024-01-01T12:02:00.000000,3.0,10.0\n'
+        '2024-01-01T12:01:00.000000,,\n'
+        '2024-01-01T12:00:00.000000,1.5,10.0\n'
+    )
+
+
+def test_inference_rows_keep_the_last_minutes():
+    assert get_inference_csv(RESULT_CSV, minutes=2).splitlines()[1:] == [
+        '2024-01-01T12:03:00.000000,3.0,10.0',
+        '2024-01-01T12:02:00.000000,3.0,10.0',
+    ]
+
+
+def test_inference_rows_without_rows():
+    assert get_inference_csv('"Timestamp","Sensor0"\n') == 'Timestamp,Sensor0\n'
+
+
+def test_split_by_asset():
+    header, rows = inference_data.read_result_csv(Body(
+        '"Timestamp","asset_id","Sensor0"\n'
+        '"2024-01-01T12:00:00.000","engine0","1.0"\n'
+        '"2024-01-01T12:00:01.000","engine1","2.0"\n'
+        '"2024-01-01T12:00:02.000","engine0","3.0"\n'
+    ))
+    header, asset_rows = inference_data.split_by_asset(header, rows)
+    assert header == ['Timestamp', 'Sensor0']
+    assert asset_rows == {
+        'engine0': [['2024-01-01T12:00:00.000', '1.0'], ['2024-01-01T12:00:02.000', '3.0']],
+        'engine1': [['2024-01-01T12:00:01.000', '2.0']],
+    }
+
+
+def test_truncate_to_minute():
+    assert inference_data.truncate_to_minute(datetime.datetime(2024, 1, 1, 12, 3, 59, 999999)) == \
+        datetime.datetime(2024, 1, 1, 12, 3)
+
+
+@pytest.mark.parametrize('num_rows', [45, 360, 3600])
+def test_inference_csv_matches_pandas(num_rows):
+    pytest.importorskip('pandas')
+    result_csv = make_result_csv(num_rows, 30, seed=num_rows)
+    assert csv_rows_match(get_inference_csv(result_csv), get_inference_csv_with_pandas(result_csv))
+
+
+def window_rows(rows, first_minute, last_minute, last_values=None):
+    return inference_data.get_window_rows(['Timestamp', 'Sensor0', 'Sensor1'], rows, first_minute, last_minute, last_values)
+
+
+def test_window_rows_carry_the_fill_over_from_the_previous_window():
+    minute = datetime.datetime(2024, 1, 1, 12, 0)
+    rows = [['2024-01-01T12:00:10.000', '1.0', ''], ['2024-01-01T12:00:40.000', '', '5.0']]
+    header, output_rows, filled_values = window_rows(rows, minute, minute)
+    assert output_rows == [[minute, 1.0, 5.0]]
+    assert filled_values == {'Sensor0': 1.0, 'Sensor1': 5.0}
+
+    next_minute = minute + inference_data.ONE_MINUTE
+    rows = [['2024-01-01T12:01:30.000', '', '7.0'], ['2024-01-01T12:02:05.000', '3.0', '']]
+    header, output_rows, filled_values = window_rows(
+        rows, next_minute, next_minute + inference_data.ONE_MINUTE, filled_values)
+    assert header == ['Timestamp', 'Sensor0', 'Sensor1']
+    assert output_rows == [[next_minute + inference_data.ONE_MINUTE, 3.0, 7.0], [next_minute, 1.0, 7.0]]
+    assert filled_values == {'Sensor0': 3.0, 'Sensor1': 7.0}
+
+
+def test_window_rows_without_rows_keep_the_filled_values():
+    minute = datetime.datetime(2024, 1, 1, 12, 0)
+    header, output_rows, filled_values = window_rows([], minute, minute, {'Sensor0': 1.0})
+    assert output_rows == [[minute, None, None]]
+    assert filled_values == {'Sensor0': 1.0}
+
+
+def test_window_rows_fill_from_rows_before_the_window_and_drop_rows_after_it():
+    minute = datetime.datetime(2024, 1, 1, 12, 1)
+    rows = [
+        ['2024-01-01T12:00:30.000', '1.0', '2.0'],
+        ['2024-01-01T12:01:30.000', '', '4.0'],
+        ['2024-01-01T12:02:30.000', '8.0', '8.0'],
+    ]
+    header, output_rows, filled_values = window_rows(rows, minute, minute)
+    assert output_rows == [[minute, 1.0, 4.0]]
+    assert filled_values == {'Sensor0': 1.0, 'Sensor1': 4.0}
@@ -0,0 +1,189 @@
+import calendar
+import datetime
+import io
+
+import pytest
+
+from tests.unit.lambda_loader import load_lambda_module
+
+lambda_function = load_lambda_module('inference_schedule', 'lambda_function')
+watermark_store = load_lambda_module('inference_schedule', 'watermark_store')
+
+VIEW_QUERY = 'CREATE OR REPLACE VIEW l4e_view AS SELECT 1'
+RESULT_CSV = (
+    '"Timestamp","asset_id","Sensor0"\n'
+    '"2024-01-01T12:00:10.000","engine0","1.0"\n'
+    '"2024-01-01T12:01:10.000","engine1","2.0"\n'
+)
+LAST_MINUTE = datetime.datetime(2024, 1, 1, 12, 0)
+
+
+class FakeAWS(object):
+    """The Athena, Glue and S3 clients, with S3 objects in a dict."""
+
+    class exceptions(object):
+        class NoSuchKey(Exception):
+            pass
+
+        class EntityNotFoundException(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.queries = []
+        self.tables = set()
+        self.view_query = VIEW_QUERY
+
+    def get_named_query(self, NamedQueryId):
+        return {'NamedQuery': {'Name': 'l4e_view', 'QueryString': self.view_query}}
+
+    def start_query_execution(self, QueryString, **kwargs):
+        self.queries.append(QueryString)
+        if QueryString.startswith('CREATE'):
+            self.tables.add('l4e_view')
+        else:
+            self.objects[('results', 'q.csv')] = RESULT_CSV.encode('utf-8')
+        return {'QueryExecutionId': str(len(self.queries))}
+
+    def get_query_execution(self, QueryExecutionId):
+        return {'QueryExecution': {
+            'QueryExecutionId': QueryExecutionId,
+            'Status': {'State': 'SUCCEEDED'},
+            'ResultConfiguration': {'OutputLocation': 's3://results/q.csv'},
+        }}
+
+    def get_table(self, DatabaseName, Name):
+        if Name not in self.tables:
+            raise self.exceptions.EntityNotFoundException()
+        return {'Table': {'Name': Name}}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise self.exceptions.NoSuchKey()
+        return {'Body': FakeBody(self.objects[(Bucket, Key)]), 'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body.encode('utf-8') if isinstance(Body, str) else Body
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+
+class FakeBody(io.BytesIO):
+    def iter_lines(self):
+        return iter(self.getvalue().splitlines())
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    aws = FakeAWS()
+    monkeypatch.setattr(lambda_function.boto3, 'client', lambda service_name, **kwargs: aws)
+    return aws
+
+
+def view_event():
+    return {
+        'athena_output_bucket': 'data',
+        'view_query_id': 'view',
+        'database': 'database',
+        'work_group': 'work_group',
+        'assets': [
+            {'assetId': 'engine0', 'asset_name': 'engine', 'l4e_bucket': 'l4e0'},
+            {'assetId': 'engine1', 'asset_name': 'engine', 'l4e_bucket': 'l4e1'},
+        ],
+    }
+
+
+def create_view_queries(aws):
+    return [query for query in aws.queries if query.startswith('CREATE')]
+
+
+def test_view_is_created_once(aws):
+    lambda_function.lambda_handler(view_event(), None)
+    lambda_function.lambda_handler(view_event(), None)
+    assert create_view_queries(aws) == [VIEW_QUERY]
+    assert sorted((bucket, key.split('/')[0]) for bucket, key in aws.objects if bucket.startswith('l4e')) == [
+        ('l4e0', 'engine0'), ('l4e1', 'engine1')]
+
+
+def test_view_is_created_again_when_its_query_changes(aws):
+    lambda_function.lambda_handler(view_event(), None)
+    aws.view_query = 'CREATE OR REPLACE VIEW l4e_view AS SELECT 2'
+    lambda_function.lambda_handler(view_event(), None)
+    lambda_function.lambda_handler(view_event(), None)
+    assert create_view_queries(aws) == [VIEW_QUERY, 'CREATE OR REPLACE VIEW l4e_view AS SELECT 2']
+
+
+def test_view_is_created_again_when_it_was_dropped(aws):
+    lambda_function.lambda_handler(view_event(), None)
+    aws.tables.clear()
+    lambda_function.lambda_handler(view_event(), None)
+    assert create_view_queries(aws) == [VIEW_QUERY, VIEW_QUERY]
+
+
+def test_local_watermark_store(tmp_path):
+    store = watermark_store.LocalWatermarkStore(str(tmp_path / 'watermarks.json'))
+    assert store.load() == {}
+    watermarks = {'engine0': {'minute': 1704110400, 'values': {'Sensor0': 1.0}}}
+    store.save(watermarks)
+    assert watermark_store.LocalWatermarkStore(str(tmp_path / 'watermarks.json')).load() == watermarks
+
+
+def test_first_minute_without_watermark():
+    assert lambda_function.get_first_minute(None, LAST_MINUTE) == \
+        LAST_MINUTE - (lambda_function.INFERENCE_MINUTES - 1) * datetime.timedelta(minutes=1)
+
+
+def test_first_minute_follows_the_watermark():
+    watermark = {'minute': calendar.timegm((LAST_MINUTE - datetime.timedelta(minutes=3)).timetuple())}
+    assert lambda_function.get_first_minute(watermark, LAST_MINUTE) == LAST_MINUTE - datetime.timedelta(minutes=2)
+
+
+def test_first_minute_after_the_last_minute_when_up_to_date():
+    watermark = {'minute': calendar.timegm(LAST_MINUTE.timetuple())}
+    assert lambda_function.get_first_minute(watermark, LAST_MINUTE) > LAST_MINUTE
+
+
+def test_first_minute_of_a_watermark_far_behind():
+    watermark = {'minute': calendar.timegm((LAST_MINUTE - datetime.timedelta(days=1)).timetuple())}
+    assert lambda_function.get_first_minute(watermark, LAST_MINUTE) == \
+        LAST_MINUTE - (lambda_function.MAX_WINDOW_IN_MINUTES - 1) * datetime.timedelta(minutes=1)
+
+
+def test_partitions_predicate_of_a_window_within_an_hour():
+    assert lambda_function.get_partitions_predicate(
+        datetime.datetime(2024, 1, 1, 12, 10), datetime.datetime(2024, 1, 1, 12, 20)
+    ) == '''(("data"."dt" = '2024-01-01') AND ("data"."hour" = 12))'''
+
+
+def test_partitions_predicate_of_a_window_across_midnight():
+    assert lambda_function.get_partitions_predicate(
+        datetime.datetime(2024, 1, 1, 23, 50), datetime.datetime(2024, 1, 2, 0, 1)
+    ) == (
+        '''(("data"."dt" = '2024-01-01') AND ("data"."hour" = 23)) OR '''
+        '''(("data"."dt" = '2024-01-02') AND ("data"."hour" = 0))'''
+    )
+
+
+def test_partitions_predicate_of_a_window_ending_on_the_hour():
+    assert lambda_function.get_partitions_predicate(
+        datetime.datetime(2024, 1, 1, 11, 30), datetime.datetime(2024, 1, 1, 12, 0)
+    ) == '''(("data"."dt" = '2024-01-01') AND ("data"."hour" = 11))'''
+
+
+def test_partitions_predicate_of_a_window_starting_on_the_hour():
+    # Values from 00:00 on can be in a notification from 23:59 filed under the previous hour
+    assert lambda_function.get_partitions_predicate(
+        datetime.datetime(2024, 1, 2, 0, 0), datetime.datetime(2024, 1, 2, 0, 5)
+    ) == (
+        '''(("data"."dt" = '2024-01-01') AND ("data"."hour" = 23)) OR '''
+        '''(("data"."dt" = '2024-01-02') AND ("data"."hour" = 0))'''
+    )
+
+
+def test_partitions_predicate_of_a_window_starting_after_the_lookback():
+    assert lambda_function.get_partitions_predicate(
+        datetime.datetime(2024, 1, 1, 12, 1), datetime.datetime(2024, 1, 1, 12, 5)
+    ) == '''(("data"."dt" = '2024-01-01') AND ("data"."hour" = 12))'''
@@ -0,0 +1,64 @@
+import datetime
+import re
+
+import aws_cdk as cdk
+from aws_cdk.assertions import Template
+
+from lib import etl_pipeline
+from lib.l4e_setup import L4ESetup
+from tests.unit.lambda_loader import load_lambda_module
+
+lambda_function = load_lambda_module('inference_schedule', 'lambda_function')
+
+ONE_MINUTE = datetime.timedelta(minutes=1)
+UPLOAD_FREQUENCY = etl_pipeline.INFERENCE_UPLOAD_FREQUENCY_IN_MINUTES * ONE_MINUTE
+
+
+def write_times(first_run, num_runs):
+    """Returns the time each inference input file of a run of the fleet rule is written, by its name."""
+    grace_period = etl_pipeline.INFERENCE_GRACE_PERIOD_IN_MINUTES * ONE_MINUTE
+    timeout = datetime.timedelta(seconds=etl_pipeline.INFERENCE_SCHEDULE_TIMEOUT_IN_SECONDS)
+    watermark = None
+    files = {}
+    for run in range(num_runs):
+        now = first_run + run * UPLOAD_FREQUENCY
+        last_minute = lambda_function.get_last_minute(now, grace_period)
+        first_minute = lambda_function.get_first_minute(watermark, last_minute)
+        if first_minute <= last_minute:
+            files[first_minute] = now + timeout
+            watermark = {'minute': (last_minute - datetime.datetime(1970, 1, 1)) // datetime.timedelta(seconds=1)}
+    return files
+
+
+def test_default_grace_period_is_the_stack_grace_period():
+    assert lambda_function.GRACE_PERIOD_IN_MINUTES == etl_pipeline.INFERENCE_GRACE_PERIOD_IN_MINUTES
+
+
+def test_input_files_are_written_before_the_scheduler_reads_them():
+    delay_offset = etl_pipeline.INFERENCE_DATA_DELAY_OFFSET_IN_MINUTES * ONE_MINUTE
+    assert delay_offset <= 60 * ONE_MINUTE
+    for phase_in_seconds in range(0, 5 * 60, 7):
+        files = write_times(datetime.datetime(2024, 1, 1, 12, 0) + datetime.timedelta(seconds=phase_in_seconds), 24)
+        # The upload periods from the first file on, L4E reading each at its end plus the offset
+        upload_period = datetime.datetime(2024, 1, 1, 12, 0) - 30 * ONE_MINUTE
+        while upload_period + UPLOAD_FREQUENCY <= max(files):
+            names = [name for name in files if upload_period <= name < upload_period + UPLOAD_FREQUENCY]
+            if upload_period >= min(files):
+                assert len(names) == 1
+            for name in names:
+                assert files[name] <= upload_period + UPLOAD_FREQUENCY + delay_offset
+            upload_period += UPLOAD_FREQUENCY
+
+
+def test_scheduler_uses_the_inference_timing():
+    app = cdk.App()
+    stack = cdk.Stack(app, 'L4ESetupStack')
+    asset_data = [{'asset_id': 'engine0', 'data_path': 'data/EngineAsset0.txt'},
+                  {'asset_id': 'engine1', 'data_path': 'data/EngineAsset1.txt'}]
+    L4ESetup(stack, 'L4ETrain', ['Sensor0'], asset_data, prefix='l4etrain')
+    state_machine, = Template.from_stack(stack).find_resources('AWS::StepFunctions::StateMachine').values()
+    # The definition joined without the references it holds
+    definition = ''.join(part for part in state_machine['Properties']['DefinitionString']['Fn::Join'][1]
+                         if isinstance(part, str))
+    assert re.findall(r'"DataDelayOffsetInMinutes":(\d+)', definition) == [str(etl_pipeline.INFERENCE_DATA_DELAY_OFFSET_IN_MINUTES)]
+    assert re.findall(r'"DataUploadFrequency":"(\w+)"', definition) == [f'PT{etl_pipeline.INFERENCE_UPLOAD_FREQUENCY_IN_MINUTES}M']
@@ -0,0 +1,69 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+from tests.unit.lambda_loader import load_lambda_module
+
+index = load_lambda_module('ingest_data', 'index')
+
+ASSETS = [{'asset_id': f'asset{i}', 'properties': [f'Sensor{j}' for j in range(30)]} for i in range(2)]
+START_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_estimate_backfill_seconds_per_minute():
+    # 60 properties of 6 entries per minute, in requests of 10 entries at 10 requests per second
+    assert index.estimate_backfill_seconds_per_minute(ASSETS) == 3.6
+
+
+def test_get_backfill_chunk_duration():
+    assert index.get_backfill_chunk_duration(90000, 3.6) == timedelta(minutes=10)
+    assert index.get_backfill_chunk_duration(40000, 3.6) == timedelta(minutes=6)
+    assert index.get_backfill_chunk_duration(18000, 3.6) is None
+
+
+def test_backfill_chunks_end_before_the_timeout(monkeypatch, fake_clock, lambda_context):
+    clock = fake_clock
+    context = lambda_context(90)
+    chunks = []
+
+    def put_all_data(assets, cursor, base_offset, num_entries_needed, send_batch):
+        # Twice as slow as the request rate, as when SiteWise throttles
+        chunks.append((cursor, base_offset, num_entries_needed))
+        clock.now += num_entries_needed * index.NUM_VALUES_PER_ENTRY / 60 * 7.2
+        assert context.get_remaining_time_in_millis() > 0
+
+    monkeypatch.setattr(index, 'put_all_data', put_all_data)
+    monkeypatch.setattr(index.time, 'monotonic', clock)
+    result = index.backfill(ASSETS, START_TIME, START_TIME + timedelta(hours=1), START_TIME, context)
+
+    assert not result['complete']
+    assert context.get_remaining_time_in_millis() > 0
+    # Every chunk starts at the minute of the replay its cursor is at
+    cursor = START_TIME
+    for chunk_cursor, base_offset, num_entries_needed in chunks:
+        assert chunk_cursor == cursor
+        assert base_offset == (cursor - START_TIME) // timedelta(minutes=1)
+        cursor += timedelta(seconds=num_entries_needed * index.NUM_VALUES_PER_ENTRY)
+    assert result['cursor'] == cursor.isoformat()
+
+
+def test_backfill_completes_short_ranges(monkeypatch, fake_clock, lambda_context):
+    monkeypatch.setattr(index, 'put_all_data', lambda *args, **kwargs: None)
+    monkeypatch.setattr(index.time, 'monotonic', fake_clock)
+    end_time = START_TIME + timedelta(minutes=3)
+    result = index.backfill(ASSETS, START_TIME, end_time, START_TIME, lambda_context(90))
+    assert result == {'cursor': end_time.isoformat(), 'complete': True}
+
+
+def test_backfill_checkpoint_needs_a_bucket_and_a_key(monkeypatch, lambda_context):
+    def put_all_data(*args, **kwargs):
+        raise AssertionError('Data sent without a checkpoint to save it in')
+
+    monkeypatch.setattr(index, 'put_all_data', put_all_data)
+    event = {'mode': index.BACKFILL_MODE, 'assets': ASSETS, 'checkpoint_bucket': 'bucket',
+             'start_time': START_TIME.isoformat(), 'end_time': (START_TIME + timedelta(hours=1)).isoformat()}
+    with pytest.raises(ValueError):
+        index.handler(event, lambda_context(90))
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_loader import load_lambda_module
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+quota_coordinator = load_lambda_module('ingest_data', 'quota_coordinator')
+
+
+class CountingBackend(quota_coordinator.LocalQuotaBackend):
+    def __init__(self):
+        super().__init__()
+        self.leases = []
+
+    def lease(self, api, window, limit, tokens):
+        granted = super().lease(api, window, limit, tokens)
+        self.leases.append((api, window, tokens, granted))
+        return granted
+
+
+class FakeDynamoDB(object):
+    """A DynamoDB client evaluating the conditional update of the quota backend on one counter per key."""
+
+    def __init__(self):
+        self.used = {}
+        self.updates = []
+
+    def update_item(self, TableName, Key, ExpressionAttributeValues, **kwargs):
+        tokens = int(ExpressionAttributeValues[':tokens']['N'])
+        max_used = int(ExpressionAttributeValues[':max_used']['N'])
+        self.updates.append(tokens)
+        used = self.used.get(Key['pk']['S'])
+        if used is not None and used > max_used:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+        self.used[Key['pk']['S']] = (used or 0) + tokens
+
+
+def coordinator(backend, clock, **kwargs):
+    return quota_coordinator.QuotaCoordinator(backend, {'DescribeAsset': 4}, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def test_leases_are_used_up_before_leasing_again(fake_clock):
+    backend = CountingBackend()
+    quotas = coordinator(backend, fake_clock, lease_size=2)
+    for _ in range(4):
+        quotas.acquire('DescribeAsset')
+    assert backend.leases == [('DescribeAsset', 0, 2, 2), ('DescribeAsset', 0, 2, 2)]
+    assert fake_clock.sleeps == []
+
+
+def test_exhausted_quota_waits_for_the_next_window(fake_clock):
+    fake_clock.now = 0.25
+    backend = CountingBackend()
+    # Two containers sharing the quota of 4 calls per second
+    containers = [coordinator(backend, fake_clock, lease_size=2) for _ in range(2)]
+    for container in containers:
+        container.acquire('DescribeAsset')
+        container.acquire('DescribeAsset')
+    containers[0].acquire('DescribeAsset')
+    assert fake_clock.sleeps == [pytest.approx(0.75)]
+    assert backend.leases[-2:] == [('DescribeAsset', 0, 2, 0), ('DescribeAsset', 1, 2, 2)]
+
+
+def test_leases_of_a_past_window_are_not_used(fake_clock):
+    backend = CountingBackend()
+    quotas = coordinator(backend, fake_clock, lease_size=4)
+    quotas.acquire('DescribeAsset')
+    fake_clock.now = 1.5
+    quotas.acquire('DescribeAsset')
+    assert [window for _, window, _, _ in backend.leases] == [0, 1]
+    assert fake_clock.sleeps == []
+
+
+def test_limit_decorator_acquires_before_every_call(fake_clock):
+    backend = CountingBackend()
+    quotas = coordinator(backend, fake_clock)
+
+    @quotas.limit('DescribeAsset')
+    def describe_asset(asset_id):
+        return asset_id
+
+    assert [describe_asset(i) for i in range(5)] == list(range(5))
+    assert [granted for _, _, _, granted in backend.leases] == [1, 1, 1, 1, 0, 1]
+    assert fake_clock.now == pytest.approx(1.0)
+
+
+def test_dynamodb_lease_halves_on_conditional_check_failure():
+    client = FakeDynamoDB()
+    backend = quota_coordinator.DynamoDBQuotaBackend('quotas', client=client)
+    assert backend.lease('DescribeAsset', 0, 10, 8) == 8
+    # 2 tokens left, leases of 8 and 4 fail
+    assert backend.lease('DescribeAsset', 0, 10, 8) == 2
+    assert client.updates == [8, 8, 4, 2]
+    assert backend.lease('DescribeAsset', 0, 10, 8) == 0
+    assert client.updates[4:] == [8, 4, 2, 1]
+    assert client.used == {'DescribeAsset#0': 10}
@@ -0,0 +1,30 @@
+import io
+import json
+
+import numpy as np
+import pytest
+
+from lib.replay_dataset import write_replay_dataset
+from tests.unit.lambda_loader import load_lambda_module
+
+replay_dataset = load_lambda_module('ingest_data', 'replay_dataset')
+
+
+def write_dataset(tmp_path, asset_data):
+    asset_data_path = tmp_path / 'asset.txt'
+    asset_data_path.write_text(json.dumps(asset_data))
+    return write_replay_dataset(str(asset_data_path), str(tmp_path / 'asset.bin'))
+
+
+def test_load_replay_dataset_decodes_every_sensor(tmp_path):
+    asset_data = {'Sensor0': [1.5, 2.5, 3.5], 'Sensor1': [-1.0, 0.25], 'Sensor2': [42.0]}
+    with open(write_dataset(tmp_path, asset_data), 'rb') as f:
+        sensors = replay_dataset.load_replay_dataset(f)
+    assert sensors.keys() == asset_data.keys()
+    for sensor_name, values in asset_data.items():
+        np.testing.assert_array_equal(sensors[sensor_name], np.array(values, dtype=np.float32))
+
+
+def test_load_replay_dataset_rejects_other_files():
+    with pytest.raises(ValueError):
+        replay_dataset.load_replay_dataset(io.BytesIO(b'{"Sensor0": [1.0]}'))
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_loader import load_lambda_module
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+retry_policy = load_lambda_module('asset_metadata', 'retry_policy')
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code}}, 'Operation')
+
+
+def failing(errors):
+    calls = []
+
+    def call():
+        calls.append(None)
+        if errors:
+            raise errors.pop(0)
+        return 'done'
+    return call, calls
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(retry_policy.time, 'sleep', fake_clock.sleep)
+    return fake_clock
+
+
+def is_throttling(exception):
+    return isinstance(exception, ClientError) and exception.response['Error']['Code'] == 'ThrottlingException'
+
+
+def test_retries_retryable_errors(clock):
+    policy = retry_policy.RetryPolicy(is_throttling, clock=clock)
+    call, calls = failing([client_error('ThrottlingException')] * 3)
+    assert policy(call)() == 'done'
+    assert len(calls) == 4
+
+
+def test_raises_other_errors(clock):
+    policy = retry_policy.RetryPolicy(is_throttling, clock=clock)
+    call, calls = failing([client_error('ValidationException')])
+    with pytest.raises(ClientError):
+        policy(call)()
+    assert len(calls) == 1
+
+
+def test_gives_up_at_the_deadline(clock, lambda_context):
+    policy = retry_policy.RetryPolicy(is_throttling, clock=clock)
+    policy.set_deadline(lambda_context(30), 30)
+    call, calls = failing([client_error('ThrottlingException')])
+    with pytest.raises(retry_policy.DeadlineExceededError):
+        policy(call)()
+    assert len(calls) == 1
+
+
+def test_metadata_writes_retry_past_the_crawl_deadline(clock, monkeypatch):
+    pytest.importorskip('pyarrow')
+    asset_metadata_lambda = load_lambda_module('asset_metadata', 'asset_metadata_lambda')
+    # 20 seconds left, inside the checkpoint margin the crawl is over but the writes still retry
+    for policy, margin_in_seconds in ((asset_metadata_lambda.retry_policy, asset_metadata_lambda.CHECKPOINT_MARGIN_IN_SECONDS),
+                                      (asset_metadata_lambda.write_retry_policy, asset_metadata_lambda.WRITE_MARGIN_IN_SECONDS)):
+        monkeypatch.setattr(policy, '_clock', clock)
+        monkeypatch.setattr(policy, 'deadline', clock.now + 20 - margin_in_seconds)
+    put_object, calls = failing([client_error('SlowDown'), client_error('503')])
+    monkeypatch.setattr(asset_metadata_lambda.s3, 'put_object', lambda **kwargs: put_object())
+    asset_metadata_lambda.put_object_to_s3('bucket', 'checkpoint.json', '{}')
+    assert len(calls) == 3
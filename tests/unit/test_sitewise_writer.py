@@ -0,0 +1,110 @@
+import filecmp
+import logging
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.lambda_loader import LAMBDA_ROOT, load_lambda_module
+
+sitewise_writer = load_lambda_module('ingest_data', 'sitewise_writer')
+
+
+def property_value(time_in_seconds, value):
+    return {'value': {'doubleValue': value}, 'timestamp': {'timeInSeconds': time_in_seconds, 'offsetInNanos': 0},
+            'quality': 'GOOD'}
+
+
+def entry(entry_id, num_values=3):
+    return {'entryId': entry_id, 'assetId': 'asset', 'propertyId': f'property{entry_id}',
+            'propertyValues': [property_value(1700000000 + i, float(i)) for i in range(num_values)]}
+
+
+def error_entry(entry_id, error_code, times_in_seconds):
+    return {'entryId': entry_id, 'errors': [{
+        'errorCode': error_code,
+        'errorMessage': error_code,
+        'timestamps': [{'timeInSeconds': time_in_seconds, 'offsetInNanos': 0} for time_in_seconds in times_in_seconds],
+    }]}
+
+
+class FakeSend(object):
+    """Returns the responses in turn, recording the entries of every attempt."""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.attempts = []
+
+    def __call__(self, entries):
+        self.attempts.append(entries)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(sitewise_writer.time, 'sleep', fake_clock.sleep)
+    return fake_clock
+
+
+def times(entry):
+    return [property_value['timestamp']['timeInSeconds'] for property_value in entry['propertyValues']]
+
+
+def test_copies_are_identical():
+    assert filecmp.cmp(os.path.join(LAMBDA_ROOT, 'ingest_data', 'sitewise_writer.py'),
+                       os.path.join(LAMBDA_ROOT, 'l4e_to_sitewise', 'sitewise_writer.py'), shallow=False)
+
+
+def test_retries_only_the_throttled_values(clock):
+    send = FakeSend([
+        {'errorEntries': [error_entry('1', 'ThrottlingException', [1700000001])]},
+        {'errorEntries': []},
+    ])
+    assert sitewise_writer.put_asset_property_values(send, [entry('0'), entry('1')]) == []
+    assert [e['entryId'] for e in send.attempts[1]] == ['1']
+    assert times(send.attempts[1][0]) == [1700000001]
+    assert len(clock.sleeps) == 1
+
+
+def test_reports_values_rejected_without_retrying_them(clock, caplog):
+    send = FakeSend([
+        {'errorEntries': [{'entryId': '0', 'errors': [
+            {'errorCode': 'InvalidRequestException', 'errorMessage': 'Out of range', 'timestamps': [
+                {'timeInSeconds': 1700000000, 'offsetInNanos': 0}]},
+            {'errorCode': 'ServiceUnavailableException', 'timestamps': [
+                {'timeInSeconds': 1700000002, 'offsetInNanos': 0}]},
+        ]}]},
+        {'errorEntries': []},
+    ])
+    with caplog.at_level(logging.ERROR):
+        rejected = sitewise_writer.put_asset_property_values(send, [entry('0')])
+    assert rejected == [{
+        'entryId': '0', 'assetId': 'asset', 'propertyId': 'property0', 'propertyAlias': None,
+        'errorCode': 'InvalidRequestException', 'errorMessage': 'Out of range', 'timestamps': [(1700000000, 0)],
+    }]
+    assert times(send.attempts[1][0]) == [1700000002]
+    assert 'Rejected entry 0 of asset asset property property0: InvalidRequestException Out of range' in caplog.text
+
+
+def test_values_still_failing_at_the_last_attempt_are_rejected(clock):
+    throttled = {'errorEntries': [error_entry('0', 'ThrottlingException', [1700000000])]}
+    send = FakeSend([throttled] * 3)
+    rejected = sitewise_writer.put_asset_property_values(send, [entry('0')], max_attempts=3)
+    assert [r['errorCode'] for r in rejected] == ['ThrottlingException']
+    assert len(send.attempts) == 3
+
+
+def test_retries_the_whole_request_on_retryable_client_errors(clock):
+    send = FakeSend([ClientError({'Error': {'Code': 'ThrottlingException'}}, 'BatchPutAssetPropertyValue'), {}])
+    assert sitewise_writer.put_asset_property_values(send, [entry('0'), entry('1')]) == []
+    assert send.attempts[0] == send.attempts[1]
+
+
+def test_raises_other_client_errors(clock):
+    send = FakeSend([ClientError({'Error': {'Code': 'AccessDeniedException'}}, 'BatchPutAssetPropertyValue')])
+    with pytest.raises(ClientError):
+        sitewise_writer.put_asset_property_values(send, [entry('0')])
+    assert clock.sleeps == []
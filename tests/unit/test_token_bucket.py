@@ -0,0 +1,65 @@
+import asyncio
+import filecmp
+import os
+
+import pytest
+
+from tests.unit.lambda_loader import LAMBDA_ROOT, load_lambda_module
+
+token_bucket = load_lambda_module('ingest_data', 'token_bucket')
+
+
+@pytest.fixture
+def clock(fake_clock, monkeypatch):
+    monkeypatch.setattr(token_bucket.time, 'sleep', fake_clock.sleep)
+    return fake_clock
+
+
+def test_copies_are_identical():
+    assert filecmp.cmp(os.path.join(LAMBDA_ROOT, 'ingest_data', 'token_bucket.py'),
+                       os.path.join(LAMBDA_ROOT, 'asset_metadata', 'token_bucket.py'), shallow=False)
+
+
+def test_bursts_up_to_capacity_then_paces_at_rate(clock):
+    bucket = token_bucket.TokenBucket(rate=10, capacity=5, clock=clock)
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.sleeps == []
+    for _ in range(10):
+        bucket.acquire()
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_acquire_gives_up_past_timeout(clock):
+    bucket = token_bucket.TokenBucket(rate=1, capacity=1, clock=clock)
+    assert bucket.acquire(timeout=0)
+    assert not bucket.acquire(timeout=0.5)
+    assert clock.sleeps == []
+    assert bucket.acquire(timeout=1)
+    assert clock.now == pytest.approx(1.0)
+
+
+def test_set_rate_keeps_tokens_within_capacity(clock):
+    bucket = token_bucket.TokenBucket(rate=100, clock=clock)
+    bucket.set_rate(2)
+    assert bucket.capacity == 2
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_invalid_rates_are_rejected():
+    with pytest.raises(ValueError):
+        token_bucket.TokenBucket(rate=0)
+    with pytest.raises(ValueError):
+        token_bucket.TokenBucket(rate=1, capacity=0.5)
+
+
+def test_decorates_coroutine_functions():
+    bucket = token_bucket.TokenBucket(rate=1000)
+
+    @bucket
+    async def call():
+        return 'called'
+
+    assert asyncio.run(call()) == 'called'
@@ -0,0 +1,80 @@
+import base64
+import json
+
+import pytest
+
+from benchmarks.transform_json_data import make_batch, transform_with_dicts
+from tests.unit.lambda_loader import load_lambda_module
+
+transform = load_lambda_module('transform_json_data', 'index')
+
+
+def notification(values, asset_id='asset', property_id='property'):
+    return {
+        'type': 'PropertyValueUpdate',
+        'payload': {'assetId': asset_id, 'propertyId': property_id, 'values': values},
+    }
+
+
+def property_value(value, time_in_seconds=1700000000, offset_in_nanos=0, quality='GOOD'):
+    return {
+        'timestamp': {'timeInSeconds': time_in_seconds, 'offsetInNanos': offset_in_nanos},
+        'quality': quality,
+        'value': value,
+    }
+
+
+def transform_record(data):
+    event = {'records': [{'recordId': '0', 'data': base64.b64encode(json.dumps(data).encode('utf-8')).decode('ascii')}]}
+    record, = transform.handler(event, None)['records']
+    return record
+
+
+@pytest.mark.parametrize('values_per_record', [1, 10])
+def test_rows_match_json_dumps_of_dicts(values_per_record):
+    for record in make_batch(64 * 1024, values_per_record)['records']:
+        data = json.loads(base64.b64decode(record['data']))
+        buffer = []
+        transform.write_rows(data, buffer)
+        assert ''.join(buffer) == transform_with_dicts(data)
+
+
+@pytest.mark.parametrize('value', [
+    {'doubleValue': 1.5},
+    {'integerValue': 7},
+    {'booleanValue': True},
+    {'stringValue': 'café "quoted"'},
+    {'doubleValue': 1.5, 'stringValue': 'both'},
+])
+def test_value_types(value):
+    data = notification([property_value(value, quality='UNCERTAIN'), property_value(value, offset_in_nanos=5)])
+    record = transform_record(data)
+    assert record['result'] == 'Ok'
+    assert base64.b64decode(record['data']).decode('utf-8') == transform_with_dicts(data)
+
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+def test_non_finite_doubles_are_null(value):
+    data = notification([property_value({'doubleValue': value})])
+    row = json.loads(base64.b64decode(transform_record(data)['data']))
+    assert row['asset_property_double_value'] is None
+    assert row['asset_property_data_type'] == 'double'
+
+
+def test_values_after_one_without_value_are_dropped():
+    data = notification([property_value({'doubleValue': 1.0}), property_value({}), property_value({'doubleValue': 2.0})])
+    rows = base64.b64decode(transform_record(data)['data']).decode('utf-8').split('\n')
+    assert [json.loads(row)['asset_property_double_value'] for row in rows] == [1.0]
+
+
+def test_partition_keys():
+    data = notification([property_value({'doubleValue': 1.0}, time_in_seconds=1700000000)], asset_id='engine0')
+    assert transform_record(data)['metadata']['partitionKeys'] == {'asset_id': 'engine0', 'dt': '2023-11-14', 'hour': '22'}
+
+
+def test_partition_keys_without_values_use_arrival_time(monkeypatch):
+    monkeypatch.setattr(transform.time, 'time', lambda: 1700000000.5)
+    data = notification([], asset_id='engine1')
+    record = transform_record(data)
+    assert record['data'] == ''
+    assert record['metadata']['partitionKeys'] == {'asset_id': 'engine1', 'dt': '2023-11-14', 'hour': '22'}